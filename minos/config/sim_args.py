@@ -42,11 +42,57 @@ def add_sim_args(parser):
                         help='Simulator server host')
     parser.add_argument('--port', type=int,
                         help='Simulator server port')
+    parser.add_argument('--port_range',
+                        help='Range of ports (start-end) to allocate simulator server ports from (OS assigned if not set)')
     parser.add_argument('--busywait', type=int,
                         default=0,
                         help='Number of seconds for simulator server to busywait (test busy server)')
+    parser.add_argument('--server_pool',
+                        action='store_true',
+                        default=False,
+                        help='Lease warm simulator servers from a pool (reused across simulators of a process)')
+    parser.add_argument('--server_pool_max_rss_mb', type=float,
+                        help='Stop pooled simulator servers using more memory than this when released')
+    parser.add_argument('--server_pool_max_leases', type=int,
+                        help='Stop pooled simulator servers after they have been leased this many times')
+    parser.add_argument('--server_start_timeout', type=float,
+                        default=60,
+                        help='Number of seconds to wait for simulator servers to start listening')
     parser.add_argument('--ping_timeout', type=int,
                         help='Number of seconds between ping/pong before client timeout')
+    parser.add_argument('--decode_mode',
+                        choices=['walk', 'schema'],
+                        help='How to find arrays in responses (walk whole response or use observation metadata)')
+    parser.add_argument('--observation_cache_mb', type=float,
+                        help='Cache sensor frames by agent pose in this many MB so steps predicted to revisit a '
+                             'pose do not send its frames again')
+    parser.add_argument('--observation_cache_position_resolution', type=float,
+                        help='Agent positions within this distance (in meters) share cached frames (default 0.01)')
+    parser.add_argument('--observation_cache_angle_resolution', type=float,
+                        help='Agent angles and tilts within this angle (in radians) share cached frames '
+                             '(default 1 degree)')
+    parser.add_argument('--latency_log_interval', type=float,
+                        default=60,
+                        help='Number of seconds between logging rpc latency histograms (0 to only log at exit)')
+    parser.add_argument('--sim_server',
+                        choices=['node', 'mock'],
+                        help='Simulator server to run (node server.js or python mock with synthetic observations, '
+                             'which sends frames through shared memory)')
+    parser.add_argument('--mock_latency', type=float,
+                        help='Seconds the mock simulator server delays responses by')
+    parser.add_argument('--mock_jitter', type=float,
+                        help='Fraction of mock latency to randomly add or subtract')
+    parser.add_argument('--mock_payload_bytes', type=int,
+                        help='Size of extra payload frame in mock simulator observations')
+    parser.add_argument('--mock_capabilities',
+                        help='Comma separated optional events the mock simulator server handles (default all), '
+                             'others are not answered like by older servers (include get_capabilities to answer it, '
+                             'and set_transport for the shared memory transport the mock needs)')
+    parser.add_argument('--transport',
+                        choices=['socket', 'shm'],
+                        help='How sensor frames are sent from the simulator server (socket or shared memory)')
+    parser.add_argument('--navmap_cache_dir',
+                        help='Directory to cache computed navigation maps in')
     parser.add_argument('--width', type=int,
                         default=256,
                         help='Image width')
@@ -132,6 +178,18 @@ def add_sim_args(parser):
                         nargs='?', const='True',
                         type=str2bool,
                         help='Whether to write out png sequence')
+    parser.add_argument('--save_png_backlog', type=int,
+                        default=64,
+                        help='Number of sensor dumps (with save_png) that can wait to be written in the background')
+    parser.add_argument('--save_png_policy',
+                        choices=['drop', 'block'],
+                        default='drop',
+                        help='Whether to drop sensor dumps or wait when the background writer falls behind')
+    parser.add_argument('--record_trajectories',
+                        help='Directory to record episodes to (as compressed npz shards with index)')
+    parser.add_argument('--observation_store',
+                        help='Directory with precomputed observation stores of scenes to serve gridworld episodes '
+                             'from instead of a simulation server (see minos.tools.build_observation_store)')
     parser.add_argument('--debug',
                         nargs='?', const='True',
                         type=str2bool,
@@ -200,6 +258,17 @@ def parse_sim_args(parser):
     for s in args.sensors:
         args.observations[s] = True
     args.collision_detection = {'mode': args.collision_mode}
+    if args.transport:
+        args.transport = {'type': args.transport}
+    if args.server_pool:
+        args.server_pool = {'max_rss_mb': args.server_pool_max_rss_mb, 'max_leases': args.server_pool_max_leases}
+    if args.record_trajectories:
+        args.record_trajectories = {'path': args.record_trajectories}
+    if args.sim_server == 'mock':
+        args.mock = {'latency': args.mock_latency, 'jitter': args.mock_jitter,
+                     'payload_bytes': args.mock_payload_bytes,
+                     'capabilities': [e for e in args.mock_capabilities.split(',') if e]
+                     if args.mock_capabilities is not None else None}
     if args.add_object_at_goal:
         # print('add object at goal')
         args.modifications = [{
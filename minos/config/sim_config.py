@@ -53,7 +53,10 @@ sim_defaults = {
     'scenes_file': '../data/scenes.multiroom.csv',
     'states_file': '../data/episode_states.suncg.csv.bz2',
     'roomtypes_file': '../data/roomTypes.suncg.csv',
-    'num_episodes_per_restart': 1000,
+    'num_episodes_per_restart': 0,  # restart servers after this many episodes (0 to only restart on resource_limits)
+    # restart servers when they use more memory (in MB) than this (checked at most every check_interval secs)
+    'resource_limits': {'sim_rss_mb': 6144, 'sim_heap_mb': 3584, 'audio_rss_mb': 4096, 'check_interval': 30},
+    'scene_cache': {'size': 0, 'max_memory_mb': 3072},  # number of upcoming scenes to preload (0 to disable)
     'num_episodes_per_scene': 10,
     'max_states_per_scene': 1,
     'episodes_per_scene_test': 1,  # DFP param
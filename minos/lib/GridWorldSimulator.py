@@ -0,0 +1,283 @@
+import collections
+import copy
+import math
+import os
+import random
+import time
+from timeit import default_timer as timer
+
+import numpy as np
+
+from .Simulator import Simulator, create_depth_noise_sim, load_sensor_configs
+from .util.LabelMapping import LabelMapping
+from .util.LatencyStats import LatencyStats
+from .util.ObservationStore import ObservationStore, MOVES, STORE_FILE, TURNS
+
+
+class GridWorldSimulator:
+    """Provides Simulator interface for gridworld agents served from precomputed observation stores
+
+    Observations are looked up in the observation store of the current scene (built with
+    minos.tools.build_observation_store, one store per scene id under the observation_store directory)
+    instead of being rendered by a simulation server.  Agents move between cells of the store lattice and
+    turn between its headings: move actions move one cell (or collide if the target cell is not reachable)
+    and turn actions turn one heading.  Measurements (distance and direction to goal, and shortest path
+    distance over the lattice) are computed from the agent cell.  Stores are memory mapped and cached, so
+    simulators in the same process or on the same machine share frames.  Depth frames are stored without
+    noise, and noise is simulated for depth sensors with noise enabled every time frames are looked up.
+    """
+    _stores = {}  # shared by simulators in the same process
+
+    def __init__(self, params):
+        self.params = params
+        self.id = params.get('id', 'sim00')
+        self.store_dir = params['observation_store']
+        if params.get('roomtypes_file') is not None:
+            self.roomTypes = LabelMapping(params['roomtypes_file'], 'roomType', 0)
+        else:
+            self.roomTypes = None
+        self.latency_stats = LatencyStats()
+        self.rng = random.Random()
+        self._depth_noise_sims = {}  # depth sensor name to noise simulator
+        for sensor in load_sensor_configs(params):
+            if sensor.get('type') == 'depth' and sensor.get('noise'):
+                if sensor.get('noise_model') is None:
+                    raise Exception('noise_model not specified for sensor ' + sensor['name'])
+                self._depth_noise_sims[sensor['name']] = create_depth_noise_sim(sensor['noise_model'])
+        self._config = {'scene': copy.deepcopy(params.get('scene') or {}), 'start': None,
+                        'goal': copy.deepcopy(params.get('goal'))}
+        self.store = None
+        self.cell = None
+        self.heading = None
+        self.time = 0.0
+        self.goal = None
+        self._goal_cells = None
+        self._goal_distances = None
+        self._last_observation = None
+        self.start_summary_info = None
+        self.start_time = None
+        self.running = False
+        self.killed = False
+
+    def _get_store(self, scene_id):
+        path = os.path.join(self.store_dir, scene_id)
+        if path not in GridWorldSimulator._stores:
+            if not os.path.isfile(os.path.join(path, STORE_FILE)):
+                raise FileNotFoundError('No observation store for scene %s in %s (see minos.tools.build_observation_store)'
+                                        % (scene_id, self.store_dir))
+            GridWorldSimulator._stores[path] = ObservationStore(path)
+        return GridWorldSimulator._stores[path]
+
+    def init(self):
+        """Initializes the simulation. Returns success."""
+        return True
+
+    def close(self, seconds=None):
+        """Stops the simulation. Returns success."""
+        self.start_summary_info = None
+        self.running = False
+        return True
+
+    def kill(self):
+        self.running = False
+        self.killed = True
+
+    def restart_child_servers(self, randomize_ports=False, seconds=None):
+        return True
+
+    def needs_recycle(self):
+        return False
+
+    def seed(self, s):
+        """Sets the random number seed for the simulator. Returns success."""
+        self.rng.seed(s)
+        return True
+
+    def configure(self, config):
+        """Sets the simulator configuration. Returns success."""
+        for k, v in (config or {}).items():
+            if k == 'scene':
+                self._config['scene'].update(v)
+            else:
+                self._config[k] = v
+        return True
+
+    def prefetch_scenes(self, scene_ids):
+        """Opens observation stores of scenes.  Returns ids of scenes with stores."""
+        prefetched = []
+        for scene_id in scene_ids:
+            if os.path.isdir(os.path.join(self.store_dir, scene_id)):
+                self._get_store(scene_id)
+                prefetched.append(scene_id)
+        return prefetched
+
+    def start(self):
+        """Starts the simulation. Returns summary of started configuration."""
+        self.store = self._get_store(self._config['scene']['fullId'])
+        self.start_time = time.time()
+        self.running = True
+        return self.reset()
+
+    def reset(self):
+        """Resets the simulation. Returns summary of current configuration."""
+        store = self.store
+        start = self._config.get('start')
+        if isinstance(start, dict) and isinstance(start.get('position'), (list, tuple)):
+            self.cell = store.nearest_cell(start['position'])
+            angle = start.get('angle')
+            self.heading = store.nearest_heading(angle) if angle is not None else self.rng.randrange(store.num_headings)
+        else:
+            self.cell = self.rng.randrange(store.num_cells)
+            self.heading = self.rng.randrange(store.num_headings)
+        self.set_goal(self._config.get('goal'))
+        self.time = 0.0
+        start_state = {'position': store.get_position(self.cell), 'angle': store.get_angle(self.heading), 'tilt': 0.0}
+        distance = self._goal_distances[self.cell]
+        self.start_summary_info = {
+            'sceneId': store.scene_id,
+            'task': self.params.get('task'),
+            'start': start_state,
+            'goal': self.goal,
+            'shortestPath': {'isValid': bool(np.isfinite(distance)),
+                             'distance': float(distance) if np.isfinite(distance) else None},
+            'bbox': self.get_scene_data()['data']['bbox']
+        }
+        self._last_observation = self._observe(False)
+        return self.start_summary_info
+
+    def begin_episode(self, config=None, seed=None, restart=False, goal_observations=True):
+        """Starts new episode (seeding, configuring, and starting or resetting).  Returns summary of started
+        configuration."""
+        if seed is not None:
+            self.seed(seed)
+        self.configure(config)
+        return self.start() if restart or self.store is None else self.reset()
+
+    def set_goal(self, goal):
+        """Set agent goal (position, or rooms if the goal has roomIds). Returns goal."""
+        store = self.store
+        goal = goal or {}
+        if goal.get('roomIds'):
+            self._goal_cells = store.get_room_cells(goal['roomIds'])
+            if len(self._goal_cells) == 0:
+                raise ValueError('No reachable cells in goal rooms %s of scene %s' % (goal['roomIds'], store.scene_id))
+        elif goal.get('type') == 'object' or goal.get('objectIds'):
+            raise ValueError('Object goals are not supported by observation stores')
+        elif isinstance(goal.get('position'), (list, tuple)):
+            self._goal_cells = [store.nearest_cell(goal['position'])]
+        else:
+            self._goal_cells = [self.rng.randrange(store.num_cells)]
+        self._goal_distances = store.get_distances(self._goal_cells)
+        goal_cell = self._goal_cells[0]
+        room = store.rooms[store.cell_rooms[goal_cell]]
+        self.goal = {'type': 'room' if goal.get('roomIds') else 'position', 'position': store.get_position(goal_cell),
+                     'room': room.get('id'), 'roomType': room.get('roomType'), 'objectId': '', 'objectType': ''}
+        return self.goal
+
+    def move_to(self, pos=None, angle=None, tilt=None):
+        """Move agent to cell nearest to position (x,y,z), facing heading nearest to angle radians. Returns
+        agent state."""
+        if pos is not None:
+            self.cell = self.store.nearest_cell(pos)
+        if angle is not None:
+            self.heading = self.store.nearest_heading(angle)
+        return {'status': 'OK', 'data': self._get_agent_state()}
+
+    def step(self, action, frame_skip):
+        """Takes simulation step carrying out action frame_skip times"""
+        actions = action if isinstance(action, list) else [action or {}]
+        collision = False
+        for i in range(frame_skip):
+            for a in actions:
+                name = a.get('name', 'idle')
+                if name in MOVES:
+                    cell = self.store.move(self.cell, self.heading, MOVES[name] * self.store.num_headings // 4)
+                    if cell < 0:
+                        collision = True
+                    else:
+                        self.cell = cell
+                elif name in TURNS:
+                    self.heading = (self.heading + TURNS[name]) % self.store.num_headings
+            self.time += self.store.meta.get('time_step') or 0.2
+        self._last_observation = self._observe(collision)
+        return self._last_observation
+
+    def _get_agent_state(self):
+        return {'position': self.store.get_position(self.cell), 'angle': self.store.get_angle(self.heading),
+                'tilt': 0.0}
+
+    def _observe(self, collision):
+        store = self.store
+        sensors = {}
+        for name, data in store.get_frames(self.cell, self.heading).items():
+            sensors[name] = dict(store.meta['sensors'][name], data=data)
+        if len(self._depth_noise_sims) > 0:
+            start_time = timer()
+            self._simulate_depth_noise(sensors)
+            self.latency_stats.add('action', 'noise', timer() - start_time)
+        position = store.get_position(self.cell)
+        gp = self.goal['position']
+        dx, dz = gp[0] - position[0], gp[2] - position[2]
+        dist = math.sqrt(dx * dx + dz * dz)
+        # direction to goal in agent coordinates
+        angle = store.get_angle(self.heading)
+        c, s = math.cos(-angle), math.sin(-angle)
+        direction = [(c * dx - s * dz) / max(dist, 1e-6), 0.0, (s * dx + c * dz) / max(dist, 1e-6)]
+        path_distance = self._goal_distances[self.cell]
+        room = store.rooms[store.cell_rooms[self.cell]]
+        observation = {
+            'time': self.time,
+            'collision': collision,
+            'sensors': sensors,
+            'measurements': {
+                'distance_to_goal': [dist],
+                'direction_to_goal': direction,
+                'shortest_path_to_goal': {'distance': float(path_distance) if np.isfinite(path_distance) else None,
+                                          'isValid': bool(np.isfinite(path_distance))}
+            },
+            'roomInfo': {'id': room.get('id'), 'roomType': room.get('roomType')}
+        }
+        return {'observation': observation, 'info': {'agent_state': self._get_agent_state()}}
+
+    def _simulate_depth_noise(self, sensors):
+        # noise frames of depth sensors sharing a noise simulator and shape together (stacking copies the
+        # frames so the stored frames are kept as is)
+        batches = collections.OrderedDict()
+        for name, sensor_data in sensors.items():
+            noise_sim = self._depth_noise_sims.get(name)
+            if noise_sim is not None and sensor_data.get('type') == 'depth':
+                key = (id(noise_sim), sensor_data['data'].shape)
+                batches.setdefault(key, (noise_sim, []))[1].append(name)
+        for noise_sim, names in batches.values():
+            data = np.stack([sensors[name]['data'] for name in names])
+            noise_sim.simulate_batch(data)
+            for i, name in enumerate(names):
+                sensors[name]['data_clean'] = sensors[name]['data']
+                sensors[name]['data'] = data[i]
+
+    def get_last_observation(self):
+        return self._last_observation
+
+    def get_scene_data(self):
+        """Returns metadata about current scene: { id: scene_id, bbox: {min, max} }"""
+        store = self.store
+        corner = store.origin
+        extent = np.max(store.cells, axis=0) * store.cell_size
+        bbox = {'min': list(corner), 'max': [corner[0] + float(extent[0]), corner[1], corner[2] + float(extent[1])]}
+        return {'status': 'OK', 'data': {'id': store.scene_id, 'bbox': bbox}}
+
+    def get_observation_metadata(self):
+        """Return metadata about sensors and measurements in observations"""
+        return self.store.meta['observation_metadata']
+
+    def get_observation_space(self):
+        """Return observation space"""
+        obs_meta = self.get_observation_metadata()
+        sensors = obs_meta.get('sensors')
+        sensor_obs_space = {k: Simulator.BoxSpace(range=s.get('dataRange'), shape=s.get('shape')) for k, s in sensors.items()}
+        meas = obs_meta.get('measurements')
+        meas_obs_space = {k: Simulator.BoxSpace(range=s.get('dataRange'), shape=s.get('shape')) for k, s in meas.items()}
+        return {'sensors': sensor_obs_space, 'measurements': meas_obs_space}
+
+    def get_latency_stats(self, name=None):
+        return self.latency_stats.get_stats(name)
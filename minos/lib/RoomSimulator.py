@@ -1,10 +1,14 @@
 import math
 import numpy as np
+import os
 import random
 import sys
 import time
+from timeit import default_timer as timer
 
+from .GridWorldSimulator import GridWorldSimulator
 from .Simulator import Simulator
+from .util.TrajectoryRecorder import TrajectoryRecorder
 from . import common
 
 
@@ -43,9 +47,22 @@ class RoomSimulator:
         self.start_dist = -1
         self.scene_id = None
 
-        self.sim = Simulator(params)
+        if params.get('observation_store'):
+            # gridworld episodes served from precomputed observations
+            self.sim = GridWorldSimulator(params)
+        else:
+            self.sim = Simulator(params)
         self.sid = self.sim.id
 
+        # stream episodes (observations, actions, measurements, rewards) to disk
+        record = params.get('record_trajectories')
+        self.recorder = None
+        if record:
+            self.recorder = TrajectoryRecorder(os.path.join(record['path'], self.sid),
+                                               chunk_size=record.get('chunk_size', 1000),
+                                               compress=record.get('compress', True))
+            self.record_sensors = record.get('sensors')
+
     def get_random_action(self):
         return [(self.my_rand.random() >= .5) for _ in range(self.num_buttons)]
 
@@ -67,6 +84,9 @@ class RoomSimulator:
                      path_numdoors, path_numrooms))
             print('%s:EPINFO:%d,%s' % (self.sim.id, self.num_episodes, str(self.start_config_this_episode)))
             sys.stdout.flush()
+        if self.recorder is not None:
+            self.recorder.end_episode({'success': success, 'num_steps': self.num_steps_this_episode,
+                                       'time_taken': time.time() - self.start_time_this_episode})
         self.episode_is_running = False
 
     def new_episode(self):
@@ -75,10 +95,11 @@ class RoomSimulator:
         self.num_steps_this_episode = 0
         self.start_time_this_episode = time.time()
 
-        # Check if we should restart
+        # Check if we should restart (servers using too much memory, or after fixed number of episodes if set)
         self.num_episodes_since_restart += 1
         num_episodes_per_restart = self.params.get('num_episodes_per_restart', 0)
-        restart_needed = num_episodes_per_restart and self.num_episodes_since_restart > num_episodes_per_restart
+        restart_needed = (num_episodes_per_restart and self.num_episodes_since_restart > num_episodes_per_restart) \
+            or (self.num_episodes > 1 and self.sim.needs_recycle())
         if restart_needed:
             self.sim.restart_child_servers(randomize_ports=True)
             self.sim.init()
@@ -107,7 +128,8 @@ class RoomSimulator:
             #config['goal'] = {'type': 'position', 'objectIds': None, 'roomIds': None}
         if 'start' in ep_settings:
             config['start'] = ep_settings['start']
-        self.sim.seed(self.my_rand.randint(0, 123456789))
+        seed = self.my_rand.randint(0, 123456789)
+        # goal observations are not passed on in episode info (see below) so don't ask for them
         if restart_needed or scene_changed:
             if scene_changed:
                 self.num_episodes_this_scene = 1
@@ -115,12 +137,11 @@ class RoomSimulator:
                                'level': ep_settings['level'],
                                'textureSet': self.curr_schedule}
             # print('restart_needed or scene_changed: config', config, 'ep_settings', ep_settings)
-            self.sim.configure(config)
-            result = self.sim.start()
+            result = self.sim.begin_episode(config, seed=seed, restart=True, goal_observations=False)
+            self._prefetch_next_scenes(ep_settings['scene_id'])
         else:
             # print('reset: config', config, 'ep_settings', ep_settings)
-            self.sim.configure(config)
-            result = self.sim.reset()
+            result = self.sim.begin_episode(config, seed=seed, restart=False, goal_observations=False)
         # update our current scene id
         self.scene_id = ep_settings['scene_id']
 
@@ -138,12 +159,24 @@ class RoomSimulator:
             print('new_episode(): failure in start/reset')
             self.start_dist = -1
 
-        if 'goalObservations' in result:
+        if result and 'goalObservations' in result:
             del result['goalObservations']
         self.measure_fun.reset()
         self.start_config_this_episode = result
+        if self.recorder is not None:
+            self.recorder.begin_episode(result)
         return result
 
+    def _prefetch_next_scenes(self, scene_id):
+        # keep upcoming scenes warm in sim server
+        scene_cache = self.params.get('scene_cache') or {}
+        num_scenes = scene_cache.get('size', 0)
+        if num_scenes > 0:
+            scheduler = self.episode_schedulers[self.curr_schedule]
+            dataset = self.params['scene']['dataset']
+            upcoming = [dataset + '.' + s for s in scheduler.peek_scene_ids(num_scenes) if s != scene_id]
+            self.sim.prefetch_scenes(upcoming)
+
     def get_distance_to_goal(self):
         last_obs = self.sim.get_last_observation()
         measurements = last_obs['observation'].get('measurements')
@@ -164,6 +197,9 @@ class RoomSimulator:
             self.sim.close()
             self.sim.kill()
             self.initialized = False
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def reset(self, force=False):
         episode_info = self.init()
@@ -197,6 +233,8 @@ class RoomSimulator:
         response = self.sim.step(actions, self.frame_skip)
         self.num_steps_this_episode += self.frame_skip
         response = self._augment_response(response, last_observation)
+        if self.recorder is not None:
+            self._record_step(action, response)
 
         if response['terminals']:
             self.end_episode(response['success'], print_episode_stats=True)
@@ -212,7 +250,9 @@ class RoomSimulator:
             rt = self.sim.roomTypes.get_index_one_hot(room_info['roomType'] if room_info else '')
             room_info['roomTypeEncoded'] = rt  # Updates observation!!!
 
+        start_time = timer()
         meas, success, term = self.measure_fun.measure(observation, self.start_config_this_episode)
+        self.sim.latency_stats.add('action', 'measure_fun', timer() - start_time)
         response['success'] = success
         response['measurements'] = meas
         response['rewards'] = common.observation_to_reward(self.reward_type, observation, meas, term, success,
@@ -221,6 +261,22 @@ class RoomSimulator:
         #response['objectives'] = self.measure_fun.get_objectives(observation, self.start_config_this_episode)
         return response
 
+    def _record_step(self, action, response):
+        observation = response['observation']
+        sensors = {}
+        for name, sensor_data in observation['sensors'].items():
+            if self.record_sensors is None or name in self.record_sensors:
+                # copy since frames may be views of buffers that are reused by the simulator
+                sensors[name] = np.array(sensor_data['data'])
+        step = {'action': np.asarray(action), 'sensors': sensors,
+                'measurements': np.array(response['measurements']), 'reward': response['rewards'],
+                'terminal': bool(response['terminals']), 'success': bool(response['success']),
+                'time': observation.get('time'), 'collision': observation.get('collision')}
+        agent_state = response.get('info', {}).get('agent_state')
+        if agent_state is not None:
+            step['agent_state'] = agent_state
+        self.recorder.add_step(step)
+
     def get_observation_space(self, outputs):
         # NOTE: This forces the game to start and a new episode created (it helps get everything setup)
         # TODO: Don't create new episode if not needed
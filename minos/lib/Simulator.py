@@ -2,17 +2,18 @@ import collections
 import copy
 import json
 import logging as log
+import math
 import os
 import platform
-import pprint
-#import resource
 import signal
 import subprocess as sp
+import sys
 import time
 import uuid
 from collections import Counter
 from datetime import datetime
 from string import Template
+from timeit import default_timer as timer
 
 import numpy as np
 import scipy.io.wavfile as wavfile
@@ -27,7 +28,15 @@ from .simdepth.simdepth import DepthNoiseSim
 from .simdepth.simredwood import RedwoodDepthNoiseSim
 from .util.BackgroundPOpen import BackgroundPopen
 from .util.LabelMapping import LabelMapping
+from .util.LatencyStats import LatencyStats
+from .util.NavMapCache import NavMapCache
+from .util.ObservationCache import ObservationCache, CACHEABLE_SENSOR_TYPES
+from .util.ResourceWatchdog import ResourceWatchdog, get_rss_mb
 from .util.RpcCall import RpcCall
+from .util.SensorDumpWriter import SensorDumpWriter
+from .util.SharedMemoryRing import SharedMemoryRing
+from .util.SimServerPool import PooledServer
+from .util.StepFuture import StepFuture
 
 simdepth_path = os.path.dirname(simdepth.__file__)
 
@@ -35,6 +44,113 @@ FORMAT = '%(asctime)s %(levelname)s %(message)s'
 log.basicConfig(level=log.INFO, format=FORMAT)
 
 
+def _save_image(mode, data, filename):
+    image = Image.frombytes(mode, (data.shape[0], data.shape[1]), data)
+    image.save(filename)
+
+
+def _save_depth_image(mode, data, filename):
+    d = data.astype(np.float32)
+    d = (d * (255.0 / np.max(d))).astype(np.uint8)
+    _save_image(mode, d, filename)
+
+
+def _save_audio(sample_rate, data, filename):
+    wavfile.write(filename, sample_rate, data)
+    np.savetxt(filename + '.txt', data)
+
+
+def _save_force_plot(data, filename):
+    plt = common.bearing_plot(data)
+    plt.savefig(filename, dpi=25)
+    plt.close()
+
+
+def _stack_sensor_frames(sensor_frames):
+    # stack arrays of sensor frames from consecutive steps (first axis is the step)
+    stacked = dict(sensor_frames[-1])
+    for k, v in stacked.items():
+        if isinstance(v, np.ndarray):
+            stacked[k] = np.stack([frame[k] for frame in sensor_frames])
+    if stacked.get('shape') is not None:
+        stacked['shape'] = [len(sensor_frames)] + list(stacked['shape'])
+    return stacked
+
+
+def _concatenate_sensor_frames(stacked_frames):
+    # concatenate stacked sensor frames (along first axis)
+    concatenated = dict(stacked_frames[-1])
+    for k, v in concatenated.items():
+        if isinstance(v, np.ndarray):
+            concatenated[k] = np.concatenate([frame[k] for frame in stacked_frames])
+    if concatenated.get('shape') is not None:
+        num_frames = sum(frame['shape'][0] for frame in stacked_frames)
+        concatenated['shape'] = [num_frames] + list(concatenated['shape'][1:])
+    return concatenated
+
+
+def load_sensor_configs(params):
+    """Returns sensor configurations of params.sensors_config with overrides in params.sensors merged"""
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sensors_file = os.path.join(script_path, params.get('sensors_config', '../config/sensors.yml'))
+    if sensors_file.endswith('.yml') or sensors_file.endswith('.yaml'):
+        sensor_configs = yaml.load(open(sensors_file, 'r'))
+    else:
+        sensor_configs = json.load(open(sensors_file, 'r'))
+    for sensor_config in sensor_configs:
+        # merge sensor configuration overrides
+        if 'sensors' in params:
+            for sensor_override in [x for x in params['sensors']
+                                    if 'name' in x and x['name'] == sensor_config['name']]:
+                sensor_config.update(sensor_override)
+    return sensor_configs
+
+
+def create_depth_noise_sim(noise_model_spec):
+    """Returns depth noise simulator for noise model of depth sensor configuration"""
+    noise_model_spec = edict(noise_model_spec)
+    noise_type = noise_model_spec.get('type')
+    if noise_type == 'simple':
+        if noise_model_spec.noise[0] == 'gaussian':
+            return DepthNoiseSim(near=noise_model_spec.clip[0], far=noise_model_spec.clip[1],
+                                 mean=noise_model_spec.noise[1], sigma=noise_model_spec.noise[2],
+                                 seed=noise_model_spec.get('seed'))
+        else:
+            raise ValueError('Unknown noise distribution ' + noise_model_spec.noise[0])
+    elif noise_type == 'redwood':
+        noise_model_file = Template(noise_model_spec.path).substitute({ "SIMDEPTH_DIR": simdepth_path })
+        return RedwoodDepthNoiseSim(noise_model_file, seed=noise_model_spec.get('seed'))
+    else:
+        raise ValueError('Unsupported noise type ' + noise_type)
+
+
+def _get_last_sensor_frame(stacked):
+    # sensor frame of last step of stacked sensor frames (views of stacked arrays)
+    frame = {k: v[-1] if isinstance(v, np.ndarray) else v for k, v in stacked.items()}
+    if frame.get('shape') is not None:
+        frame['shape'] = list(frame['shape'][1:])
+    return frame
+
+
+def _copy_sensor_frames(sensors):
+    # copy frames as they may be views into buffers reused by the next step
+    return {name: {k: np.array(v) if isinstance(v, np.ndarray) else v for k, v in sensor_data.items()}
+            for name, sensor_data in sensors.items()}
+
+
+def _to_pose(pose):
+    # pose as dictionary with position, angle and tilt (floats so it can be sent as json)
+    if isinstance(pose, dict):
+        position, angle, tilt = pose.get('position'), pose.get('angle'), pose.get('tilt')
+    elif len(pose) == 3 and np.size(pose[0]) == 3:
+        position, angle, tilt = pose
+    else:
+        position, angle, tilt = pose[0:3], pose[3], pose[4] if len(pose) > 4 else None
+    return {'position': [float(x) for x in position] if position is not None else None,
+            'angle': float(angle) if angle is not None else None,
+            'tilt': float(tilt) if tilt is not None else None}
+
+
 class Simulator:
     """Provides interface to an indoor simulation server"""
 
@@ -53,12 +169,13 @@ class Simulator:
             params.color_encoding = 'gray'
         if 'host' not in params:
             params.host = 'localhost'
+        self._allocated_ports = []  # ports reserved by us (released when killed)
         if 'port' not in params or params.port is None:
-            params.port = common.get_random_port()
+            params.port = self._allocate_port(params)
         if 'audio' not in params or not params.audio:
             params.audio = edict()
         if 'port' not in params.audio or params.audio.port is None:
-            params.audio.port = common.get_random_port()
+            params.audio.port = self._allocate_port(params)
         if 'datapath' not in params.audio:
             params.audio.datapath = 'data/wav'    # where audio files are found
         if 'wallpath' not in params.audio:
@@ -79,6 +196,7 @@ class Simulator:
             self.objectTypes = None
 
         self.auto_start = params.auto_start if 'auto_start' in params else False
+        self.sim_server = params.get('sim_server') or 'node'  # node (server.js) or mock (MockSimServer)
         self.start_time = None
         self.stats_counter = Counter()
         self.id = params.get('id', 'sim00')
@@ -86,9 +204,41 @@ class Simulator:
         self._rpcid = 0
         self._proc_sim = None
         self._proc_audio = None
+        # warm sim servers are leased from a pool shared by simulators of this process (if server_pool is set)
+        self._server_pool = common.get_sim_server_pool(params.server_pool) if params.get('server_pool') else None
+        self._pooled_server = None
+        self._resource_watchdog = ResourceWatchdog(params.get('resource_limits'))
+        self._sensor_dump_writer = None  # created when save_png is first used
         self._sio = None
+        self._shm = None
         self._restarts = 0
         self._last_observation = None
+        self._decode_paths = {}  # rpc name to paths of array nodes in response
+        self.decode_mode = params.get('decode_mode', 'walk')  # walk (whole response) or schema
+        # Latency histograms by rpc name and phase (emit, wait, decode, process_observation, noise, ...)
+        self.latency_stats = LatencyStats()
+        self.latency_log_interval = params.get('latency_log_interval', 60)  # seconds between logging latencies
+        self._latency_logged_at = time.time()
+        self.max_steps_in_flight = params.get('max_steps_in_flight', 2)  # for step_async
+        self._steps_in_flight = collections.deque()
+        self._capabilities = None  # optional events handled by sim server (asked for when first needed)
+        self._scene_prefetch_supported = True
+        self.render_chunk_size = params.get('render_chunk_size', 32)  # poses rendered per call by render_poses
+        # client side cache of sensor frames by agent pose (used by step if observation_cache_mb is set)
+        if params.get('observation_cache_mb'):
+            self.observation_cache = ObservationCache(
+                int(params.observation_cache_mb * 1024 * 1024),
+                position_resolution=params.get('observation_cache_position_resolution', 0.01),
+                angle_resolution=params.get('observation_cache_angle_resolution', math.radians(1)))
+        else:
+            self.observation_cache = None
+        self._cached_step = None  # actions of last step with agent poses before and after (for predicting poses)
+        # track scene, navmap and agent configuration for caching navigation maps
+        self._navmap_cache = NavMapCache(params.navmap_cache_dir) if params.get('navmap_cache_dir') else None
+        self._navmap_cache_key = None
+        self._tracked_config = {'scene': copy.deepcopy(params.get('scene') or {}),
+                                'navmap': copy.deepcopy(params.get('navmap') or {}),
+                                'agent': None}
         self.start_summary_info = None
         self.running = False
         self.killed = False
@@ -104,6 +254,22 @@ class Simulator:
         self._output_dir = params.output_dir if 'output_dir' in params else self._logdir
         params.output_dir = os.path.abspath(self._output_dir)
 
+        transport = params.get('transport') or {}
+        if self.sim_server == 'mock':
+            # the mock server sends frames over sockets as binary socket.io acks, which the socketIO client
+            # packages do not decode (so frames are sent through shared memory)
+            if transport.get('type', 'socket') != 'shm':
+                if params.get('transport') is not None:
+                    raise ValueError('Mock sim server only supports shared memory transport (--transport shm)')
+                transport = edict({'type': 'shm'})
+                params.transport = transport
+        if transport.get('type') == 'shm':
+            # each step in flight needs its own slot, and the last observation still holds one
+            slots = transport.get('slots', 4)
+            if self.max_steps_in_flight + 1 > slots:
+                raise ValueError('Shared memory transport with %d slots cannot hold max_steps_in_flight=%d steps '
+                                 '(needs at least max_steps_in_flight+1 slots)' % (slots, self.max_steps_in_flight))
+
         # Track what version we are
         stk_sim_path = os.path.dirname(os.path.abspath(__file__))
         stk_git_hash = sp.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True,
@@ -119,19 +285,10 @@ class Simulator:
         self._logger.info(info)
 
         # Initialize sensors
-        sensors_file = os.path.join(script_path, params.sensors_config)
-        if sensors_file.endswith('.yml') or sensors_file.endswith('.yaml'):
-            sensor_configs = yaml.load(open(sensors_file, 'r'))
-        else:
-            sensor_configs = json.load(open(sensors_file, 'r'))
+        sensor_configs = load_sensor_configs(params)
         self._depth_noise_sims = {}
         self._sensors_by_name = {}
         for sensor_config in sensor_configs:
-            # merge sensor configuration overrides
-            if 'sensors' in params:
-                for sensor_override in [x for x in params.sensors
-                                        if 'name' in x and x['name'] == sensor_config['name']]:
-                    sensor_config.update(sensor_override)
             sensor = edict(copy.copy(sensor_config))  # make copy so our noise_sim not in config parameters
             self._sensors_by_name[sensor['name']] = sensor
             if sensor.type == 'depth':
@@ -149,6 +306,7 @@ class Simulator:
         if self.objectTypes is not None:
             params.semantic_encodings['objectType'] = self.objectTypes.to_dict()
         params.sensors = sensor_configs
+        self._sensors_config_key = json.dumps(sensor_configs, sort_keys=True, default=str)  # for observation cache
 
         # Initialize agent config
         if 'agent_config' in params and params['agent_config']:
@@ -181,60 +339,71 @@ class Simulator:
         return logger
 
     def _rpc(self, name, data=None, callback=None, seconds=1):
+        if len(self._steps_in_flight) > 0:
+            self.wait_steps()  # make sure steps are processed in order
+        rpc = self._new_rpc(name)
+        start_time = timer()
+        result = rpc.call(name, data, callback, seconds, check_wait=lambda: self.running)
+        self._record_latency(rpc, total_time=timer() - start_time)
+        return result
+
+    def _new_rpc(self, name):
         self._rpcid = self._rpcid + 1
-        rpc = RpcCall(self._sio, self._rpcid, self._logger)
-        return rpc.call(name, data, callback, seconds, check_wait=lambda: self.running)
+        return RpcCall(self._sio, self._rpcid, self._logger, decode_paths=self._decode_paths.get(name), shm=self._shm)
+
+    def _record_latency(self, rpc, total_time=None):
+        for phase, secs in [('emit', rpc.emit_time), ('wait', rpc.wait_time), ('decode', rpc.decode_time),
+                            ('total', total_time)]:
+            if secs is not None:
+                self.latency_stats.add(rpc.name, phase, secs)
+        if self.latency_log_interval and time.time() - self._latency_logged_at >= self.latency_log_interval:
+            self.log_latency_stats()
+
+    def set_decode_schema(self, obs_meta):
+        """Use observation metadata to find array nodes in observations (instead of walking whole response)"""
+        paths = [('data', 'observation', 'map', 'data'), ('data', 'observation', 'map', '*', 'data')]
+        for name in obs_meta.get('sensors', {}):
+            paths.append(('data', 'observation', 'sensors', name, 'data'))
+            paths.append(('data', 'observation', 'sensors', name, 'data_viz'))
+        for name in obs_meta.get('measurements', {}):
+            paths.append(('data', 'observation', 'measurements', name))
+        self._decode_paths['action'] = paths
+        self._decode_paths['cached_action'] = paths
+
+    def get_decode_stats(self):
+        """Returns number of calls, total and mean decode time (in seconds) by rpc name"""
+        stats = {}
+        for name, phases in self.latency_stats.get_stats().items():
+            if 'decode' in phases:
+                decode = phases['decode']
+                stats[name] = {'calls': decode['count'], 'secs': decode['secs'], 'mean_secs': decode['mean_secs']}
+        return stats
+
+    def get_latency_stats(self, name=None):
+        """Returns latency summaries (count, mean, percentiles, in seconds) by rpc name and phase.
+        Phases are emit, wait (for server response), decode, process_observation (including noise),
+        noise (depth noise simulation), measure_fun (RoomSimulator) and total (for blocking calls)"""
+        return self.latency_stats.get_stats(name)
+
+    def log_latency_stats(self):
+        self._logger.info(self.id + ':RPC latencies\n' + self.latency_stats.format())
+        self._latency_logged_at = time.time()
 
     def _get_depth_noise_sim(self, noise_model_spec):
         simkey = json.dumps(noise_model_spec)
         noise_sim = self._depth_noise_sims.get(simkey)
 
         if noise_sim is None:
-            noise_type = noise_model_spec.get('type')
-            if noise_type == 'simple':
-                if noise_model_spec.noise[0] == 'gaussian':
-                    noise_sim = DepthNoiseSim(near=noise_model_spec.clip[0], far=noise_model_spec.clip[1],
-                                              mean=noise_model_spec.noise[1], sigma=noise_model_spec.noise[2])
-                else:
-                    raise ValueError('Unknown noise distribution ' + noise_model_spec.noise[0])
-            elif noise_type == 'redwood':
-                noise_model_file = Template(noise_model_spec.path).substitute({ "SIMDEPTH_DIR": simdepth_path })
-                simkey = noise_type + ':' + noise_model_file
-                noise_sim = RedwoodDepthNoiseSim(noise_model_file)
-            else:
-                raise ValueError('Unsupported noise type ' + noise_type)
+            noise_sim = create_depth_noise_sim(noise_model_spec)
             self._depth_noise_sims[simkey] = noise_sim
         return noise_sim
 
     def start_child_servers(self):
         if self.auto_start:
             if not self._proc_sim:
-                script_path = os.path.dirname(os.path.realpath(__file__))
-                path_sim = os.path.realpath(os.path.join(script_path, '../server/'))
-                self._logger.info(self.id + ':Starting sim server at %s with port %d' % (path_sim + '/server.js', self.params.port))
-                my_env = os.environ.copy()
-                my_env['NODE_BASE_URL'] = self.params.NODE_BASE_URL
-
-                simserver_cmd = ['node','--max-old-space-size=4096', path_sim + '/server.js',
-                                 '-p', str(self.params.port)]
-                if self.params.get('busywait', 0) > 0:
-                    simserver_cmd.append('--busywait')
-                    simserver_cmd.append(str(self.params.get('busywait')))
-                if self.params.get('ping_timeout') is not None:
-                    simserver_cmd.append('--ping_timeout')
-                    simserver_cmd.append(str(self.params.get('ping_timeout')))
-                if self.params.get('profile_cpu', False):
-                    simserver_cmd.insert(1, '--prof')
-                if self.params.get('debug_mem', False):
-                    simserver_cmd.insert(1, '--expose-gc')
-                self._proc_sim = BackgroundPopen('simserver', self._get_logger('simserver'),
-                                                 out_handler=None, err_handler=None,
-                                                 args=simserver_cmd,
-                                                 #bufsize=0,
-                                                 start_new_session=True,
-                                                 env=my_env, cwd=path_sim)
-                time.sleep(1)
-            if not self._proc_audio and self.params.observations.audio:
+                if not self._start_sim_server():
+                    return False
+            if not self._proc_audio and self.params.observations.audio and self.sim_server != 'mock':
                 path_audio = os.path.join(self.params.SIM_PATH, 'r2sim')
                 self._logger.info('Starting audio server at %s with port %d' % (path_audio, self.params.audio.port))
 
@@ -251,7 +420,8 @@ class Simulator:
                                                    #bufsize=0,
                                                    start_new_session=True,
                                                    cwd=path_audio)
-                time.sleep(1)
+                if not self._wait_for_server(self._proc_audio, 'audio server', self.params.audio.port):
+                    return False
             if not self.check_status():
                 return False
         if not self._sio:
@@ -259,8 +429,150 @@ class Simulator:
             self._sio.on('connect', self.on_connect)
             self._sio.on('disconnect', self.on_disconnect)
             self._sio.on('reconnect', self.on_reconnect)
+            self._setup_transport()
         return True
 
+    def _wait_for_server(self, proc, name, port):
+        """Waits until server process is listening on port (up to server_start_timeout seconds).
+        Returns whether the server is ready"""
+        timeout = self.params.get('server_start_timeout', 60)
+        start_time = time.time()
+        while True:
+            rv = proc.poll()
+            if rv is not None:
+                self._logger.error(self.id + ':%s exited with rv %d before listening on port %d' % (name, rv, port))
+                return False
+            if common.is_listening(proc.pid, port):
+                self._logger.info(self.id + ':%s ready on port %d after %.2f secs'
+                                  % (name, port, time.time() - start_time))
+                return True
+            if time.time() - start_time > timeout:
+                self._logger.error(self.id + ':%s not listening on port %d after %d secs' % (name, port, timeout))
+                return False
+            time.sleep(0.02)
+
+    def _allocate_port(self, params):
+        port = common.get_random_port(params.get('port_range'))
+        self._allocated_ports.append(port)
+        return port
+
+    def _release_port(self, port):
+        if port in self._allocated_ports:
+            common.release_port(port, self.params.get('port_range'))
+            self._allocated_ports.remove(port)
+
+    def _start_sim_server(self):
+        """Starts sim server (or leases a warm one from the server pool).  Returns success"""
+        if self._server_pool is None:
+            return self._launch_mock_server() if self.sim_server == 'mock' else self._launch_node_server()
+        self._pooled_server = self._server_pool.lease(self._get_server_key(), self._launch_pooled_server)
+        if self._pooled_server is None:
+            return False
+        self._proc_sim = self._pooled_server.proc
+        if self.params.port != self._pooled_server.port:
+            self._release_port(self.params.port)
+            self.params.port = self._pooled_server.port
+        self._logger.info(self.id + ':Using sim server pid %d on port %d'
+                          % (self._proc_sim.pid, self._pooled_server.port))
+        return True
+
+    def _get_server_key(self):
+        """Sim server launch options (servers can be shared by simulators with the same key)"""
+        return json.dumps([self.sim_server, self.params.NODE_BASE_URL, self.params.get('busywait', 0),
+                           self.params.get('ping_timeout'), self.params.get('profile_cpu', False),
+                           self.params.get('debug_mem', False), self.params.get('port_range')])
+
+    def _launch_pooled_server(self):
+        if self.params.port not in self._allocated_ports:
+            # port was used by previous pooled server
+            self.params.port = self._allocate_port(self.params)
+        launched = self._launch_mock_server() if self.sim_server == 'mock' else self._launch_node_server()
+        if not launched:
+            return None
+        # port belongs to the server from now on (released by the pool when the server is stopped)
+        port = self.params.port
+        self._allocated_ports.remove(port)
+        port_range = self.params.get('port_range')
+        return PooledServer(self._get_server_key(), self._proc_sim, port,
+                            release_port=lambda p: common.release_port(p, port_range))
+
+    def _launch_node_server(self):
+        script_path = os.path.dirname(os.path.realpath(__file__))
+        path_sim = os.path.realpath(os.path.join(script_path, '../server/'))
+        self._logger.info(self.id + ':Starting sim server at %s with port %d' % (path_sim + '/server.js', self.params.port))
+        my_env = os.environ.copy()
+        my_env['NODE_BASE_URL'] = self.params.NODE_BASE_URL
+
+        simserver_cmd = ['node','--max-old-space-size=4096', path_sim + '/server.js',
+                         '-p', str(self.params.port)]
+        if self.params.get('busywait', 0) > 0:
+            simserver_cmd.append('--busywait')
+            simserver_cmd.append(str(self.params.get('busywait')))
+        if self.params.get('ping_timeout') is not None:
+            simserver_cmd.append('--ping_timeout')
+            simserver_cmd.append(str(self.params.get('ping_timeout')))
+        if self.params.get('profile_cpu', False):
+            simserver_cmd.insert(1, '--prof')
+        if self.params.get('debug_mem', False):
+            simserver_cmd.insert(1, '--expose-gc')
+        self._proc_sim = BackgroundPopen('simserver', self._get_logger('simserver'),
+                                         out_handler=None, err_handler=None,
+                                         args=simserver_cmd,
+                                         #bufsize=0,
+                                         start_new_session=True,
+                                         env=my_env, cwd=path_sim)
+        return self._wait_for_server(self._proc_sim, 'sim server', self.params.port)
+
+    def _launch_mock_server(self):
+        # python stand-in for server.js with synthetic observations (no rendering or scene data needed)
+        script_path = os.path.dirname(os.path.realpath(__file__))
+        root_path = os.path.realpath(os.path.join(script_path, '../../'))
+        self._logger.info(self.id + ':Starting mock sim server with port %d' % self.params.port)
+        my_env = os.environ.copy()
+        my_env['PYTHONPATH'] = os.pathsep.join([root_path] + ([my_env['PYTHONPATH']] if 'PYTHONPATH' in my_env else []))
+        simserver_cmd = [sys.executable, '-m', 'minos.lib.util.MockSimServer', '-p', str(self.params.port)]
+        capabilities = (self.params.get('mock') or {}).get('capabilities')
+        if capabilities is not None:
+            # capabilities are asked for before the mock gets its parameters (to set up the transport)
+            simserver_cmd += ['--capabilities', ','.join(capabilities)]
+        self._proc_sim = BackgroundPopen('simserver', self._get_logger('simserver'),
+                                         out_handler=None, err_handler=None,
+                                         args=simserver_cmd,
+                                         start_new_session=True,
+                                         env=my_env, cwd=root_path)
+        return self._wait_for_server(self._proc_sim, 'mock sim server', self.params.port)
+
+    def _setup_transport(self):
+        """Sets up how sensor frames are sent from the sim server (socket or shared memory)"""
+        transport = self.params.get('transport')
+        if transport is None or transport.get('type', 'socket') == 'socket':
+            return
+        if transport.type != 'shm':
+            raise ValueError('Unsupported transport type ' + transport.type)
+        if self.params.host not in ['localhost', '127.0.0.1']:
+            if self.sim_server == 'mock':
+                raise ValueError('Mock sim server requires shared memory transport (with local sim server)')
+            self._logger.warning(self.id + ':Shared memory transport requires local sim server, using socket')
+            return
+        if not self.supports('set_transport'):
+            if self.sim_server == 'mock':
+                raise Exception(self.id + ':Mock sim server does not support shared memory transport it requires')
+            self._logger.warning(self.id + ':Shared memory transport not supported by sim server, using socket')
+            return
+        if self._shm is None:
+            self._shm = SharedMemoryRing(slots=transport.get('slots', 4),
+                                         slot_size=transport.get('slot_size', 16*1024*1024),
+                                         min_bytes=transport.get('min_bytes', 1024))
+        res = self._rpc('set_transport', self._shm.spec(), seconds=None)
+        if res is None or res.get('status') == 'error':
+            self._shm.close()
+            self._shm = None
+            if self.sim_server == 'mock':
+                raise Exception(self.id + ':Error setting up shared memory transport required by mock sim server')
+            self._logger.warning(self.id + ':Error setting up shared memory transport, using socket')
+        else:
+            self._logger.info(self.id + ':Using shared memory transport at %s' % self._shm.path)
+
     def restart_child_servers(self, randomize_ports=False, seconds=1):
         # Maybe something happened to our servers
         # Let's stop and restart!
@@ -272,18 +584,20 @@ class Simulator:
         # Hypothetically, it should reconnected as long as simserver reuses the same port (but something goes wrong)
         self.close(seconds=seconds)
         self._sio = None
+        self._capabilities = None  # ask restarted sim server again
 
         # Partial close (not fully working)
         #self.running = False
         #self._rpc('close', seconds=seconds)  # Try to be good and tell other side we are closing
 
-        # Stop servers
-        self.stop_child_servers()
+        # Stop servers (don't hand sim server to others, we are restarting because something may be wrong with it)
+        self.stop_child_servers(reusable=False)
 
         # Restart servers
         if randomize_ports:
             # Only audio port need to be randomized (sio port is okay)
-            self.params.audio.port = common.get_random_port()
+            self._release_port(self.params.audio.port)
+            self.params.audio.port = self._allocate_port(self.params)
         return self.start_child_servers()
 
     def restart(self, randomize_ports=False, seconds=1):
@@ -291,11 +605,36 @@ class Simulator:
         return self.start()
 
     def check_resources(self):
-        resources_self = resource.getrusage(resource.RUSAGE_SELF)
-        resources_children = resource.getrusage(resource.RUSAGE_CHILDREN)
-        resources = { 'self': resources_self, 'children': resources_children }
-        self._logger.info(pprint.pformat(resources))
-        return resources
+        """Samples memory used by sim and audio servers (RSS, and V8 heap if reported by sim server).
+        Returns sample and list of exceeded resource limits"""
+        sample = {
+            'sim_rss_mb': get_rss_mb(self._proc_sim.pid) if self._proc_sim else None,
+            'sim_heap_mb': None,
+            'audio_rss_mb': get_rss_mb(self._proc_audio.pid) if self._proc_audio else None
+        }
+        if self.running and self.supports('get_memory_usage'):
+            res = self._rpc('get_memory_usage')
+            if res is None or res.get('status') == 'error':
+                self._logger.warning(self.id + ':Error getting memory usage of sim server, only checking RSS')
+            elif res.get('data', {}).get('heapUsed') is not None:
+                sample['sim_heap_mb'] = res['data']['heapUsed'] / (1024 * 1024)
+        exceeded = self._resource_watchdog.add_sample(sample)
+        self._get_logger('resources').info(json.dumps(sample))
+        if len(exceeded) > 0:
+            self._logger.warning(self.id + ':Resource limits exceeded: ' + ', '.join(exceeded))
+        return sample, exceeded
+
+    def needs_recycle(self):
+        """Checks (at most every resource_limits.check_interval seconds) whether servers use more memory
+        than allowed by resource_limits and should be restarted"""
+        if not self._resource_watchdog.limits or not self._resource_watchdog.is_due():
+            return False
+        sample, exceeded = self.check_resources()
+        return len(exceeded) > 0
+
+    def get_resource_stats(self):
+        """Returns last sample and maximum memory use (in MB) of servers"""
+        return self._resource_watchdog.get_stats()
 
     def check_status(self):
         ok = True
@@ -303,6 +642,9 @@ class Simulator:
             rv = self._proc_sim.poll()
             if rv is not None:
                 self._logger.info(self.id + ':sim server has exited with rv %d' % rv)
+                if self._pooled_server is not None:
+                    self._server_pool.release(self._pooled_server, reusable=False)
+                    self._pooled_server = None
                 self._proc_sim = None
                 ok = False
         else:
@@ -315,7 +657,7 @@ class Simulator:
                 self._proc_audio = None
                 ok = False
         else:
-            ok = not self.params.observations.audio
+            ok = not self.params.observations.audio or self.sim_server == 'mock'
 
         return ok
 
@@ -327,9 +669,50 @@ class Simulator:
             return False
         self.start_time = time.time()
         self.running = True
+        self._set_cached_navmap()
+        self._clear_retextured_frames()
         self._rpc('start', self.params, self.on_started)
+        if self.start_summary_info is not None:
+            if self.decode_mode == 'schema':
+                self.get_observation_metadata()  # update decode schema
+            if self._navmap_cache_key is not None and self.params.get('navmap_cached_grid') is None:
+                self._save_navmap()
         return self.start_summary_info
 
+    def _set_cached_navmap(self):
+        # Tell server to use cached navigation map (if we have one) instead of computing it
+        if self._navmap_cache is None:
+            return
+        self._navmap_cache_key = None
+        self.params.navmap_cached_grid = None
+        scene = self._tracked_config['scene']
+        navmap = self._tracked_config['navmap']
+        if not self.params.get('navmap') or not scene.get('fullId'):
+            return
+        agent = self._tracked_config['agent'] or self.params.get('agent')
+        self._navmap_cache_key = self._navmap_cache.key(scene.get('fullId'), scene.get('level'),
+                                                        agent, navmap, scene)
+        self.params.navmap_cached_grid = self._navmap_cache.get(self._navmap_cache_key)
+        if self.params.navmap_cached_grid is not None:
+            self._logger.info(self.id + ':Using cached navmap %s' % self.params.navmap_cached_grid)
+
+    def _save_navmap(self):
+        if not self.supports('get_navmap'):
+            return
+        res = self._rpc('get_navmap')
+        if res is not None and res.get('status') == 'OK' and res.get('data'):
+            path = self._navmap_cache.put(self._navmap_cache_key, res['data'])
+            self._logger.info(self.id + ':Saved navmap to cache %s' % path)
+
+    def _track_config(self, config):
+        for k in ['scene', 'navmap', 'agent']:
+            if config.get(k) is not None:
+                if self._tracked_config[k] is None:
+                    self._tracked_config[k] = {}
+                self._tracked_config[k].update(config[k])
+        if config.get('sensors') is not None:
+            self._sensors_config_key += json.dumps(config['sensors'], sort_keys=True, default=str)
+
     def init(self):
         """Initializes the simulation. Returns success."""
         started = self.start_child_servers()
@@ -338,6 +721,36 @@ class Simulator:
             return False
         return self._rpc('init', self.params, self.on_inited)
 
+    def supports(self, event):
+        """Returns whether sim server handles optional event.  The first call asks the sim server which
+        optional events it handles (older servers never answer events they do not handle, including
+        get_capabilities, so no optional events are used if there is no answer within capabilities_timeout)."""
+        if self._capabilities is None:
+            res = self._probe_rpc('get_capabilities', timeout=self.params.get('capabilities_timeout', 5))
+            if res is None or res.get('status') == 'error':
+                self._logger.warning(self.id + ':Sim server does not report capabilities, not using optional events')
+                self._capabilities = []
+            else:
+                self._capabilities = (res.get('data') or {}).get('events') or []
+        return event in self._capabilities
+
+    def _probe_rpc(self, name, data=None, timeout=5):
+        """Calls rpc that the sim server may not answer.  Returns response (None if not answered within timeout
+        seconds)."""
+        if len(self._steps_in_flight) > 0:
+            self.wait_steps()
+        rpc = self._new_rpc(name)
+        rpc.emit(name, data)
+        ack_id = getattr(self._sio, '_ack_id', None)  # of the call just emitted
+        deadline = time.time() + timeout
+        while not rpc.done() and time.time() < deadline and self._sio.connected:
+            self._sio.wait_for_callbacks(seconds=0.1)
+        if not rpc.done() and ack_id is not None:
+            # drop callback that will never be called (socketIO waits for all pending callbacks)
+            getattr(self._sio, '_callback_by_ack_id', {}).pop(ack_id, None)
+        self._record_latency(rpc)
+        return rpc.response
+
     def close(self, seconds=None):
         """Stops the simulation. Returns success."""
         self.start_summary_info = None
@@ -352,9 +765,51 @@ class Simulator:
 
     def reset(self):
         """Resets the simulation. Returns summary of current configuration."""
+        self._clear_retextured_frames()
         self._rpc('reset', callback=self.on_reset)
         return self.start_summary_info
 
+    def begin_episode(self, config=None, seed=None, restart=False, goal_observations=True):
+        """Starts new episode: seeds (if seed is given) and configures the simulator, then starts (if
+        restart) or resets the simulation and takes the first step to fill last observation.  This takes one
+        round trip if the sim server supports it (otherwise separate calls are made).  Goal observations
+        are only included in the episode summary if goal_observations.  Returns summary of started
+        configuration."""
+        if restart:
+            if not self.start_child_servers():
+                self.running = False
+                return False
+        if not self.supports('begin_episode'):
+            return self._begin_episode_separately(config, seed, restart)
+        if config:
+            self._track_config(config)
+        opts = {'seed': seed, 'config': config or None, 'start': restart, 'goalObservations': goal_observations,
+                'action': {'name': 'idle', 'frame_skip': 1}}
+        if restart:
+            self.start_time = time.time()
+            self.running = True
+            self._set_cached_navmap()
+            opts['params'] = self.params
+        self._clear_retextured_frames()
+        res = self._rpc('begin_episode', opts)
+        if res is None or res.get('status') == 'error':
+            return False
+        self.start_summary_info = res['data']['episodeInfo']
+        self.__process_goal_observations(self.start_summary_info.get('goalObservations'), 'begin_episode')
+        if restart:
+            if self.decode_mode == 'schema':
+                self.get_observation_metadata()  # update decode schema
+            if self._navmap_cache_key is not None and self.params.get('navmap_cached_grid') is None:
+                self._save_navmap()
+        self.on_observation({'data': res['data']['step']}, 'begin_episode')
+        return self.start_summary_info
+
+    def _begin_episode_separately(self, config, seed, restart):
+        if seed is not None:
+            self.seed(seed)
+        self.configure(config)
+        return self.start() if restart else self.reset()
+
     def move_to(self, pos=None, angle=None, tilt=None):
         """Move agent to position (x,y,z), facing direction with angle radians
         to +X axis, and with tilt radians from horizontal. Returns success."""
@@ -366,16 +821,35 @@ class Simulator:
 
     def set_scene(self, id):
         """Sets the scene in which simulator will run. Returns success."""
-        return self._rpc('configure', { 'scene': { 'fullId': id }})
+        return self.configure({ 'scene': { 'fullId': id }})
+
+    def prefetch_scenes(self, scene_ids):
+        """Asks sim server to preload scenes in the background so that starting them later avoids a cold load.
+        At most scene_cache.size scenes are kept (least recently used evicted first), also evicting when
+        preloaded scenes take more than scene_cache.max_memory_mb (geometry and textures).  Preloaded scenes
+        are handed to the simulator when it starts them.  Returns ids of preloaded scenes."""
+        if not self._scene_prefetch_supported or len(scene_ids) == 0 or not self.supports('preload_scenes'):
+            return None
+        scene_cache = self.params.get('scene_cache') or {}
+        res = self._rpc('preload_scenes', {'fullIds': scene_ids,
+                                           'cacheSize': scene_cache.get('size', len(scene_ids)),
+                                           'maxMemoryMB': scene_cache.get('max_memory_mb'),
+                                           'sceneOptions': {k: v for k, v in self._tracked_config['scene'].items()
+                                                            if k != 'fullId'}})
+        if res is None or res.get('status') == 'error':
+            self._logger.warning(self.id + ':Scene prefetching not supported by sim server, disabling')
+            self._scene_prefetch_supported = False
+            return None
+        return res.get('data')
 
     def configure(self, config):
         """Sets the simulator configuration. Returns success."""
         if not config:  # check for empty config
             return True
+        self._track_config(config)
         return self._rpc('configure', config)
 
-    def step(self, action, frame_skip):
-        """Takes simulation step carrying out action frame_skip times"""
+    def _set_frame_skip(self, action, frame_skip):
         if action is None:
             action = {}
         if type(action) is list:
@@ -383,7 +857,243 @@ class Simulator:
                 a['frame_skip'] = frame_skip
         else:
             action['frame_skip'] = frame_skip
-        return self._rpc('action', action, self.on_observation)
+        return action
+
+    def step(self, action, frame_skip):
+        """Takes simulation step carrying out action frame_skip times"""
+        return self._step(action, frame_skip)
+
+    def _step(self, action, frame_skip, rpc_name=None):
+        # rpc_name is the call the observation is processed for (defaults to the rpc used for the step)
+        action = self._set_frame_skip(action, frame_skip)
+        if self.observation_cache is not None and self.supports('cached_action'):
+            return self._step_cached(action, rpc_name)
+        return self._rpc('action', action, lambda message: self.on_observation(message, rpc_name or 'action'))
+
+    def _step_cached(self, action, rpc_name=None):
+        # predict pose after action, and if its frames are cached ask sim server to leave them out of the
+        # response (the sim server checks that the agent actually reached the predicted pose)
+        cache = self.observation_cache
+        pose_before = self._get_agent_pose(self._last_observation)
+        predicted = self._predict_pose(action, pose_before)
+        scene = self._get_scene_key()
+        key = cache.key(scene, self._sensors_config_key, predicted) if predicted is not None else None
+        cached = cache.get(key) if key is not None else None
+        step_rpc = 'action' if cached is None else 'cached_action'
+        if cached is None:
+            res = self._rpc(step_rpc, action)
+        else:
+            res = self._rpc(step_rpc, {'action': action,
+                                              'cached': {'sensors': list(cached.keys()), 'pose': list(key[2:]),
+                                                         'positionResolution': cache.position_resolution,
+                                                         'angleResolution': cache.angle_resolution}})
+        data = res.get('data') if res is not None else None
+        observation = data.get('observation') if data is not None else None
+        if observation is not None and observation.get('sensors') is not None:
+            sensors = observation['sensors']
+            omitted = observation.pop('cachedSensors', None) or []
+            for name in omitted:
+                sensors[name] = dict(cached[name], data=np.array(cached[name]['data']))
+            cache.record_lookup(len(omitted) > 0)
+            pose_after = self._get_agent_pose(data)
+            if len(omitted) == 0 and pose_after is not None:
+                cacheable = {name: sensor_data for name, sensor_data in sensors.items()
+                             if sensor_data.get('type') in CACHEABLE_SENSOR_TYPES
+                             and sensor_data.get('data') is not None}
+                if len(cacheable) > 0:
+                    cache.put(cache.key(scene, self._sensors_config_key, pose_after), cacheable)
+            self._cached_step = (self._get_action_key(action), pose_before, pose_after)
+        return self.on_observation(res, rpc_name or step_rpc)
+
+    @staticmethod
+    def _get_agent_pose(data):
+        agent_state = ((data or {}).get('info') or {}).get('agent_state')
+        if agent_state is None or agent_state.get('position') is None or agent_state.get('angle') is None:
+            return None
+        return {'position': list(agent_state['position']), 'angle': agent_state['angle'],
+                'tilt': agent_state.get('tilt') or 0.0}
+
+    @staticmethod
+    def _get_action_key(action):
+        actions = action if isinstance(action, list) else [action]
+        return tuple((a.get('name', 'idle'), a.get('strength', 1), a.get('frame_skip', 1)) for a in actions)
+
+    def _predict_pose(self, action, pose):
+        """Predicts agent pose after action: idle keeps the pose, and repeating the last action moves the agent
+        as much as it did (so agents turning in place or stopped by a wall revisit poses)"""
+        if pose is None:
+            return None
+        action_key = self._get_action_key(action)
+        if all(name == 'idle' for name, _, _ in action_key):
+            return pose
+        if self._cached_step is None:
+            return None
+        last_action_key, last_before, last_after = self._cached_step
+        if last_action_key != action_key or last_before is None or last_after != pose:
+            return None
+        return {'position': [p + a - b for p, a, b in
+                             zip(pose['position'], last_after['position'], last_before['position'])],
+                'angle': pose['angle'] + last_after['angle'] - last_before['angle'],
+                'tilt': pose['tilt'] + last_after['tilt'] - last_before['tilt']}
+
+    def _clear_retextured_frames(self):
+        # scenes are retextured for each episode so frames cached in earlier episodes are stale
+        if self.observation_cache is not None and self._tracked_config['scene'].get('retexture'):
+            self.observation_cache.clear()
+
+    def _get_scene_key(self):
+        scene_id = self.start_summary_info.get('sceneId') if self.start_summary_info is not None else None
+        return json.dumps([scene_id, self._tracked_config['scene']], sort_keys=True, default=str)
+
+    def get_observation_cache_stats(self):
+        """Returns hits, misses, hit rate, evictions, number of entries and bytes of observation cache (None if
+        the observation cache is not used)"""
+        return self.observation_cache.get_stats() if self.observation_cache is not None else None
+
+    def step_async(self, action, frame_skip):
+        """Sends simulation step without waiting for its observation.  Returns StepFuture whose result()
+        is the observation.  Observations are processed in order when their results are requested, so the
+        next action can be sent while the last observation is processed.  At most max_steps_in_flight
+        steps are sent before waiting for the oldest one (with shared memory transport, there must be more slots
+        than max_steps_in_flight so frames are not overwritten before they are read)."""
+        action = self._set_frame_skip(action, frame_skip)
+        while len(self._steps_in_flight) >= self.max_steps_in_flight:
+            self.wait_steps(self._steps_in_flight[0])
+        rpc = self._new_rpc('action')
+        rpc.emit('action', action)
+        future = StepFuture(self, rpc)
+        self._steps_in_flight.append(future)
+        return future
+
+    def wait_steps(self, future=None):
+        """Waits for and processes steps sent by step_async (up to and including future, or all steps)"""
+        while len(self._steps_in_flight) > 0:
+            f = self._steps_in_flight.popleft()
+            # poll so that we return as soon as this response is received (not all pending responses)
+            f.rpc.wait(seconds=0.001, check_wait=lambda: self.running)
+            self._record_latency(f.rpc)
+            f.set_result(self.on_observation(f.rpc.response, f.rpc.name))
+            if f is future:
+                break
+
+    def step_sequence(self, actions, frame_skip=1, observations='last'):
+        """Takes a simulation step for each action in actions (action or list of actions carried out
+        frame_skip times) in one call.  Returns the response of the last step (as returned by step) with
+        'steps' listing the time, collision flag and measurements of every step.  If observations is 'all',
+        'frames' has the sensor frames of every step stacked (first axis is the step)."""
+        if observations not in ['last', 'all']:
+            raise ValueError('Unknown observations %s (supported: last,all)' % observations)
+        actions = [self._set_frame_skip(action, frame_skip) for action in actions]
+        if len(actions) == 0:
+            return None
+        if not self.supports('action_sequence'):
+            return self._step_sequence_separately(actions, observations)
+        res = self._rpc('action_sequence', {'actions': actions, 'observations': observations})
+        if res is None or res.get('status') == 'error' or res.get('data') is None:
+            self._logger.error(self.id + ':Error taking action sequence: ' + str(res.get('message') if res else None))
+            return None
+        steps = res['data'].pop('steps')
+        frames = res['data'].pop('frames', None)
+        data = self.on_observation(res, 'action_sequence')
+        data['steps'] = steps
+        if frames is not None:
+            start_time = timer()
+            data['frames'] = self.__process_stacked_frames(frames)
+            # frames of the last step are only sent stacked (so they are processed once)
+            for name, frame in data['frames'].items():
+                data['observation']['sensors'][name] = _get_last_sensor_frame(frame)
+            self.latency_stats.add('action_sequence', 'process_observation', timer() - start_time)
+        return data
+
+    def _step_sequence_separately(self, actions, observations):
+        steps = []
+        sensor_frames = []
+        data = None
+        for action in actions:
+            data = self.step(action, 1)
+            if data is None:
+                return None
+            observation = data['observation']
+            steps.append({'time': observation.get('time'), 'collision': observation.get('collision'),
+                          'measurements': observation.get('measurements')})
+            if observations == 'all':
+                sensor_frames.append(_copy_sensor_frames(observation['sensors']))
+        data['steps'] = steps
+        if observations == 'all':
+            data['frames'] = {name: _stack_sensor_frames([frames[name] for frames in sensor_frames])
+                              for name in sensor_frames[0]}
+        return data
+
+    def __process_stacked_frames(self, frames, rpc_name='action_sequence'):
+        # process frames one by one (as for single steps), and stack processed frames again
+        stacked = {}
+        for name, frame in frames.items():
+            num_steps = frame['shape'][0]
+            data = np.asarray(frame['data']).reshape(num_steps, -1)
+            sensor_frames = []
+            for i in range(num_steps):
+                sensor_data = dict(frame, shape=frame['shape'][1:], data=data[i])
+                self.__process_observation({'observation': {'sensors': {name: sensor_data}}}, rpc_name)
+                sensor_frames.append(sensor_data)
+            stacked[name] = _stack_sensor_frames(sensor_frames)
+        return stacked
+
+    def iter_render_poses(self, poses, chunk_size=None):
+        """Renders sensor frames at poses in current scene (each pose is a (position, angle, tilt) tuple, a
+        dictionary with position, angle and tilt, or a row x,y,z,angle,tilt of an array).  Poses are
+        rendered chunk_size (render_chunk_size by default) at a time so memory used for frames is bounded.
+        Yields dictionary with the poses the agent was moved to, 'steps' with the time, collision flag,
+        measurements and room info at each pose, and the sensor frames of each chunk stacked (first axis is
+        the pose).  The agent is left at the last pose."""
+        chunk_size = chunk_size or self.render_chunk_size
+        poses = [_to_pose(pose) for pose in poses]
+        for i in range(0, len(poses), chunk_size):
+            chunk = poses[i:i + chunk_size]
+            if not self.supports('render_poses'):
+                yield self._render_poses_separately(chunk)
+                continue
+            res = self._rpc('render_poses', {'poses': chunk})
+            if res is None or res.get('status') == 'error' or res.get('data') is None:
+                err_str = self.id + ':Error rendering poses: ' + str(res.get('message') if res else None)
+                self._logger.error(err_str)
+                raise Exception(err_str)
+            start_time = timer()
+            frames = self.__process_stacked_frames(res['data']['frames'], 'render_poses')
+            self.latency_stats.add('render_poses', 'process_observation', timer() - start_time)
+            yield {'poses': res['data']['poses'], 'steps': res['data']['steps'], 'frames': frames}
+
+    def render_poses(self, poses, chunk_size=None):
+        """Renders sensor frames at poses in current scene (see iter_render_poses).  Returns dictionary with
+        the poses the agent was moved to, steps and the sensor frames of all poses stacked."""
+        rendered = {'poses': [], 'steps': [], 'frames': {}}
+        chunks = []
+        for chunk in self.iter_render_poses(poses, chunk_size):
+            rendered['poses'].extend(chunk['poses'])
+            rendered['steps'].extend(chunk['steps'])
+            chunks.append(chunk['frames'])
+        for name in (chunks[0] if len(chunks) > 0 else {}):
+            rendered['frames'][name] = _concatenate_sensor_frames([frames[name] for frames in chunks])
+        return rendered
+
+    def _render_poses_separately(self, poses):
+        agent_poses = []
+        steps = []
+        sensor_frames = []
+        for pose in poses:
+            res = self.move_to(pose['position'], pose['angle'], pose['tilt'])
+            agent_poses.append(res.get('data') if res is not None else None)
+            data = self.step({'name': 'idle'}, 1)
+            if data is None:
+                err_str = self.id + ':Error rendering pose ' + str(pose)
+                self._logger.error(err_str)
+                raise Exception(err_str)
+            observation = data['observation']
+            steps.append({'time': observation.get('time'), 'collision': observation.get('collision'),
+                          'measurements': observation.get('measurements'), 'roomInfo': observation.get('roomInfo')})
+            sensor_frames.append(_copy_sensor_frames(observation['sensors']))
+        return {'poses': agent_poses, 'steps': steps,
+                'frames': {name: _stack_sensor_frames([frames[name] for frames in sensor_frames])
+                           for name in sensor_frames[0]}}
 
     def get_last_observation(self):
         return self._last_observation
@@ -396,9 +1106,16 @@ class Simulator:
         """Returns trace of actions in current session"""
         return self._rpc('get_action_trace')
 
+    def get_observation_metadata(self):
+        """Return metadata about sensors and measurements in observations"""
+        obs_meta = self._rpc('get_observation_metadata')['data']
+        if self.decode_mode == 'schema':
+            self.set_decode_schema(obs_meta)
+        return obs_meta
+
     def get_observation_space(self):
         """Return observation space"""
-        obs_meta = self._rpc('get_observation_metadata')['data']
+        obs_meta = self.get_observation_metadata()
         sensors = obs_meta.get('sensors')
         sensor_obs_space = {k: Simulator.BoxSpace(range=s.get('dataRange'), shape=s.get('shape')) for k, s in sensors.items()}
         meas = obs_meta.get('measurements')
@@ -421,10 +1138,8 @@ class Simulator:
             data = np.reshape(frame, (rgb['shape'][0], rgb['shape'][1]))
 
         if self.params.get('save_png'):
-            if image is None:
-                image = Image.frombytes(mode,(data.shape[0], data.shape[1]),data)
             cnt = self.stats_counter['frames_received']
-            image.save(os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
+            self._dump_sensor(_save_image, mode, np.array(data), os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
 
         return {'image': image, 'data': data}
 
@@ -433,7 +1148,7 @@ class Simulator:
         frame = depth['data']
         encoding = depth.get('encoding')
         data = None
-        data_clean = None
+        data_clean = depth.get('data_clean')
         image = None
 
         # depths
@@ -447,23 +1162,33 @@ class Simulator:
             #self._logger.info(dims)
             data = np.reshape(frame, (depth['shape'][0], depth['shape'][1]))
             mode = 'L'
-            # TODO: need to make sure in meters and is float32 for depth sensor noise simulation
-            depth_sensor = self._sensors_by_name[name]
-            if depth_sensor.noise_sim is not None:
-                # Simulate noise
-                data_clean = np.copy(data)  # TODO: Is this copying unnecessarily expensive, should there be a flag guarding against this?
-                depth_sensor.noise_sim.simulate(data)
 
         if self.params.get('save_png'):
-            if image is None:
-                # self._logger.info('type is %s' % type(data))
-                d = data.astype(np.float32)
-                d = (d * (255.0 / np.max(d))).astype(np.uint8)
-                image = Image.frombytes(mode,(d.shape[0], d.shape[1]),d)
             cnt = self.stats_counter['frames_received']
-            image.save(os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
+            self._dump_sensor(_save_depth_image, mode, np.array(data), os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
         return {'image': image, 'data': data, 'data_clean': data_clean}
 
+    def __simulate_depth_noise(self, depths):
+        """Simulates noise for depth sensors, batching frames that share a noise simulator and shape"""
+        batches = collections.OrderedDict()
+        for name, depth in depths.items():
+            encoding = depth.get('encoding')
+            depth_sensor = self._sensors_by_name[name]
+            if depth_sensor.noise_sim is None or (encoding != 'depth' and encoding != 'binned'):
+                continue
+            # TODO: need to make sure in meters and is float32 for depth sensor noise simulation
+            shape = (depth['shape'][0], depth['shape'][1])
+            key = (id(depth_sensor.noise_sim), shape)
+            batches.setdefault(key, (depth_sensor.noise_sim, []))[1].append(name)
+        for noise_sim, names in batches.values():
+            # Stacking copies the frames so the clean frames are kept as is
+            data = np.stack([np.reshape(depths[name]['data'], depths[name]['shape'][0:2]) for name in names])
+            data_clean = np.copy(data)
+            noise_sim.simulate_batch(data)
+            for i, name in enumerate(names):
+                depths[name]['data'] = data[i]
+                depths[name]['data_clean'] = data_clean[i]
+
     def __process_camera_frame(self, name, f):
         """Converts generic camera based frame (assume to be rgba) bytes to Image and reshapes"""
         if type(f)==list:
@@ -475,11 +1200,9 @@ class Simulator:
 
         image = None
         if self.params.get('save_png'):
-            if image is None:
-                imgd = data_viz if data_viz is not None else data
-                image = Image.frombytes('RGBA',(imgd.shape[0], imgd.shape[1]),imgd)
+            imgd = data_viz if data_viz is not None else data
             cnt = self.stats_counter['frames_received']
-            image.save(os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
+            self._dump_sensor(_save_image, 'RGBA', np.array(imgd), os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
 
         return {'image': image, 'data': data, 'data_viz': data_viz}
 
@@ -492,8 +1215,7 @@ class Simulator:
 
         # TODO: Change save_png flag to more generic save sensor output flag
         if self.params.get('save_png'):
-            wavfile.write(os.path.join(self._output_dir, name + '.wav'), sample_rate, data)
-            np.savetxt(os.path.join(self._output_dir, name + '.wav.txt'), data)
+            self._dump_sensor(_save_audio, sample_rate, np.array(data), os.path.join(self._output_dir, name + '.wav'))
 
         return {'data': data}
 
@@ -501,13 +1223,19 @@ class Simulator:
         data = force['data']
         # TODO: Change save_png flag to more generic save sensor output flag
         if self.params.get('save_png'):
-            plt = common.bearing_plot(data)
             cnt = self.stats_counter['frames_received']
-            plt.savefig(os.path.join(self._output_dir, name + ('_%d.png' % cnt)), dpi=25)
-            plt.close()
+            self._dump_sensor(_save_force_plot, np.array(data), os.path.join(self._output_dir, name + ('_%d.png' % cnt)))
         return {'data': data}
 
-    def __process_observation(self, data):
+    def _dump_sensor(self, fn, *args):
+        """Queues sensor dump to be written in the background (off the step path)"""
+        if self._sensor_dump_writer is None:
+            self._sensor_dump_writer = SensorDumpWriter(max_backlog=self.params.get('save_png_backlog', 64),
+                                                        policy=self.params.get('save_png_policy', 'drop'),
+                                                        logger=self._logger)
+        self._sensor_dump_writer.submit(fn, *args)
+
+    def __process_observation(self, data, rpc_name='action'):
         observation = data['observation']
         sensors = observation['sensors']
         if observation.get('map') is not None:
@@ -515,6 +1243,12 @@ class Simulator:
             if type(observation['map'])==list:
                 observation['map']=observation['map'][0]
             observation['map']['data'] = converted['data']
+        # Simulate depth noise for all depth sensors together
+        depths = {name: sensor_data for name, sensor_data in sensors.items() if sensor_data.get('type') == 'depth'}
+        if len(depths) > 0:
+            start_time = timer()
+            self.__simulate_depth_noise(depths)
+            self.latency_stats.add(rpc_name, 'noise', timer() - start_time)
         # Go over observations from sensors and process them
         for name, sensor_data in sensors.items():
             sensor_type = sensor_data.get('type')
@@ -538,12 +1272,14 @@ class Simulator:
                     sensor_data['data'] = converted['data']
                     sensor_data['data_viz'] = converted['data_viz']
 
-    def __process_goal_observations(self, goal_observations):
+    def __process_goal_observations(self, goal_observations, rpc_name):
         if goal_observations is not None:
             for i, obs in enumerate(goal_observations):
-                self.__process_observation(obs)
+                start_time = timer()
+                self.__process_observation(obs, rpc_name)
+                self.latency_stats.add(rpc_name, 'process_observation', timer() - start_time)
 
-    def on_observation(self, message):
+    def on_observation(self, message, rpc_name='action'):
         self.stats_counter.update(['frames_received'])
         data = message.get('data') if message is not None else None
         if data is not None:
@@ -551,7 +1287,9 @@ class Simulator:
                 err_str = self.id + ':Received data message with no observation : ' + str(data)
                 self._logger.error(err_str)
                 raise Exception(err_str)
-            self.__process_observation(data)
+            start_time = timer()
+            self.__process_observation(data, rpc_name)
+            self.latency_stats.add(rpc_name, 'process_observation', timer() - start_time)
         else:
             self.stats_counter.update(['empty_frames_received'])
         self._last_observation = data  # save last observation
@@ -562,8 +1300,8 @@ class Simulator:
             return False
         else:
             self.start_summary_info = message.get('data')
-            self.__process_goal_observations(self.start_summary_info.get('goalObservations'))
-            self.step({'name': 'idle'}, 1)  # take a first step to fill last observation
+            self.__process_goal_observations(self.start_summary_info.get('goalObservations'), 'start')
+            self._step({'name': 'idle'}, 1, 'start')  # take a first step to fill last observation
             #self._logger.info('started')
             return True
 
@@ -572,8 +1310,8 @@ class Simulator:
             return False
         else:
             self.start_summary_info = message.get('data')
-            self.__process_goal_observations(self.start_summary_info.get('goalObservations'))
-            self.step({'name': 'idle'}, 1)  # take a first step to fill last observation
+            self.__process_goal_observations(self.start_summary_info.get('goalObservations'), 'reset')
+            self._step({'name': 'idle'}, 1, 'reset')  # take a first step to fill last observation
             return True
 
     def on_inited(self, message):
@@ -601,9 +1339,16 @@ class Simulator:
             for handler in self._logger.handlers:
                 handler.flush()
 
-    def stop_child_servers(self):
+    def stop_child_servers(self, reusable=True):
+        """Stops sim and audio servers (a pooled sim server is returned to the pool instead, and is only
+        reused by other simulators if reusable)"""
         self._logger.info(self.id + ':Stopping child servers')
-        if self._proc_sim:
+        if self._pooled_server is not None:
+            self._logger.info(self.id + ':Releasing sim pid %d' % self._pooled_server.proc.pid)
+            self._server_pool.release(self._pooled_server, reusable=reusable)
+            self._pooled_server = None
+            self._proc_sim = None
+        elif self._proc_sim:
             self._logger.info(self.id + ':Killing sim pid %d' % self._proc_sim.pid)
             try:
                 os.killpg(os.getpgid(self._proc_sim.pid), signal.SIGTERM)
@@ -624,8 +1369,17 @@ class Simulator:
     def kill(self):
         self._logger.info(self.id + ':Stopping the simulator')
         self._logger.info(self.stats_counter)
+        self.log_latency_stats()
         if self.running:
             self.close(seconds=1)
         self.stop_child_servers()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+        for port in list(self._allocated_ports):
+            self._release_port(port)
+        if self._sensor_dump_writer is not None:
+            self._sensor_dump_writer.close()
+            self._sensor_dump_writer = None
         self._logger.info(self.id + ':Simulator killed.')
         self.killed = True
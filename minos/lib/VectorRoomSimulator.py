@@ -0,0 +1,240 @@
+import copy
+import multiprocessing as mp
+import os
+import traceback
+
+import numpy as np
+
+from .RoomSimulator import RoomSimulator
+from .Simulator import Simulator
+
+CLOSE_TIMEOUT = 30  # seconds to wait for a worker to close its simulator before terminating it
+
+
+def _get_outputs(response, outputs):
+    """Extracts requested outputs from RoomSimulator response as numpy arrays"""
+    observation = response['observation']
+    sensors = observation.get('sensors', {})
+    result = {}
+    for outp in outputs:
+        if outp == 'measurements':
+            result[outp] = np.asarray(response['measurements'])
+        elif outp == 'rewards':
+            result[outp] = np.asarray(response['rewards'] or 0.0)
+        elif outp == 'terminals':
+            result[outp] = np.asarray(bool(response['terminals']))
+        elif outp == 'depth_clean':
+            depth = sensors.get('depth')
+            if depth is not None:
+                data_clean = depth.get('data_clean')
+                result[outp] = np.asarray(data_clean if data_clean is not None else depth['data'])
+        elif outp in sensors:
+            result[outp] = np.asarray(sensors[outp]['data'])
+    return result
+
+
+def _to_tuples(space):
+    # BoxSpace namedtuples are not picklable (nested in Simulator), send them as tuples
+    if isinstance(space, dict):
+        return {k: _to_tuples(v) for k, v in space.items()}
+    elif isinstance(space, tuple):
+        return tuple(space)
+    return space
+
+
+def _from_tuples(space):
+    if isinstance(space, dict):
+        return {k: _from_tuples(v) for k, v in space.items()}
+    elif isinstance(space, tuple):
+        return Simulator.BoxSpace(*space)
+    return space
+
+
+def _handle_command(sim, cmd, data, outputs):
+    if cmd == 'step':
+        response = sim.step(data)
+        result = _get_outputs(response, outputs)
+        info = {'success': response['success'], 'info': response.get('info')}
+        if response['terminals']:
+            # auto reset, returning observations from start of new episode
+            res = sim.reset()
+            info['terminal_observation'] = result
+            info['episode_info'] = res['episode_info']
+            result = _get_outputs(res['observation'], outputs)
+            for k in ['rewards', 'terminals']:
+                if k in result:
+                    result[k] = info['terminal_observation'][k]
+        return result, info
+    elif cmd == 'reset':
+        res = sim.reset(force=data)
+        return _get_outputs(res['observation'], outputs), {'episode_info': res['episode_info']}
+    elif cmd == 'get_observation_space':
+        return _to_tuples(sim.get_observation_space(outputs))
+    elif cmd == 'set_episode_schedule':
+        sim.set_episode_schedule(data, end_current_episode=True)
+        return True
+    else:
+        raise ValueError('Unknown command ' + cmd)
+
+
+def _worker(remote, parent_remote, params):
+    # replies are ('ok', result) or ('error', traceback) so that the parent can re-raise worker errors
+    parent_remote.close()
+    sim = None
+    init_error = None
+    try:
+        sim = RoomSimulator(params)
+    except Exception:
+        init_error = traceback.format_exc()
+    outputs = params['outputs']
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'close':
+                break
+            if init_error is not None:
+                remote.send(('error', init_error))
+                continue
+            try:
+                remote.send(('ok', _handle_command(sim, cmd, data, outputs)))
+            except Exception:
+                remote.send(('error', traceback.format_exc()))
+    except KeyboardInterrupt:
+        print('VectorRoomSimulator worker: got KeyboardInterrupt')
+    except (EOFError, BrokenPipeError):
+        pass  # parent went away
+    finally:
+        if sim is not None:
+            sim.close()
+        remote.close()
+
+
+class VectorRoomSimulator:
+    """Runs several RoomSimulators (each in its own process) and steps them together"""
+
+    def __init__(self, params, num_simulators=None):
+        self.num_simulators = num_simulators or params.get('num_simulators', 1)
+        self.outputs = params.get('outputs', ['color', 'measurements', 'rewards', 'terminals'])
+        self.waiting = False
+        self.closed = False
+
+        self._remotes = []
+        self._processes = []
+        seed = params.get('seed', 0)
+        logdir = params.get('logdir', 'logs')
+        for i in range(self.num_simulators):
+            worker_params = copy.copy(params)
+            worker_params['outputs'] = self.outputs
+            worker_params['id'] = 'sim%02d' % i
+            worker_params['seed'] = seed + i
+            worker_params['logdir'] = os.path.join(logdir, worker_params['id'])
+            remote, worker_remote = mp.Pipe()
+            process = mp.Process(target=_worker, args=(worker_remote, remote, worker_params))
+            process.daemon = True  # if the main process crashes, we should not cause things to hang
+            process.start()
+            worker_remote.close()
+            self._remotes.append(remote)
+            self._processes.append(process)
+
+    def _stack(self, results):
+        outputs = {}
+        for k in results[0]:
+            outputs[k] = np.stack([r[k] for r in results])
+        return outputs
+
+    def _send_all(self, commands, remotes=None):
+        """Sends one command to each worker.  If a worker is gone, replies of the others are drained (so
+        the pipes stay in sync) and RuntimeError is raised"""
+        remotes = self._remotes if remotes is None else remotes
+        sent = []
+        errors = []
+        for i, (remote, command) in enumerate(zip(remotes, commands)):
+            try:
+                remote.send(command)
+                sent.append(remote)
+            except OSError as e:
+                errors.append('sim%02d: Worker process exited (%s)' % (i, repr(e)))
+        if len(errors) > 0:
+            try:
+                self._recv_all(sent)
+            except RuntimeError:
+                pass
+            raise RuntimeError('VectorRoomSimulator worker failed\n' + '\n'.join(errors))
+
+    def _recv_all(self, remotes=None):
+        """Receives one reply from each worker.  Raises RuntimeError with the worker traceback if any
+        worker failed (after all replies are received, so that the pipes stay in sync)"""
+        replies = []
+        errors = []
+        for i, remote in enumerate(self._remotes if remotes is None else remotes):
+            try:
+                status, result = remote.recv()
+            except (EOFError, OSError) as e:
+                status, result = 'error', 'Worker process exited (%s)' % repr(e)
+            if status == 'error':
+                errors.append('sim%02d: %s' % (i, result))
+            replies.append(result)
+        if len(errors) > 0:
+            raise RuntimeError('VectorRoomSimulator worker failed\n' + '\n'.join(errors))
+        return replies
+
+    def reset(self, force=False):
+        """Resets all simulators.  Returns dictionary of stacked outputs and list of episode infos"""
+        self._send_all([('reset', force)] * self.num_simulators)
+        results, infos = zip(*self._recv_all())
+        outputs = self._stack(results)
+        outputs['infos'] = list(infos)
+        return outputs
+
+    def step_async(self, actions):
+        """Sends one action to each simulator without waiting for the results"""
+        if self.waiting:
+            raise RuntimeError('step_async called before step_wait')
+        self._send_all([('step', action) for action in actions])
+        self.waiting = True
+
+    def step_wait(self):
+        """Waits for results of step_async.  Returns dictionary of stacked outputs and list of infos.
+        Simulators with finished episodes are reset, with terminal observations kept in their infos"""
+        self.waiting = False
+        results, infos = zip(*self._recv_all())
+        outputs = self._stack(results)
+        outputs['infos'] = list(infos)
+        return outputs
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def get_observation_space(self):
+        self._send_all([('get_observation_space', None)], self._remotes[:1])
+        return _from_tuples(self._recv_all(self._remotes[:1])[0])
+
+    def set_episode_schedule(self, schedule):
+        self._send_all([('set_episode_schedule', schedule)] * self.num_simulators)
+        return self._recv_all()
+
+    def close(self):
+        """Stops all simulators (workers that already died are skipped)"""
+        if self.closed:
+            return
+        self.closed = True
+        for remote in self._remotes:
+            try:
+                if self.waiting:
+                    remote.recv()
+                remote.send(('close', None))
+            except (EOFError, OSError):
+                pass  # worker is gone
+        self.waiting = False
+        for process in self._processes:
+            process.join(timeout=CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for remote in self._remotes:
+            remote.close()
+
+    def __del__(self):
+        if not self.closed:
+            self.close()
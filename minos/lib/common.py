@@ -1,27 +1,50 @@
 import atexit
 import csv
 import os
-import platform
-import psutil
-import random
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 from .util.EpisodeScheduler import EpisodeScheduler
+from .util.PortAllocator import PortAllocator, is_listening, parse_port_range
+from .util.SimServerPool import SimServerPool
 from .util.StateSet import StateSet, Select, SelectPolicy
 
 
-def get_random_port():
-    rand = random.Random()
-    while True:
-        port = rand.randint(10000, 60000)
-        my_os = platform.system()
-        if 'Darwin' in my_os:  # checking open ports with psutil on Mac requires root!
-            return port
-        used_ports = [x.laddr[1] for x in psutil.net_connections()]
-        if port not in used_ports:
-            return port
+_port_allocators = {}
+
+
+def get_port_allocator(port_range=None):
+    """Returns port allocator (shared by simulators of this process) for port range"""
+    port_range = parse_port_range(port_range)
+    allocator = _port_allocators.get(port_range)
+    if allocator is None:
+        allocator = PortAllocator(port_range)
+        _port_allocators[port_range] = allocator
+    return allocator
+
+
+def get_random_port(port_range=None):
+    """Returns free port (assigned by OS or from port range, reserved across processes)"""
+    return get_port_allocator(port_range).allocate()
+
+
+def release_port(port, port_range=None):
+    get_port_allocator(port_range).release(port)
+
+
+_sim_server_pool = None
+
+
+def get_sim_server_pool(config=None):
+    """Returns pool of warm simulator servers shared by simulators of this process
+    (created with configuration of first caller)"""
+    global _sim_server_pool
+    if _sim_server_pool is None:
+        config = config or {}
+        _sim_server_pool = SimServerPool(max_idle=config.get('max_idle', 4), max_rss_mb=config.get('max_rss_mb'),
+                                         max_leases=config.get('max_leases'))
+    return _sim_server_pool
 
 
 def add_localhost_to_noproxy():
@@ -7,11 +7,16 @@ from PIL import Image
 
 
 class DepthNoiseSim():
-    def __init__(self, near, far, mean, sigma):
+    def __init__(self, near, far, mean, sigma, seed=None):
         self.mean = mean
         self.sigma = sigma
         self.near = near
         self.far = far
+        self.random = np.random.default_rng(seed)
+        self._noise = None
+
+    def seed(self, s):
+        self.random = np.random.default_rng(s)
 
     '''Reads and simulate noise on inputpng and write output to outputpng'''
     def process_image(self, inputpng, outputpng):
@@ -22,10 +27,21 @@ class DepthNoiseSim():
 
     '''Simulate noise over depth values in buffer and modifies it'''
     def simulate(self, buffer):
-        gauss = np.random.normal(self.mean, self.sigma, buffer.shape)
-        buffer += gauss
-        noisy = buffer
-        noisy[noisy > self.far] = 0
-        noisy[noisy < self.near] = 0
+        self.simulate_batch(buffer[np.newaxis])
+        return buffer
+
+    '''Simulate noise over stack of depth frames (N x H x W) in buffers and modifies it'''
+    def simulate_batch(self, buffers):
+        # Reuse preallocated noise buffer across calls with the same shape
+        dtype = buffers.dtype if buffers.dtype == np.float32 else np.float64
+        if self._noise is None or self._noise.shape != buffers.shape or self._noise.dtype != dtype:
+            self._noise = np.empty(buffers.shape, dtype=dtype)
+        gauss = self._noise
+        self.random.standard_normal(out=gauss, dtype=dtype)
+        gauss *= self.sigma
+        gauss += self.mean
+        buffers += gauss
+        noisy = buffers
+        noisy[(noisy > self.far) | (noisy < self.near)] = 0
         return noisy
 
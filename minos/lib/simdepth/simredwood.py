@@ -3,7 +3,9 @@
 # Simulates Kinect noise with distortion model that is loaded from file
 # This noise simulator has the following issues:
 # - It is not very robust (resolution was hard coded)
-# - It is also extremely slow!  Takes about 1sec frame with noise enabled for 320x320
+# - The original per-pixel implementation (simulate_per_pixel) is extremely slow!
+#   Takes about 1sec frame with noise enabled for 320x320
+#   simulate is an array based implementation of the same model that should be used instead
 
 
 import numpy as np
@@ -15,11 +17,44 @@ from multiprocessing import Pool
 
 
 class RedwoodDepthNoiseSim:
-    def __init__(self, model_filename=None):
+    # Kinect disparity constants (baseline * focal length) and disparity quantization (subpixel steps)
+    DISPARITY_NUMERATOR = 35.130
+    DISPARITY_STEPS = 8
+    DISPARITY_SIGMA = 0.027778
+    SHUFFLE_SIGMA = 0.25
+
+    def __init__(self, model_filename=None, seed=None):
         self.distmodel = None
+        self.random = np.random.default_rng(seed)
+        self._buffers = {}
         if model_filename is not None:
             self.loaddistmodel(model_filename)
 
+    def seed(self, s):
+        self.random = np.random.default_rng(s)
+
+    def _get_buffer(self, name, shape, dtype=np.float64):
+        # Reuse preallocated buffers across calls with the same frame shape
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def _get_normal(self, name, shape, sigma):
+        noise = self._get_buffer(name, shape)
+        self.random.standard_normal(out=noise)
+        noise *= sigma
+        return noise
+
+    def _get_pixel_indices(self, shape):
+        key = ('indices', shape)
+        indices = self._buffers.get(key)
+        if indices is None:
+            indices = np.indices(shape)
+            self._buffers[key] = indices
+        return indices
+
     '''Loads distortion model'''
     def loaddistmodel(self, fname):
         data = np.loadtxt(fname, comments='%', skiprows=5)
@@ -54,8 +89,52 @@ class RedwoodDepthNoiseSim:
         self.simulate(a)
         Image.fromarray((a * 1000).astype(np.int32)).save(outputpng)
 
+    '''Vectorized version of distort over arrays of pixel coordinates and depths'''
+    def distort_array(self, x, y, z):
+        i2 = np.floor((z + 1) / 2).astype(np.int64)
+        i1 = i2 - 1
+        a = (z - (i1 * 2 + 1)) / 2
+        x = np.minimum(x // 8, self.distmodel.shape[1] - 1)
+        y = np.minimum(y // 6, self.distmodel.shape[0] - 1)
+        f = (1 - a) * self.distmodel[y, x, np.clip(i1, 0, 4)] + a * self.distmodel[y, x, np.clip(i2, 0, 4)]
+        nonzero = f != 0
+        return np.where(nonzero, z / np.where(nonzero, f, 1), 0)
+
     '''Simulate noise over depth values in buffer and modifies it'''
     def simulate(self, buffer):
+        self.simulate_batch(buffer[np.newaxis])
+        return buffer
+
+    '''Simulate noise over stack of depth frames (N x H x W) in buffers and modifies it'''
+    def simulate_batch(self, buffers):
+        n, h, w = buffers.shape
+        shuffle = self._get_normal('shuffle', (2, n, h, w), self.SHUFFLE_SIGMA)
+        ys, xs = self._get_pixel_indices((h, w))
+        fs = np.arange(n).reshape(n, 1, 1)
+
+        # pixel shuffle
+        x = np.clip(np.rint(xs + shuffle[1]), 0, w - 1).astype(np.int64)
+        y = np.clip(np.rint(ys + shuffle[0]), 0, h - 1).astype(np.int64)
+
+        # downsample
+        d = buffers[fs, y - y % 2, x - x % 2].astype(np.float64)
+
+        # distortion
+        d = self.distort_array(x, y, d)
+
+        # quantization and high freq noise
+        k = self.DISPARITY_NUMERATOR
+        steps = self.DISPARITY_STEPS
+        valid = d != 0
+        disparity = k / np.where(valid, d, 1) + self._get_normal('disparity', (n, h, w), self.DISPARITY_SIGMA)
+        denom = np.rint(disparity * steps)
+        quantized = denom != 0
+        out = np.where(quantized, k * steps / np.where(quantized, denom, 1), d)
+        buffers[...] = np.where(valid, out, 0)
+        return buffers
+
+    '''Simulate noise over depth values in buffer one pixel at a time (slow reference implementation)'''
+    def simulate_per_pixel(self, buffer):
         a = buffer
         b = np.copy(a)
         it = np.nditer(a, flags=['multi_index'], op_flags=['writeonly'])
@@ -64,8 +143,8 @@ class RedwoodDepthNoiseSim:
         xmax = buffer.shape[1] - 1
         while not it.finished:
             # pixel shuffle
-            x = min(max(round(it.multi_index[1] + np.random.normal(0, 0.25)), 0), xmax)
-            y = min(max(round(it.multi_index[0] + np.random.normal(0, 0.25)), 0), ymax)
+            x = min(max(round(it.multi_index[1] + self.random.normal(0, self.SHUFFLE_SIGMA)), 0), xmax)
+            y = min(max(round(it.multi_index[0] + self.random.normal(0, self.SHUFFLE_SIGMA)), 0), ymax)
 
             # downsample
             d = b[y - y % 2, x - x % 2]
@@ -77,9 +156,11 @@ class RedwoodDepthNoiseSim:
             if d == 0:
                 it[0] = 0
             else:
-                denom = round((35.130 / d + np.random.normal(0, 0.027778)) * 8)
+                k = self.DISPARITY_NUMERATOR
+                steps = self.DISPARITY_STEPS
+                denom = round((k / d + self.random.normal(0, self.DISPARITY_SIGMA)) * steps)
                 if denom != 0:
-                    it[0] = 35.130 * 8 / denom
+                    it[0] = k * steps / denom
                 else:
                     it[0] = d
 
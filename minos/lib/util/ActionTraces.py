@@ -1,5 +1,11 @@
 import csv
 
+import numpy as np
+
+# Numeric columns of action trace files (other columns are strings)
+INT_FIELDS = ['episode', 'tick']
+FLOAT_FIELDS = ['px', 'py', 'pz', 'rotation']
+
 
 # TODO(MS) get rid of this default task-to-goal mapping by storing goal specs in action trace header
 TASK_TO_DEFAULT_GOAL = {
@@ -45,6 +51,100 @@ class ActionTrace:
             self.actions.append(r)
 
 
+def _read_csv_records(csvfile):
+    """Yields parsed records of action trace csv file"""
+    #    episode,sceneId,tick,px,py,pz,rotation,actions,actionArgs
+    #    1,p5dScene.bf3c229ca4d17aa0854665c47632952b,0,-42.6000,1.0800,-39.0400,,goal,0_14
+    #    -,-,1,-37.9170,0.5950,-38.6200,2.9940,idle
+    with open(csvfile) as f:
+        reader = csv.DictReader(f)
+        prev_record = None
+        for r in reader:
+            for f,v in r.items():
+                if v == '-':
+                    r[f] = prev_record[f]
+                if r[f] == '':
+                    r[f] = None
+            for f in INT_FIELDS:
+                if r[f] is not None:
+                   r[f] = int(r[f])
+            for f in FLOAT_FIELDS:
+                if r[f] is not None:
+                    r[f] = float(r[f])
+            yield r
+            prev_record = r
+
+
+def _read_binary_records(npzfile):
+    """Yields records of action traces converted with write_binary_traces"""
+    with np.load(npzfile) as data:
+        columns = data['columns'].tolist()
+        strings = data['strings'].tolist()
+        values = {c: data['col_' + c] for c in columns}
+    for i in range(len(values[columns[0]])):
+        r = {}
+        for c in columns:
+            v = values[c][i].item()
+            if c in INT_FIELDS:
+                r[c] = v
+            elif c in FLOAT_FIELDS:
+                r[c] = None if v != v else v   # NaN for missing values
+            else:
+                r[c] = strings[v] if v >= 0 else None
+        yield r
+
+
+def iter_action_traces(log_file):
+    """Yields action traces of log file (csv or binary npz) one at a time"""
+    records = _read_binary_records(log_file) if log_file.endswith('.npz') else _read_csv_records(log_file)
+    trace = None
+    prev_record = None
+    for r in records:
+        if prev_record is None or r['episode'] != prev_record['episode']:
+            # New trace
+            if trace is not None:
+                yield trace
+            trace = ActionTrace(r)
+        else:
+            # Append to old trace
+            trace.append(r)
+        prev_record = r
+    if trace is not None:
+        yield trace
+
+
+def write_binary_traces(csvfile, output=None):
+    """Converts action traces csv file into compact binary npz (numeric columns as arrays, strings as
+    indices into table of strings).  Returns path of written file"""
+    if output is None:
+        output = (csvfile[:-len('.csv')] if csvfile.endswith('.csv') else csvfile) + '.npz'
+    records = list(_read_csv_records(csvfile))
+    columns = list(records[0].keys()) if len(records) > 0 else []
+    strings = []
+    string_indices = {}
+
+    def intern(s):
+        if s is None:
+            return -1
+        index = string_indices.get(s)
+        if index is None:
+            index = len(strings)
+            strings.append(s)
+            string_indices[s] = index
+        return index
+
+    arrays = {}
+    for c in columns:
+        if c in INT_FIELDS:
+            arrays['col_' + c] = np.array([r[c] for r in records], dtype=np.int64)
+        elif c in FLOAT_FIELDS:
+            arrays['col_' + c] = np.array([np.nan if r[c] is None else r[c] for r in records], dtype=np.float64)
+        else:
+            arrays['col_' + c] = np.array([intern(r[c]) for r in records], dtype=np.int32)
+    np.savez_compressed(output, columns=np.array(columns), strings=np.array(strings, dtype=np.str_), **arrays)
+    return output
+
+
 class ActionTraces:
     """ Wrapper for a set of action traces """
     def __init__(self, log_file):
@@ -58,35 +158,19 @@ class ActionTraces:
         self.index += 1
         return self.curr_trace()
 
-    def _load_action_traces(self, csvfile):
-        #    episode,sceneId,tick,px,py,pz,rotation,actions,actionArgs
-        #    1,p5dScene.bf3c229ca4d17aa0854665c47632952b,0,-42.6000,1.0800,-39.0400,,goal,0_14
-        #    -,-,1,-37.9170,0.5950,-38.6200,2.9940,idle
-        traces = []
-        int_fields = ['episode', 'tick']
-        float_fields = ['px', 'py', 'pz', 'rotation']
-        with open(csvfile) as f:
-            reader = csv.DictReader(f)
-            prev_record = None
-            trace = None
-            for r in reader:
-                for f,v in r.items():
-                    if v == '-':
-                        r[f] = prev_record[f]
-                    if r[f] == '':
-                        r[f] = None
-                for f in int_fields:
-                    if r[f] is not None:
-                       r[f] = int(r[f])
-                for f in float_fields:
-                    if r[f] is not None:
-                        r[f] = float(r[f])
-                if prev_record is None or r['episode'] != prev_record['episode']:
-                    # New trace
-                    trace = ActionTrace(r)
-                    traces.append(trace)
-                else:
-                    # Append to old trace
-                    trace.append(r)
-                prev_record = r
-        return traces
+    def _load_action_traces(self, log_file):
+        return list(iter_action_traces(log_file))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert action trace csv files to compact binary form')
+    parser.add_argument('input', nargs='+',
+                        help='Action trace csv files to convert')
+    args = parser.parse_args()
+    for csvfile in args.input:
+        print('Wrote ' + write_binary_traces(csvfile))
+
+
+if __name__ == "__main__":
+    main()
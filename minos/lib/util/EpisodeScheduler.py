@@ -1,3 +1,4 @@
+import collections
 import math
 import random
 
@@ -14,9 +15,11 @@ class EpisodeScheduler:
         self.state_index = -1
         self.scene_index = -1
         self.scene_id = None
+        self._upcoming_scene_ids = collections.deque()  # scenes already drawn for random schedule
 
     def seed(self, s):
         self.random.seed(s)
+        self._upcoming_scene_ids.clear()
 
     def next_episode(self):
         if self.schedule == 'random':
@@ -38,11 +41,25 @@ class EpisodeScheduler:
     def get_all_scene_ids(self):
         return [s['id'] for s in self.state_set.get_scenes()]
 
+    def peek_scene_ids(self, k):
+        """Returns ids of the next k scenes that will be switched to (without advancing the schedule)"""
+        scenes = self.state_set.get_scenes()
+        if self.schedule == 'random':
+            # draw scenes ahead of time (in same order as they would be drawn)
+            while len(self._upcoming_scene_ids) < k:
+                self._upcoming_scene_ids.append(self.random.choice(scenes)['id'])
+            return list(self._upcoming_scene_ids)[:k]
+        elif self.schedule == 'fixed':
+            return [scenes[(self.scene_index + i) % len(scenes)]['id'] for i in range(1, k + 1)]
+
     def _next_random_state(self):
         scenes = self.state_set.get_scenes()
         if self.num_episodes_this_scene % self.num_episodes_per_scene == 0:
             # print('picking random from', scenes)
-            self.scene_id = self.random.choice(scenes)['id']
+            if len(self._upcoming_scene_ids) > 0:
+                self.scene_id = self._upcoming_scene_ids.popleft()
+            else:
+                self.scene_id = self.random.choice(scenes)['id']
         self.num_episodes_this_scene += 1
         return {'scene_id': self.scene_id}
 
@@ -0,0 +1,95 @@
+import collections
+import math
+
+
+class LatencyHistogram:
+    """ Histogram of durations (in seconds) with logarithmically spaced buckets """
+    BUCKETS_PER_DECADE = 10
+    MIN_SECS = 1e-6
+    MAX_SECS = 1e3
+
+    def __init__(self):
+        self.num_buckets = int(math.log10(self.MAX_SECS / self.MIN_SECS) * self.BUCKETS_PER_DECADE) + 1
+        self.counts = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, secs):
+        if secs <= self.MIN_SECS:
+            return 0
+        b = int(math.ceil(math.log10(secs / self.MIN_SECS) * self.BUCKETS_PER_DECADE))
+        return min(b, self.num_buckets - 1)
+
+    def bucket_limit(self, b):
+        """Upper limit (in seconds) of bucket"""
+        return self.MIN_SECS * 10 ** (b / self.BUCKETS_PER_DECADE)
+
+    def add(self, secs):
+        self.counts[self._bucket(secs)] += 1
+        self.count += 1
+        self.total += secs
+        self.min = secs if self.min is None else min(self.min, secs)
+        self.max = secs if self.max is None else max(self.max, secs)
+
+    def percentile(self, p):
+        """Approximate percentile (upper limit of bucket containing it, clamped to max)"""
+        if self.count == 0:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for b, c in enumerate(self.counts):
+            seen += c
+            if c > 0 and seen >= target:
+                return min(self.bucket_limit(b), self.max)
+        return self.max
+
+    def get_buckets(self):
+        """Returns list of (bucket upper limit in seconds, count) for non empty buckets"""
+        return [(self.bucket_limit(b), c) for b, c in enumerate(self.counts) if c > 0]
+
+    def summary(self):
+        return {'count': self.count, 'secs': self.total,
+                'mean_secs': self.total / self.count if self.count else 0,
+                'min_secs': self.min, 'max_secs': self.max,
+                'p50_secs': self.percentile(50), 'p90_secs': self.percentile(90), 'p99_secs': self.percentile(99)}
+
+
+class LatencyStats:
+    """ Latency histograms keyed by rpc name and phase (e.g. emit, wait, decode, process_observation) """
+    def __init__(self):
+        self.histograms = collections.OrderedDict()
+
+    def add(self, name, phase, secs):
+        key = (name, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[key] = histogram
+        histogram.add(secs)
+
+    def get_histogram(self, name, phase):
+        return self.histograms.get((name, phase))
+
+    def get_stats(self, name=None):
+        """Returns summary (count, total, mean, min, max and percentiles in seconds) by rpc name and phase"""
+        stats = {}
+        for (n, phase), histogram in self.histograms.items():
+            if name is None or n == name:
+                stats.setdefault(n, {})[phase] = histogram.summary()
+        return stats
+
+    def reset(self):
+        self.histograms.clear()
+
+    def format(self):
+        """Returns table of latencies (in milliseconds) for logging"""
+        lines = ['%-24s %-20s %8s %9s %9s %9s %9s %9s' %
+                 ('rpc', 'phase', 'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')]
+        for (name, phase), histogram in self.histograms.items():
+            s = histogram.summary()
+            lines.append('%-24s %-20s %8d %9.3f %9.3f %9.3f %9.3f %9.3f' %
+                         (name, phase, s['count'], s['mean_secs'] * 1000, s['p50_secs'] * 1000,
+                          s['p90_secs'] * 1000, s['p99_secs'] * 1000, s['max_secs'] * 1000))
+        return '\n'.join(lines)
@@ -0,0 +1,707 @@
+import json
+import math
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import psutil
+
+from .ObservationCache import quantize_pose
+from .SharedMemoryRing import SharedMemoryRing
+
+# Mapping of numpy dtypes to array datatypes (as sent by the node server)
+DATATYPES = {
+    np.dtype('i1'): 'int8',
+    np.dtype('u1'): 'uint8',
+    np.dtype('i2'): 'int16',
+    np.dtype('u2'): 'uint16',
+    np.dtype('i4'): 'int32',
+    np.dtype('u4'): 'uint32',
+    np.dtype('f4'): 'float32',
+    np.dtype('f8'): 'float64'
+}
+
+# Observation flags and the sensor types they enable (besides sensors named after the flag)
+SENSOR_OBSERVATIONS = {'color': 'color', 'depth': 'depth', 'normal': 'normal', 'audio': 'audio', 'force': 'forces',
+                       'objectId': 'objectId', 'objectType': 'objectType', 'roomId': 'roomId',
+                       'roomType': 'roomType'}
+
+
+def _is_position(position):
+    # positions can also be given as 'random'
+    return isinstance(position, (list, tuple))
+
+
+class MockSimulation:
+    """ Stand-in for the simulator of server.js that returns synthetic observations
+
+    The agent moves in an empty square room with a goal position, so measurements (distance and
+    direction to goal) and episode termination behave like in a real scene.  Sensor frames have the
+    configured resolution but their content is random noise.
+
+    The mock behavior can be tuned with the `mock` configuration (sent by the client with init/configure):
+      latency: seconds to delay responses by (number for all events, or dictionary of event name to seconds
+               with '*' for other events)
+      jitter: fraction of latency to randomly add or subtract (uniform)
+      payload_bytes: size of extra opaque sensor frame ('payload') added to observations
+      capabilities: optional events handled (default all, see get_capabilities).  Other optional events are not
+                    answered, like by older versions of server.js (and neither is get_capabilities if it is
+                    not listed)
+    """
+    # events that only newer versions of server.js handle (reported by get_capabilities)
+    OPTIONAL_EVENTS = ['begin_episode', 'action_sequence', 'preload_scenes', 'render_poses', 'cached_action',
+                       'get_memory_usage', 'get_navmap', 'set_transport']
+    ROOM_SIZE = 10.0
+    STEP_SIZE = 0.25    # meters for move actions of strength 1
+    STEP_TIME = 0.2     # seconds of simulation time per action
+
+    def __init__(self, params=None, mock=None):
+        self.params = {'mock': dict(mock or {})}
+        self.rng = random.Random(0)
+        self.shm = None
+        self.created = False
+        self.started = False
+        self.time = 0.0
+        self.position = [0.0, 0.0, 0.0]
+        self.angle = 0.0
+        self.start_state = None
+        self.goal = None
+        self._frames = None
+        self._map_frame = None
+        self._configured_start = None
+        self._configured_goal = None
+        self._action_trace = []
+        if params:
+            self.configure(params)
+
+    def configure(self, opts):
+        opts = opts or {}
+        for k, v in opts.items():
+            if isinstance(v, dict) and isinstance(self.params.get(k), dict):
+                self.params[k].update(v)
+            else:
+                self.params[k] = v
+        if 'start' in opts:
+            self._configured_start = opts['start']
+        if 'goal' in opts:
+            goal = opts['goal']
+            self._configured_goal = goal if isinstance(goal, dict) and _is_position(goal.get('position')) else None
+        self._frames = None   # recreate frames (resolution or sensors may have changed)
+        return {k: v for k, v in self.params.items() if k not in ['sensors', 'semantic_encodings']}
+
+    def _create(self, params):
+        # like server.js, parameters of start are only used if the simulator was not created by init
+        if not self.created:
+            self.configure(params)
+            self.created = True
+
+    def seed(self, s):
+        self.rng.seed(s)
+
+    def get_latency(self, event):
+        """Returns seconds to delay response to event by"""
+        mock = self.params.get('mock') or {}
+        latency = mock.get('latency') or 0
+        if isinstance(latency, dict):
+            latency = latency.get(event, latency.get('*', 0))
+        jitter = mock.get('jitter') or 0
+        if latency > 0 and jitter > 0:
+            latency *= 1 + self.rng.uniform(-jitter, jitter)
+        return max(latency, 0)
+
+    def _get_sensors(self):
+        observations = self.params.get('observations', {'color': True})
+        width = self.params.get('width', 84)
+        height = self.params.get('height', 84)
+        sensors = []
+        for config in self.params.get('sensors', []):
+            group = config.get('modes') if config.get('type') == 'group' else [config]
+            for sensor in group:
+                if sensor.get('active') is False or config.get('active') is False:
+                    continue
+                flag = SENSOR_OBSERVATIONS.get(sensor['name'], sensor['name'])
+                if observations.get(flag):
+                    sensors.append((sensor, width, height))
+        if len(sensors) == 0 and observations.get('color', True):
+            sensors.append(({'name': 'color', 'type': 'color'}, width, height))
+        payload_bytes = (self.params.get('mock') or {}).get('payload_bytes')
+        if payload_bytes:
+            sensors.append(({'name': 'payload', 'type': 'payload', 'size': payload_bytes}, 1, 1))
+        return sensors
+
+    def _create_frame(self, sensor, width, height):
+        rs = np.random.RandomState(self.rng.randint(0, 2**31 - 1))
+        sensor_type = sensor['type']
+        frame = {'type': sensor_type}
+        if sensor_type == 'color':
+            encoding = self.params.get('color_encoding', 'gray')
+            channels = 1 if encoding == 'gray' else 4
+            frame.update({'encoding': encoding, 'shape': [height, width, channels],
+                          'data': rs.randint(0, 256, size=width * height * channels).astype(np.uint8)})
+        elif sensor_type == 'depth':
+            frame.update({'encoding': sensor.get('encoding', 'depth'), 'shape': [height, width, 1],
+                          'data': rs.uniform(0.5, 10, size=width * height).astype(np.float32)})
+        elif sensor_type == 'audio':
+            samples = 4410 * len(sensor.get('position', [[0]]))
+            frame.update({'encoding': 'pcm', 'shape': [samples], 'sampleRate': 44100,
+                          'data': rs.uniform(-1, 1, size=samples).astype(np.float32)})
+        elif sensor_type == 'force':
+            frame.update({'encoding': 'raw_contact', 'shape': [4],
+                          'data': np.zeros(4, dtype=np.float32)})
+        elif sensor_type == 'payload':
+            frame.update({'encoding': 'raw', 'shape': [sensor['size']],
+                          'data': rs.randint(0, 256, size=sensor['size']).astype(np.uint8)})
+        else:
+            # normal and semantic sensors are rgba frames
+            frame.update({'encoding': sensor.get('encoding'), 'shape': [height, width, 4],
+                          'data': rs.randint(0, 256, size=width * height * 4).astype(np.uint8)})
+        return frame
+
+    def _get_frames(self):
+        if self._frames is None:
+            self._frames = {sensor['name']: self._create_frame(sensor, width, height)
+                            for sensor, width, height in self._get_sensors()}
+            if self.params.get('observations', {}).get('map'):
+                # top down map of the scene
+                self._map_frame = self._create_frame({'name': 'map', 'type': 'map'}, 128, 128)
+            else:
+                self._map_frame = None
+        return self._frames
+
+    def get_observation_metadata(self):
+        sensors = {}
+        for name, frame in self._get_frames().items():
+            data_range = [0, 255] if frame['data'].dtype == np.uint8 else [-1, 1] if frame['type'] == 'audio' \
+                else [0, 20] if frame['type'] == 'depth' else [0, 1000]
+            sensors[name] = {'name': name, 'type': frame['type'], 'shape': frame['shape'], 'dataRange': data_range,
+                             'dataType': DATATYPES[frame['data'].dtype]}
+        h = self.ROOM_SIZE * math.sqrt(2)
+        measurements = {
+            'distance_to_goal': {'name': 'distance_to_goal', 'type': 'measurement', 'shape': [1],
+                                 'dataRange': [0, h], 'dataType': 'float64'},
+            'direction_to_goal': {'name': 'direction_to_goal', 'type': 'measurement', 'shape': [3],
+                                  'dataRange': [-1, 1], 'dataType': 'float64'},
+            'shortest_path_to_goal': {'name': 'shortest_path_to_goal', 'type': 'measurement', 'shape': [1],
+                                      'dataRange': [0, h], 'dataType': 'float64'}
+        }
+        return {'sensors': sensors, 'measurements': measurements}
+
+    def _random_position(self):
+        half = self.ROOM_SIZE / 2 - 0.5
+        return [self.rng.uniform(-half, half), 0.0, self.rng.uniform(-half, half)]
+
+    def start(self):
+        self.started = True
+        self._frames = None
+        return self.reset()
+
+    def reset(self):
+        start = self._configured_start
+        if isinstance(start, dict) and _is_position(start.get('position')):
+            self.position = list(start['position'])
+            self.angle = start['angle'] if start.get('angle') is not None else self.rng.uniform(0, 2 * math.pi)
+        else:
+            self.position = self._random_position()
+            self.angle = self.rng.uniform(0, 2 * math.pi)
+        goal = self._configured_goal
+        self.goal = {'type': 'position', 'position': list(goal['position']) if goal else self._random_position(),
+                     'room': 'mock_room', 'roomType': 'Living_Room', 'objectId': '', 'objectType': ''}
+        self.start_state = {'position': list(self.position), 'angle': self.angle, 'tilt': 0.0}
+        self.time = 0.0
+        self._action_trace = []
+        return self.get_episode_info()
+
+    def begin_episode(self, opts):
+        """Seeds, configures, starts (or resets) and steps, returning episode info and first step"""
+        if opts.get('start'):
+            self._create(opts.get('params'))
+        if opts.get('seed') is not None:
+            self.seed(opts['seed'])
+        if opts.get('config'):
+            self.configure(opts['config'])
+        episode_info = self.start() if opts.get('start') else self.reset()
+        if not opts.get('goalObservations'):
+            del episode_info['goalObservations']
+        if self.shm is not None:
+            self.shm.next_slot()
+        return {'episodeInfo': episode_info, 'step': self.step(opts.get('action') or {'name': 'idle'})}
+
+    def move_to(self, opts):
+        if opts.get('position') is not None:
+            self.position = list(opts['position'])
+        if opts.get('angle') is not None:
+            self.angle = opts['angle']
+        return {'position': list(self.position), 'angle': self.angle, 'tilt': opts.get('tilt') or 0.0}
+
+    def set_goal(self, goal):
+        goal = goal or {}
+        position = goal.get('position')
+        self.goal = dict(self.goal or {}, type='position',
+                         position=list(position) if position is not None else self._random_position())
+        return self.goal
+
+    def _distance_to_goal(self):
+        gp = self.goal['position']
+        return math.sqrt((self.position[0] - gp[0]) ** 2 + (self.position[2] - gp[2]) ** 2)
+
+    def get_episode_info(self):
+        scene = self.params.get('scene', {})
+        dist = self._distance_to_goal()
+        return {
+            'sceneId': scene.get('fullId', 'mock.mock_scene'),
+            'task': self.params.get('task', 'point_goal'),
+            'start': self.start_state,
+            'goal': self.goal,
+            'shortestPath': {'isValid': True, 'distance': dist, 'doors': [], 'rooms': [0]},
+            'bbox': {'min': [-self.ROOM_SIZE / 2, 0, -self.ROOM_SIZE / 2],
+                     'max': [self.ROOM_SIZE / 2, 3, self.ROOM_SIZE / 2]},
+            'goalObservations': []
+        }
+
+    def _apply_action(self, action):
+        name = action.get('name', 'idle')
+        strength = action.get('strength', 1)
+        dist = self.STEP_SIZE * strength
+        angle = action.get('angle', math.radians(15))
+        move = {'forwards': 0, 'backwards': math.pi, 'strafeLeft': math.pi / 2, 'strafeRight': -math.pi / 2}
+        collision = False
+        if name in move:
+            a = self.angle + move[name]
+            x = self.position[0] + dist * math.sin(a)
+            z = self.position[2] + dist * math.cos(a)
+            half = self.ROOM_SIZE / 2
+            collision = abs(x) > half or abs(z) > half
+            if not collision:
+                self.position[0] = x
+                self.position[2] = z
+        elif name == 'turnLeft':
+            self.angle += angle * strength
+        elif name == 'turnRight':
+            self.angle -= angle * strength
+        self._action_trace.append({'tick': len(self._action_trace), 'actions': name,
+                                   'px': self.position[0], 'py': self.position[1], 'pz': self.position[2],
+                                   'rotation': self.angle})
+        return collision
+
+    def step(self, action):
+        actions = action if isinstance(action, list) else [action]
+        frame_skip = max([a.get('frame_skip', 1) for a in actions] + [1])
+        collision = False
+        for i in range(frame_skip):
+            for a in actions:
+                collision = self._apply_action(a) or collision
+            self.time += self.STEP_TIME
+        dist = self._distance_to_goal()
+        gp = self.goal['position']
+        dx, dz = gp[0] - self.position[0], gp[2] - self.position[2]
+        # direction to goal in agent coordinates
+        c, s = math.cos(-self.angle), math.sin(-self.angle)
+        direction = [(c * dx - s * dz) / max(dist, 1e-6), 0.0, (s * dx + c * dz) / max(dist, 1e-6)]
+        observation = {
+            'time': self.time,
+            'collision': collision,
+            'sensors': dict((name, dict(frame)) for name, frame in self._get_frames().items()),
+            'measurements': {
+                'distance_to_goal': [dist],
+                'direction_to_goal': direction,
+                'shortest_path_to_goal': {'distance': dist, 'isValid': True}
+            },
+            'roomInfo': {'id': 'mock_room', 'roomType': 'Living_Room'}
+        }
+        if self._map_frame is not None:
+            observation['map'] = dict(self._map_frame)
+        info = {'agent_state': {'position': list(self.position), 'angle': self.angle}}
+        return {'observation': observation, 'info': info}
+
+    def step_sequence(self, opts):
+        """Takes step for each action, returning last step with time, collision and measurements of every step
+        (and stacked sensor frames if observations is 'all')"""
+        steps = []
+        sensors = []
+        for action in opts.get('actions') or []:
+            response = self.step(action)
+            observation = response['observation']
+            steps.append({'time': observation['time'], 'collision': observation['collision'],
+                          'measurements': observation['measurements']})
+            sensors.append(observation['sensors'])
+        response['steps'] = steps
+        if opts.get('observations') == 'all':
+            response['frames'] = self._stack_frames(sensors)
+            # frames of the last step are only sent stacked
+            response['observation']['sensors'] = {k: v for k, v in response['observation']['sensors'].items()
+                                                  if k not in response['frames']}
+        return response
+
+    def cached_action(self, opts):
+        """Takes step, leaving out frames of cached sensors if the agent reached the cached pose"""
+        response = self.step(opts.get('action') or {})
+        cached = opts.get('cached')
+        state = response['info']['agent_state']
+        if cached and quantize_pose(state['position'], state['angle'], state.get('tilt'), cached['positionResolution'],
+                                    cached['angleResolution']) == tuple(cached['pose']):
+            sensors = response['observation']['sensors']
+            response['observation']['sensors'] = {k: v for k, v in sensors.items() if k not in cached['sensors']}
+            response['observation']['cachedSensors'] = cached['sensors']
+        return response
+
+    def render_poses(self, opts):
+        """Moves agent to each pose and renders it, returning poses, measurements and stacked sensor frames"""
+        poses = []
+        steps = []
+        sensors = []
+        for pose in opts.get('poses') or []:
+            poses.append(self.move_to(pose))
+            observation = self.step({'name': 'idle'})['observation']
+            steps.append({'time': observation['time'], 'collision': observation['collision'],
+                          'measurements': observation['measurements'], 'roomInfo': observation['roomInfo']})
+            sensors.append(observation['sensors'])
+        return {'poses': poses, 'steps': steps, 'frames': self._stack_frames(sensors)}
+
+    @staticmethod
+    def _stack_frames(sensors):
+        frames = {}
+        for name, sensor in sensors[0].items():
+            frames[name] = dict(sensor, shape=[len(sensors)] + sensor['shape'],
+                                data=np.concatenate([s[name]['data'] for s in sensors]))
+        return frames
+
+    def get_capabilities(self):
+        capabilities = self.params['mock'].get('capabilities')
+        return list(self.OPTIONAL_EVENTS) + ['get_capabilities'] if capabilities is None else capabilities
+
+    def handle(self, event, data):
+        """Handles event from client, returns response (same format as server.js, None if not answered)"""
+        if event in self.OPTIONAL_EVENTS + ['get_capabilities'] and event not in self.get_capabilities():
+            return None
+        response = self._handle(event, data)
+        latency = self.get_latency(event)
+        if latency > 0:
+            time.sleep(latency)
+        return response
+
+    def _handle(self, event, data):
+        if event == 'init':
+            self.configure(data)
+            self.created = True
+            return {'status': 'OK', 'message': 'initialized'}
+        elif event == 'start':
+            self._create(data)
+            return {'status': 'OK', 'data': self.start()}
+        elif event == 'set_transport':
+            if self.shm is not None:
+                self.shm.close()
+                self.shm = None
+            if data and data.get('type') == 'shm':
+                try:
+                    self.shm = SharedMemoryRing.attach(data)
+                    # all arrays go through shared memory (clients do not decode binary socket.io acks)
+                    self.shm.min_bytes = 0
+                except OSError:
+                    return {'status': 'error', 'message': 'Error opening shared memory ' + data.get('path')}
+            return {'status': 'OK', 'data': True}
+        elif event == 'close':
+            self.started = False
+            return {'status': 'OK', 'message': 'closed'}
+        elif event == 'get_capabilities':
+            events = [e for e in self.get_capabilities() if e in self.OPTIONAL_EVENTS]
+            return {'status': 'OK', 'data': {'events': events}}
+        elif event == 'preload_scenes':
+            # nothing to load, pretend all scenes were preloaded
+            return {'status': 'OK', 'data': (data or {}).get('fullIds', [])}
+        elif event == 'get_navmap':
+            return {'status': 'error', 'message': 'No navigation map'}
+        elif event == 'get_memory_usage':
+            rss = psutil.Process().memory_info().rss
+            return {'status': 'OK', 'data': {'rss': rss, 'heapUsed': None}}
+        elif event == 'begin_episode':
+            if not self.started and not (data or {}).get('start'):
+                return {'status': 'error', 'message': 'Simulator is not initialized yet!'}
+            return {'status': 'OK', 'data': self.begin_episode(data or {})}
+        elif not self.started and event in ['reset', 'action', 'cached_action', 'action_sequence', 'render_poses',
+                                            'get_scene_data', 'get_observation_metadata',
+                                            'move_to', 'set_goal', 'get_action_trace']:
+            if event == 'get_observation_metadata':
+                return {'status': 'OK', 'data': self.get_observation_metadata()}
+            return {'status': 'error', 'message': 'Simulator is not started yet!'}
+        elif event == 'reset':
+            return {'status': 'OK', 'data': self.reset()}
+        elif event == 'configure':
+            return {'status': 'OK', 'data': self.configure(data)}
+        elif event == 'action':
+            if self.shm is not None:
+                self.shm.next_slot()
+            return {'status': 'OK', 'data': self.step(data)}
+        elif event == 'cached_action':
+            if self.shm is not None:
+                self.shm.next_slot()
+            return {'status': 'OK', 'data': self.cached_action(data or {})}
+        elif event == 'action_sequence':
+            if len((data or {}).get('actions') or []) == 0:
+                return {'status': 'error', 'message': 'No actions in action sequence'}
+            if self.shm is not None:
+                self.shm.next_slot()
+            return {'status': 'OK', 'data': self.step_sequence(data)}
+        elif event == 'render_poses':
+            if len((data or {}).get('poses') or []) == 0:
+                return {'status': 'error', 'message': 'No poses to render'}
+            if self.shm is not None:
+                self.shm.next_slot()
+            return {'status': 'OK', 'data': self.render_poses(data)}
+        elif event == 'seed':
+            self.seed(data)
+            return {'status': 'OK', 'data': True}
+        elif event == 'get_scene_data':
+            return {'status': 'OK', 'data': self.get_episode_info()}
+        elif event == 'get_observation_metadata':
+            return {'status': 'OK', 'data': self.get_observation_metadata()}
+        elif event == 'move_to':
+            return {'status': 'OK', 'data': self.move_to(data or {})}
+        elif event == 'set_goal':
+            return {'status': 'OK', 'data': self.set_goal(data)}
+        elif event == 'get_action_trace':
+            return {'status': 'OK', 'data': self._action_trace}
+        else:
+            return {'status': 'error', 'message': 'Unsupported event ' + str(event)}
+
+    def serialize(self, data):
+        """Replaces numpy arrays with array nodes written to shared memory (arrays are never sent as binary
+        socket.io attachments since clients do not decode binary acks)"""
+        if isinstance(data, dict):
+            return {k: self.serialize(v) for k, v in data.items()}
+        elif isinstance(data, list):
+            return [self.serialize(v) for v in data]
+        elif isinstance(data, np.ndarray):
+            if self.shm is None:
+                raise ValueError('Mock sim server needs shared memory transport to send arrays')
+            location = self.shm.write(data)
+            if location is None:
+                raise ValueError('Array of %d bytes does not fit in shared memory slot of %d bytes '
+                                 '(increase transport slot_size)' % (data.nbytes, self.shm.slot_size))
+            return {'type': 'array', 'datatype': DATATYPES[data.dtype], 'length': data.size, 'shm': location}
+        return data
+
+
+class _Session:
+    """ Engine.io session with queue of packets waiting to be polled by the client """
+    def __init__(self, sid, simulation):
+        self.sid = sid
+        self.simulation = simulation
+        self.packets = []
+        self.closed = False
+        self._cond = threading.Condition()
+        # events are handled one at a time and in order (like the single threaded node server)
+        self._events = queue.Queue()
+        self._thread = threading.Thread(name='mock_sim_' + sid, target=self._handle_events)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, packets):
+        with self._cond:
+            self.packets.extend(packets)
+            self._cond.notify_all()
+
+    def poll(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.packets) > 0 or self.closed, timeout)
+            packets = self.packets
+            self.packets = []
+        return packets
+
+    def close(self):
+        self._events.put(None)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def on_message(self, message):
+        # socket.io packet
+        packet_type = message[0]
+        if packet_type == '2':    # event
+            data = message[1:]
+            if data.startswith('/'):
+                data = data.split(',', 1)[1]
+            bracket = data.index('[')
+            ack_id = int(data[:bracket]) if bracket > 0 else None
+            args = json.loads(data[bracket:])
+            self._events.put((args[0], args[1] if len(args) > 1 else None, ack_id))
+        elif packet_type == '1':  # disconnect
+            self.close()
+
+    def _handle_events(self):
+        while True:
+            item = self._events.get()
+            if item is None:
+                break
+            event, data, ack_id = item
+            try:
+                response = self.simulation.handle(event, data)
+                if response is not None:
+                    response = self.simulation.serialize(response)
+            except Exception as e:
+                response = {'status': 'error', 'message': 'Error handling %s: %s' % (event, e)}
+            if ack_id is None or response is None:
+                continue
+            self.send(['43%d%s' % (ack_id, json.dumps([response]))])
+
+
+def encode_payload(packets):
+    """Encodes engine.io packets (str for text, bytes for binary messages) as binary polling payload"""
+    content = bytearray()
+    for packet in packets:
+        if isinstance(packet, str):
+            data = packet.encode('utf-8')
+            content.append(0)
+        else:
+            data = b'\x04' + packet
+            content.append(1)
+        content.extend(int(c) for c in str(len(data)))
+        content.append(255)
+        content.extend(data)
+    return bytes(content)
+
+
+def decode_payload(content):
+    """Decodes binary polling payload into list of engine.io packets (as str)"""
+    packets = []
+    i = 0
+    while i < len(content):
+        i += 1   # string/binary marker
+        length = 0
+        while content[i] != 255:
+            length = length * 10 + content[i]
+            i += 1
+        i += 1
+        packets.append(content[i:i + length].decode('utf-8'))
+        i += length
+    return packets
+
+
+class MockSimServer(ThreadingHTTPServer):
+    """ Python stand-in for server.js (socket.io over engine.io long polling) returning synthetic observations
+
+    Only one client session is served at a time, which gets its own MockSimulation.
+    """
+    daemon_threads = True
+    PING_INTERVAL = 25000
+    PING_TIMEOUT = 60000
+
+    def __init__(self, port, host='localhost', verbose=False, mock=None):
+        super().__init__((host, port), _RequestHandler)
+        self.verbose = verbose
+        self.mock = mock or {}
+        self.sessions = {}
+
+    def handle_error(self, request, client_address):
+        # clients drop their connections when they go away, only report other errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def create_session(self):
+        sid = uuid.uuid4().hex
+        session = _Session(sid, MockSimulation(mock=self.mock))
+        self.sessions[sid] = session
+        return session
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True   # headers and body are written separately
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, body, content_type='application/octet-stream', status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _get_session(self):
+        query = parse_qs(urlparse(self.path).query)
+        sid = query.get('sid', [None])[0]
+        return sid, self.server.sessions.get(sid)
+
+    def do_GET(self):
+        sid, session = self._get_session()
+        if sid is None:
+            # handshake (no upgrades, client stays with polling)
+            session = self.server.create_session()
+            handshake = {'sid': session.sid, 'upgrades': [], 'pingInterval': self.server.PING_INTERVAL,
+                         'pingTimeout': self.server.PING_TIMEOUT}
+            session.send(['40'])   # socket.io connect (sent with next poll)
+            self._respond(encode_payload(['0' + json.dumps(handshake)]))
+        elif session is None:
+            self._respond(b'Unknown session', 'text/plain', 400)
+        else:
+            packets = session.poll(self.server.PING_INTERVAL / 1000.0)
+            if len(packets) == 0:
+                packets = ['6']   # noop
+            self._respond(encode_payload(packets))
+
+    def do_POST(self):
+        sid, session = self._get_session()
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if session is None:
+            self._respond(b'Unknown session', 'text/plain', 400)
+            return
+        for packet in decode_payload(content):
+            packet_type = packet[0]
+            if packet_type == '2':     # ping
+                session.send(['3' + packet[1:]])
+            elif packet_type == '4':   # message
+                session.on_message(packet[1:])
+            elif packet_type == '1':   # close
+                session.close()
+                del self.server.sessions[sid]
+        self._respond(b'ok', 'text/html')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Mock simulator server returning synthetic observations')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=1234,
+                        help='Port to listen on')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        default=False,
+                        help='Log requests')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0,
+                        help='Seconds to delay responses by (can be overridden with mock.latency from client)')
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0,
+                        help='Fraction of latency to randomly add or subtract')
+    parser.add_argument('--payload_bytes',
+                        type=int,
+                        default=0,
+                        help='Size of extra opaque payload frame to add to observations')
+    parser.add_argument('--capabilities',
+                        help='Comma separated optional events to handle (default all, can be overridden with '
+                             'mock.capabilities from client)')
+    args = parser.parse_args()
+
+    mock = {'latency': args.latency, 'jitter': args.jitter, 'payload_bytes': args.payload_bytes,
+            'capabilities': [e for e in args.capabilities.split(',') if e] if args.capabilities is not None else None}
+    server = MockSimServer(args.port, verbose=args.verbose, mock=mock)
+    print('Waiting for client connection on port %d' % args.port, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import uuid
+
+
+class NavMapCache:
+    """ On disk cache of navigation maps computed by the simulation server
+
+    Navigation maps are keyed by scene id, level, agent configuration and navmap parameters
+    (and scene options affecting geometry) so changing any of these creates a new cache entry.
+    """
+    VERSION = 1
+    # scene options that do not change scene geometry
+    IGNORED_SCENE_OPTIONS = ['fullId', 'level', 'textureSet', 'texture_set', 'retexture', 'textured_objects',
+                             'enableMirrors']
+    # navmap options that do not change navigation map
+    IGNORED_NAVMAP_OPTIONS = ['autoUpdate', 'grid']
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, scene_id, level, agent, navmap, scene_options=None):
+        scene_options = {k: v for k, v in (scene_options or {}).items() if k not in self.IGNORED_SCENE_OPTIONS}
+        navmap = {k: v for k, v in (navmap or {}).items() if k not in self.IGNORED_NAVMAP_OPTIONS}
+        spec = {'version': self.VERSION, 'scene_id': scene_id, 'level': level,
+                'agent': agent, 'navmap': navmap, 'scene': scene_options}
+        digest = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return (scene_id, digest)
+
+    def get_path(self, key):
+        scene_id, digest = key
+        return os.path.join(self.cache_dir, str(scene_id), digest + '.grid.json')
+
+    def get(self, key):
+        """Returns path to cached navigation map (or None if not cached)"""
+        path = self.get_path(key)
+        return path if os.path.isfile(path) else None
+
+    def put(self, key, grid_json):
+        """Saves navigation map (as json string) to cache and returns its path"""
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to temporary file and move so other processes never see partial files
+        tmp_path = path + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(grid_json)
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,93 @@
+import collections
+import math
+
+import numpy as np
+
+# sensors whose frames only depend on the agent pose (audio and force sensors also depend on what happened)
+CACHEABLE_SENSOR_TYPES = ['color', 'depth', 'normal', 'semantic']
+
+
+def quantize_pose(position, angle, tilt, position_resolution, angle_resolution):
+    """Returns quantized pose (x, y, z, angle, tilt cells).  Must match quantizePose of the sim server."""
+    num_angles = max(1, int(math.floor(2 * math.pi / angle_resolution + 0.5)))
+    angle = angle % (2 * math.pi)
+    return (int(math.floor(position[0] / position_resolution + 0.5)),
+            int(math.floor(position[1] / position_resolution + 0.5)),
+            int(math.floor(position[2] / position_resolution + 0.5)),
+            int(math.floor(angle / angle_resolution + 0.5)) % num_angles,
+            int(math.floor((tilt or 0) / angle_resolution + 0.5)))
+
+
+class ObservationCache:
+    """ In memory least recently used cache of sensor frames keyed by (scene, sensor configuration, quantized pose)
+
+    Entries are dictionaries of sensor name to sensor data (as received from the sim server, before
+    processing, with frames copied).  The least recently used entries are evicted when the frames held
+    take more than max_bytes.  Hits and misses are counted by whoever looks up entries (see record_lookup)
+    since a lookup is only a hit once the sim server confirms the agent reached the cached pose.
+    """
+    def __init__(self, max_bytes, position_resolution=0.01, angle_resolution=math.radians(1)):
+        self.max_bytes = max_bytes
+        self.position_resolution = position_resolution
+        self.angle_resolution = angle_resolution
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key to (sensors, bytes)
+
+    def key(self, scene, sensors, pose):
+        """Returns cache key of pose (dictionary with position, angle and tilt) in scene with sensor configuration"""
+        return (scene, sensors) + quantize_pose(pose['position'], pose['angle'], pose.get('tilt'),
+                                                self.position_resolution, self.angle_resolution)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Returns cached sensor data (or None if not cached), marking it as most recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, sensors):
+        """Caches copy of sensor data (dictionary of sensor name to sensor data), evicting least recently used
+        entries to stay within max_bytes.  Returns whether the entry was cached."""
+        cached = {}
+        num_bytes = 0
+        for name, sensor_data in sensors.items():
+            data = np.array(sensor_data['data'])  # copy (frames may be views of transport buffers)
+            cached[name] = dict(sensor_data, data=data)
+            num_bytes += data.nbytes
+        if num_bytes > self.max_bytes:
+            return False
+        if key in self._entries:
+            self.num_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (cached, num_bytes)
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.num_bytes -= evicted_bytes
+            self.evictions += 1
+        return True
+
+    def record_lookup(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.num_bytes = 0
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions, 'entries': len(self._entries), 'bytes': self.num_bytes,
+                'max_bytes': self.max_bytes}
@@ -0,0 +1,309 @@
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+STORE_FILE = 'store.json'
+
+# Directions of gridworld move actions relative to agent heading (in quarter turns to the left)
+MOVES = {'forwards': 0, 'strafeLeft': 1, 'backwards': 2, 'strafeRight': 3}
+# Gridworld turn actions (in number of headings to the left)
+TURNS = {'turnLeft': 1, 'turnRight': -1}
+
+
+def get_num_headings(agent):
+    """Returns number of headings of agent (from its angular resolution, 4 if not set)"""
+    resolution = (agent or {}).get('angularResolution')
+    return int(round(2 * math.pi / resolution)) if resolution else 4
+
+
+def _get_offsets(num_headings):
+    # lattice offset (di, dj) of moving forwards in each heading (x grows with i, z with j)
+    if num_headings not in [4, 8]:
+        raise ValueError('Unsupported number of headings %d (supported: 4,8)' % num_headings)
+    offsets = []
+    for h in range(num_headings):
+        angle = h * 2 * math.pi / num_headings
+        offsets.append((int(round(math.sin(angle))), int(round(math.cos(angle)))))
+    return offsets
+
+
+class ObservationStore:
+    """ Memory mapped store of sensor frames pre-rendered at every reachable (cell, heading) of a scene
+
+    Cells form a lattice with spacing cell_size on the floor of a scene level, and headings are num_headings
+    evenly spaced agent angles (matching the angular resolution of a gridworld agent).  Moving forwards
+    in a heading moves to the neighbouring cell in that direction (diagonal for 8 headings) if the agent
+    can walk there.  The store is a directory with store.json (scene, lattice and sensor metadata),
+    cells.npy (lattice coordinates of reachable cells), index.npy (cell at each lattice coordinate, -1 if
+    not reachable), edges.npy (whether the agent can walk from each cell to its neighbour in each heading),
+    cell_rooms.npy (room of each cell) and one <sensor>.npy per sensor with the frames of all states
+    (cell * num_headings + heading).  Depth frames are stored without noise.  Frames are memory mapped read
+    only, so processes using the same store share its pages.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, STORE_FILE)) as f:
+            self.meta = json.load(f)
+        self.scene_id = self.meta['sceneId']
+        self.cell_size = self.meta['cell_size']
+        self.origin = self.meta['origin']
+        self.num_headings = self.meta['num_headings']
+        self.rooms = self.meta['rooms']
+        self.cells = np.load(os.path.join(path, 'cells.npy'))
+        self.index = np.load(os.path.join(path, 'index.npy'))
+        self.edges = np.load(os.path.join(path, 'edges.npy'))
+        self.cell_rooms = np.load(os.path.join(path, 'cell_rooms.npy'))
+        self.frames = {name: np.load(os.path.join(path, sensor['file']), mmap_mode='r')
+                       for name, sensor in self.meta['sensors'].items()}
+        self._offsets = _get_offsets(self.num_headings)
+
+    @property
+    def num_cells(self):
+        return len(self.cells)
+
+    def get_frames(self, cell, heading):
+        """Returns dictionary of sensor name to frame at cell and heading (read only view)"""
+        state = cell * self.num_headings + heading
+        return {name: frames[state] for name, frames in self.frames.items()}
+
+    def get_position(self, cell):
+        i, j = self.cells[cell]
+        return [float(self.origin[0] + i * self.cell_size), self.origin[1], float(self.origin[2] + j * self.cell_size)]
+
+    def get_angle(self, heading):
+        return heading * 2 * math.pi / self.num_headings
+
+    def get_cell(self, i, j):
+        """Returns cell at lattice coordinates (-1 if not reachable)"""
+        if 0 <= i < self.index.shape[0] and 0 <= j < self.index.shape[1]:
+            return int(self.index[i, j])
+        return -1
+
+    def nearest_cell(self, position):
+        """Returns reachable cell nearest to position"""
+        i = int(round((position[0] - self.origin[0]) / self.cell_size))
+        j = int(round((position[2] - self.origin[2]) / self.cell_size))
+        cell = self.get_cell(i, j)
+        if cell < 0:
+            cell = int(np.argmin(np.sum(np.square(self.cells - [i, j]), axis=1)))
+        return cell
+
+    def nearest_heading(self, angle):
+        return int(round(angle * self.num_headings / (2 * math.pi))) % self.num_headings
+
+    def move(self, cell, heading, direction=0):
+        """Returns cell reached by moving from cell in heading turned left by direction headings (-1 if
+        blocked)"""
+        heading = (heading + direction) % self.num_headings
+        if not self.edges[cell, heading]:
+            return -1
+        di, dj = self._offsets[heading]
+        i, j = self.cells[cell]
+        return self.get_cell(i + di, j + dj)
+
+    def get_room_cells(self, room_ids):
+        """Returns cells in rooms"""
+        rooms = [k for k, room in enumerate(self.rooms) if room.get('id') in room_ids]
+        return np.flatnonzero(np.isin(self.cell_rooms, rooms))
+
+    def get_distances(self, goal_cells):
+        """Returns shortest path distance (in meters, inf if not reachable) from each cell to nearest goal cell"""
+        distances = np.full(self.num_cells, np.inf)
+        queue = [(0.0, int(cell)) for cell in goal_cells]
+        for d, cell in queue:
+            distances[cell] = d
+        heapq.heapify(queue)
+        while len(queue) > 0:
+            d, cell = heapq.heappop(queue)
+            if d > distances[cell]:
+                continue
+            for heading, (di, dj) in enumerate(self._offsets):
+                neighbor = self.move(cell, heading)
+                nd = d + self.cell_size * math.sqrt(di * di + dj * dj)
+                if neighbor >= 0 and nd < distances[neighbor]:
+                    distances[neighbor] = nd
+                    heapq.heappush(queue, (nd, neighbor))
+        return distances
+
+
+class ObservationStoreWriter:
+    """ Writes observation store (see ObservationStore), with frames added in chunks to memory mapped files """
+    def __init__(self, path, meta, cells, cell_rooms, edges):
+        self.path = path
+        self.meta = dict(meta, sensors={})
+        os.makedirs(path, exist_ok=True)
+        cells = np.asarray(cells, dtype=np.int32).reshape(-1, 2)
+        self.num_states = len(cells) * meta['num_headings']
+        index = np.full(np.max(cells, axis=0) + 1, -1, dtype=np.int32)
+        index[cells[:, 0], cells[:, 1]] = np.arange(len(cells))
+        np.save(os.path.join(path, 'cells.npy'), cells)
+        np.save(os.path.join(path, 'index.npy'), index)
+        np.save(os.path.join(path, 'edges.npy'), np.asarray(edges, dtype=bool))
+        np.save(os.path.join(path, 'cell_rooms.npy'), np.asarray(cell_rooms, dtype=np.int32))
+        self._frames = {}
+
+    def write_frames(self, states, frames):
+        """Writes frames (dictionary of sensor name to sensor data with frames stacked) of states.  Depth
+        frames are written without noise (noise is simulated when they are looked up)."""
+        for name, frame in frames.items():
+            data = frame.get('data_clean')
+            if not isinstance(data, np.ndarray):
+                data = frame.get('data')
+            if not isinstance(data, np.ndarray):
+                continue
+            if name not in self._frames:
+                filename = name + '.npy'
+                self._frames[name] = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='w+',
+                                                               dtype=data.dtype,
+                                                               shape=(self.num_states,) + data.shape[1:])
+                sensor = {k: v for k, v in frame.items() if not isinstance(v, np.ndarray) and k != 'data_clean'}
+                sensor.update({'file': filename, 'dtype': str(data.dtype), 'shape': list(data.shape[1:])})
+                self.meta['sensors'][name] = sensor
+            self._frames[name][states] = data
+
+    def close(self):
+        """Flushes frames and writes store metadata (last, so partially written stores are not used)"""
+        for frames in self._frames.values():
+            frames.flush()
+        self._frames = {}
+        path = os.path.join(self.path, STORE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f, default=str)
+        os.replace(path + '.tmp', path)
+
+
+def _is_navigable(step, pose, position, cell_size):
+    # agent can stand at position if there is a path to the goal from it (and it was not moved elsewhere)
+    path = (step.get('measurements') or {}).get('shortest_path_to_goal')
+    if not isinstance(path, dict) or not path.get('isValid'):
+        return False
+    moved_to = (pose or {}).get('position') if isinstance(pose, dict) else None
+    if moved_to is not None:
+        offset = math.sqrt((moved_to[0] - position[0]) ** 2 + (moved_to[2] - position[2]) ** 2)
+        return offset < cell_size / 2
+    return True
+
+
+def _walks_to(sim, position, angle, target, cell_size, max_steps):
+    # moves agent to position facing target, and steps forwards until it is in the cell at target (it does
+    # not get there if it collides, stops moving or walks past the cell)
+    sim.move_to(position, angle, 0.0)
+    length = math.sqrt((target[0] - position[0]) ** 2 + (target[2] - position[2]) ** 2)
+    last = position
+    for i in range(max_steps):
+        data = sim.step({'name': 'forwards'}, 1) or {}
+        agent_state = (data.get('info') or {}).get('agent_state') or {}
+        at = agent_state.get('position')
+        if at is None or (data.get('observation') or {}).get('collision'):
+            return False
+        if math.sqrt((target[0] - at[0]) ** 2 + (target[2] - at[2]) ** 2) < cell_size / 2:
+            return True
+        moved = math.sqrt((at[0] - last[0]) ** 2 + (at[2] - last[2]) ** 2)
+        walked = math.sqrt((at[0] - position[0]) ** 2 + (at[2] - position[2]) ** 2)
+        if moved < 1e-3 or walked > length + cell_size / 2:
+            return False
+        last = at
+    return False
+
+
+def _probe_edges(sim, cells, offsets, get_position, cell_size, max_steps=20, log=print):
+    """Returns array of whether the agent can walk from each cell to its neighbour in each heading.  Edges are
+    probed by moving the agent to the cell and stepping forwards towards the neighbour (once per pair of
+    neighbours, since the navigation grid is not directed)."""
+    num_headings = len(offsets)
+    index = {c: k for k, c in enumerate(cells)}
+    edges = np.zeros((len(cells), num_headings), dtype=bool)
+    num_probed = 0
+    for k, c in enumerate(cells):
+        for h in range(num_headings // 2):
+            di, dj = offsets[h]
+            n = index.get((c[0] + di, c[1] + dj))
+            if n is None:
+                continue
+            walkable = _walks_to(sim, get_position(c), h * 2 * math.pi / num_headings,
+                                 get_position(cells[n]), cell_size, max_steps)
+            edges[k, h] = edges[n, h + num_headings // 2] = walkable
+            num_probed += 1
+        if (k + 1) % 100 == 0 or k + 1 == len(cells):
+            log('Probed %d edges of %d/%d cells (%d walkable)' % (num_probed, k + 1, len(cells), np.sum(edges) // 2))
+    return edges
+
+
+def build_observation_store(sim, path, episode_info, cell_size=0.5, num_headings=4, max_cells=None,
+                            chunk_size=None, log=print):
+    """Builds observation store of scene started in sim (with episode_info from starting it).  Cells
+    reachable from the start position are found with a breadth first search over the lattice (within the
+    scene bounding box), keeping cells that have a valid shortest path to the goal.  Then the agent walks
+    between neighbouring cells to find which moves are blocked (by walls between cells for example), and
+    every (cell, heading) is rendered and written to the store at path.  Returns number of cells."""
+    offsets = _get_offsets(num_headings)
+    start = episode_info['start']['position']
+    bbox = episode_info.get('bbox')
+    chunk_size = chunk_size or sim.render_chunk_size
+
+    def get_position(c):
+        return [start[0] + c[0] * cell_size, start[1], start[2] + c[1] * cell_size]
+
+    def in_bbox(position):
+        return bbox is None or (bbox['min'][0] <= position[0] <= bbox['max'][0] and
+                                bbox['min'][2] <= position[2] <= bbox['max'][2])
+
+    # find reachable cells (rendering heading 0 of each cell)
+    cells = []
+    rooms = []
+    room_index = {}
+    cell_rooms = []
+    times = []
+    seen = {(0, 0)}
+    frontier = [(0, 0)]
+    while len(frontier) > 0 and (max_cells is None or len(cells) < max_cells):
+        batch = frontier[:chunk_size]
+        frontier = frontier[chunk_size:]
+        rendered = sim.render_poses([(get_position(c), 0.0, 0.0) for c in batch], chunk_size)
+        for c, pose, step in zip(batch, rendered['poses'], rendered['steps']):
+            times.append(step.get('time'))
+            if not _is_navigable(step, pose, get_position(c), cell_size) or \
+                    (max_cells is not None and len(cells) >= max_cells):
+                continue
+            room = step.get('roomInfo') or {}
+            key = room.get('id')
+            if key not in room_index:
+                room_index[key] = len(rooms)
+                rooms.append({'id': key, 'roomType': room.get('roomType')})
+            cells.append(c)
+            cell_rooms.append(room_index[key])
+            for di, dj in offsets:
+                n = (c[0] + di, c[1] + dj)
+                if n not in seen and in_bbox(get_position(n)):
+                    seen.add(n)
+                    frontier.append(n)
+        log('Found %d reachable cells (%d to check)' % (len(cells), len(frontier)))
+    if len(cells) == 0:
+        raise RuntimeError('No reachable cells found for scene ' + str(episode_info.get('sceneId')))
+    edges = _probe_edges(sim, cells, offsets, get_position, cell_size, log=log)
+
+    # lattice coordinates relative to minimum corner
+    cells = np.array(cells, dtype=np.int32)
+    corner = np.min(cells, axis=0)
+    times = [t for t in times if t is not None]
+    time_steps = np.diff(times) if len(times) > 1 else []
+    meta = {'version': 2, 'sceneId': episode_info.get('sceneId'), 'cell_size': cell_size,
+            'origin': get_position(corner.tolist()), 'num_headings': num_headings, 'rooms': rooms,
+            'time_step': float(np.median(time_steps)) if len(time_steps) > 0 else None,
+            'observation_metadata': sim.get_observation_metadata()}
+    writer = ObservationStoreWriter(path, meta, cells - corner, cell_rooms, edges)
+
+    # render every state
+    poses = [(get_position(c), h * 2 * math.pi / num_headings, 0.0)
+             for c in cells.tolist() for h in range(num_headings)]
+    state = 0
+    for rendered in sim.iter_render_poses(poses, chunk_size):
+        num_rendered = len(rendered['poses'])
+        writer.write_frames(np.arange(state, state + num_rendered), rendered['frames'])
+        state += num_rendered
+        log('Rendered %d/%d states' % (state, len(poses)))
+    writer.close()
+    return len(cells)
@@ -0,0 +1,114 @@
+import os
+import psutil
+import random
+import socket
+import tempfile
+import time
+
+
+def parse_port_range(port_range):
+    """Parses port range given as 'start-end' string or (start, end) pair (inclusive)"""
+    if port_range is None:
+        return None
+    if isinstance(port_range, str):
+        start, end = port_range.split('-')
+        port_range = (start, end)
+    start, end = int(port_range[0]), int(port_range[1])
+    if start <= 0 or end > 65535 or start > end:
+        raise ValueError('Invalid port range %s-%s' % (start, end))
+    return start, end
+
+
+def is_listening(pid, port):
+    """Returns whether process is listening on port (checks only the sockets of the process, and does
+    not bind or connect to the port so the server is not disturbed while starting)"""
+    try:
+        process = psutil.Process(pid)
+        # connections() was renamed to net_connections() in psutil 6
+        connections = process.net_connections(kind='inet') if hasattr(process, 'net_connections') \
+            else process.connections(kind='inet')
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+    return any(c.status == psutil.CONN_LISTEN and c.laddr and c.laddr[1] == port for c in connections)
+
+
+class PortAllocator:
+    """ Hands out free ports for simulator servers
+
+    Ports are either assigned by the OS (by binding to port 0) or taken from a port range.  Allocated
+    ports are reserved with lock files (in a directory shared by all processes on the machine) so that
+    simulators started at the same time in different processes do not get the same port before their
+    servers have bound it.  Reservations expire after RESERVATION_SECS or when released.
+    """
+    RESERVATION_SECS = 120
+    MAX_TRIES = 100
+
+    def __init__(self, port_range=None, host='localhost', lock_dir=None):
+        self.port_range = parse_port_range(port_range)
+        self.host = host
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'minos_ports')
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _bind(self, port):
+        """Binds to port (0 for OS assigned).  Returns bound port or None if port is in use"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind((self.host, port))
+            return s.getsockname()[1]
+        except OSError:
+            return None
+        finally:
+            s.close()
+
+    def _lock_path(self, port):
+        return os.path.join(self.lock_dir, '%d.lock' % port)
+
+    def _reserve(self, port):
+        """Reserves port for this process (returns False if someone else holds a valid reservation)"""
+        path = self._lock_path(port)
+        for attempt in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    expired = time.time() - os.path.getmtime(path) > self.RESERVATION_SECS
+                except OSError:
+                    continue   # released in the meantime
+                if not expired:
+                    return False
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def allocate(self):
+        """Returns free port (reserved until released or expired)"""
+        if self.port_range is None:
+            for i in range(self.MAX_TRIES):
+                port = self._bind(0)
+                if port is not None and self._reserve(port):
+                    return port
+        else:
+            start, end = self.port_range
+            n = end - start + 1
+            offset = random.randrange(n)
+            for i in range(n):
+                port = start + (offset + i) % n
+                if self._reserve(port):
+                    if self._bind(port) is not None:
+                        return port
+                    self.release(port)
+        raise RuntimeError('No free port available' +
+                           (' in range %d-%d' % self.port_range if self.port_range else ''))
+
+    def release(self, port):
+        """Releases reservation of port"""
+        try:
+            os.remove(self._lock_path(port))
+        except OSError:
+            pass
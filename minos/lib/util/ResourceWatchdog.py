@@ -0,0 +1,66 @@
+import collections
+import time
+
+import psutil
+
+# Sampled metrics (in MB) that limits can be set on
+METRICS = ['sim_rss_mb', 'sim_heap_mb', 'audio_rss_mb']
+
+
+def get_rss_mb(pid):
+    """Returns resident memory (in MB) of process and its children (None if the process is gone)"""
+    try:
+        process = psutil.Process(pid)
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+    except psutil.NoSuchProcess:
+        return None
+    return rss / (1024 * 1024)
+
+
+class ResourceWatchdog:
+    """ Tracks memory used by simulator server processes and tells when they should be recycled
+
+    Limits are given as dictionary of metric (sim_rss_mb, sim_heap_mb, audio_rss_mb) to MB, with
+    check_interval giving the minimum number of seconds between samples.  Recent samples are kept for
+    exporting as metrics.
+    """
+    def __init__(self, limits=None, max_samples=1000):
+        limits = dict(limits or {})
+        self.check_interval = limits.pop('check_interval', 30)
+        self.limits = {k: v for k, v in limits.items() if v is not None}
+        for k in self.limits:
+            if k not in METRICS:
+                raise ValueError('Unknown resource limit %s (supported: %s)' % (k, ','.join(METRICS)))
+        self.samples = collections.deque(maxlen=max_samples)
+        self.max_values = {}
+        self.num_exceeded = 0
+        self._last_sample_time = None
+
+    def is_due(self):
+        """Whether it is time to take another sample"""
+        return self._last_sample_time is None or time.time() - self._last_sample_time >= self.check_interval
+
+    def add_sample(self, sample):
+        """Records sample (dictionary of metric to MB).  Returns list of limits that are exceeded"""
+        sample = dict(sample, time=time.time())
+        self._last_sample_time = sample['time']
+        self.samples.append(sample)
+        for k in METRICS:
+            v = sample.get(k)
+            if v is not None:
+                self.max_values[k] = max(v, self.max_values.get(k, v))
+        exceeded = ['%s=%.0f>%.0f' % (k, sample[k], limit) for k, limit in self.limits.items()
+                    if sample.get(k) is not None and sample[k] > limit]
+        if len(exceeded) > 0:
+            self.num_exceeded += 1
+        return exceeded
+
+    def get_stats(self):
+        """Returns last sample, maximum values and number of times limits were exceeded"""
+        return {'last': self.samples[-1] if len(self.samples) > 0 else None, 'max': dict(self.max_values),
+                'num_samples': len(self.samples), 'num_exceeded': self.num_exceeded, 'limits': dict(self.limits)}
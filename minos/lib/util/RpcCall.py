@@ -1,9 +1,24 @@
+from timeit import default_timer as timer
+
 import numpy as np
 
 
+# Mapping of array datatypes (as sent by server) to numpy dtypes
+DATATYPES = {
+    'int8': np.dtype('i1'),
+    'uint8': np.dtype('u1'),
+    'int16': np.dtype('i2'),
+    'uint16': np.dtype('u2'),
+    'int32': np.dtype('i4'),
+    'uint32': np.dtype('u4'),
+    'float32': np.dtype('f4'),
+    'float64': np.dtype('f8')
+}
+
+
 class RpcCall:
     """ Super basic RPC Call """
-    def __init__(self, sio, rpcid, logger):
+    def __init__(self, sio, rpcid, logger, decode_paths=None, shm=None):
         self.sio = sio
         self.id = rpcid
         self.logger = logger
@@ -11,12 +26,36 @@ class RpcCall:
         self.response = None
         self.result = None
         self.callback = None
+        # List of paths (tuple of keys, '*' matches any key) to array nodes in response
+        # If not specified, the whole response is walked looking for array nodes
+        self.decode_paths = decode_paths
+        # Timings (in seconds) of emitting call, waiting for response and decoding it
+        self.emit_time = None
+        self.wait_time = None
+        self.decode_time = None
+        self._emitted_at = None
+        # Shared memory ring that arrays with 'shm' locations are read from
+        self.shm = shm
 
     def call(self, name, data=None, callback=None, seconds=None, check_wait=None):
+        self.emit(name, data, callback)
+        return self.wait(seconds, check_wait)
+
+    def emit(self, name, data=None, callback=None):
+        """Sends call without waiting for response"""
         self.name = name
         self.callback = callback
         #self.logger.info('Call %s emit' % name)
+        start_time = timer()
         self.sio.emit(name, data, self._handle_response)
+        self._emitted_at = timer()
+        self.emit_time = self._emitted_at - start_time
+
+    def done(self):
+        return self.response is not None
+
+    def wait(self, seconds=None, check_wait=None):
+        """Waits for response to emitted call"""
         #self.logger.info('Call %s waiting...' % name)
         if check_wait is not None and seconds is not None:
             # loop and wait until check is true or response is received
@@ -33,39 +72,19 @@ class RpcCall:
     def _parse_array(self, array):
         # TODO: Handle endianness correctly
         datatype = array.get('datatype')
-        data = array.get('data')
-        if datatype == 'int8':
-            dt = np.dtype('i1')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'uint8':
-            dt = np.dtype('u1')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'int16':
-            dt = np.dtype('i2')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'uint16':
-            dt = np.dtype('u2')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'int32':
-            dt = np.dtype('i4')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'uint32':
-            dt = np.dtype('u4')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'float32':
-            dt = np.dtype('f4')
-            return np.frombuffer(data, dtype=dt)
-        elif datatype == 'float64':
-            dt = np.dtype('f8')
-            return np.frombuffer(data, dtype=dt)
+        dt = DATATYPES.get(datatype)
+        if dt is not None:
+            # wraps received buffer (no copy)
+            location = array.get('shm')
+            if location is not None and self.shm is not None:
+                return self.shm.read(location, dt)
+            return np.frombuffer(array.get('data'), dtype=dt)
         else:
             if self.logger:
                 self.logger.error('Unknown datatype %s when processing %s' % (datatype, self.name))
             return array
 
-    def _parse_data(self, value, key=None, parent=None, path=[]):
-        #if len(path) > 0:
-        #    ('parse_data %s' % path)
+    def _parse_data(self, value, key=None, parent=None):
         if type(value) is dict:
             if value.get('type') == 'array' and 'datatype' in value:
                 # Special array buffer - let's process it!
@@ -75,16 +94,46 @@ class RpcCall:
             else:
                 for k, v in value.items():
                     if type(v) is dict or type(v) is list:
-                        self._parse_data(v, key=k, parent=value, path=path + [k])
+                        self._parse_data(v, key=k, parent=value)
         elif type(value) is list and len(value) > 0:
             for k, v in enumerate(value):
                 if type(v) is dict or type(v) is list:
-                    self._parse_data(v, key=k, parent=value, path=path + [k])
+                    self._parse_data(v, key=k, parent=value)
         return value
 
+    def _parse_data_at_paths(self, value, paths):
+        # only look for array nodes at the given paths
+        for path in paths:
+            self._parse_path(value, path, 0)
+        return value
+
+    def _parse_path(self, value, path, index):
+        key = path[index]
+        if type(value) is dict:
+            keys = value.keys() if key == '*' else ([key] if key in value else [])
+        elif type(value) is list:
+            keys = range(len(value)) if key == '*' else ([key] if type(key) is int and key < len(value) else [])
+        else:
+            return
+        last = index == len(path) - 1
+        for k in list(keys):
+            v = value[k]
+            if last:
+                if type(v) is dict and v.get('type') == 'array' and 'datatype' in v:
+                    value[k] = self._parse_array(v)
+            elif type(v) is dict or type(v) is list:
+                self._parse_path(v, path, index + 1)
+
     def _handle_response(self, data):
         # process things that proclaim themselves to be array with data
-        self.response = self._parse_data(data)
+        start_time = timer()
+        if self._emitted_at is not None:
+            self.wait_time = start_time - self._emitted_at
+        if self.decode_paths is not None and data is not None:
+            self.response = self._parse_data_at_paths(data, self.decode_paths)
+        else:
+            self.response = self._parse_data(data)
+        self.decode_time = timer() - start_time
         if self.logger:
             if self.response is not None and self.response.get('status') == 'error':
                 self.logger.error('Error calling %s: %s' % (self.name, self.response.get('message')))
@@ -0,0 +1,63 @@
+import queue
+import threading
+import traceback
+
+
+class SensorDumpWriter:
+    """ Writes sensor dumps (pngs, wavs, plots) in a background thread
+
+    Dump jobs are functions that do the encoding and writing, so none of it happens on the step path.
+    At most max_backlog jobs are queued.  When the writer falls behind, new jobs are dropped
+    (policy 'drop', counted in stats) or the caller waits for room in the queue (policy 'block').
+    """
+    POLICIES = ['drop', 'block']
+
+    def __init__(self, max_backlog=64, policy='drop', logger=None):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown sensor dump policy %s (supported: %s)' % (policy, ','.join(self.POLICIES)))
+        self.policy = policy
+        self._logger = logger
+        self._queue = queue.Queue(maxsize=max_backlog)
+        self.stats = {'written': 0, 'dropped': 0, 'errors': 0}
+        self._thread = threading.Thread(name='sensor_dump_writer', target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queues fn(*args) to be run by the writer.  Returns whether the job was queued"""
+        if self._thread is None:
+            return False
+        if self.policy == 'block':
+            self._queue.put((fn, args))
+            return True
+        try:
+            self._queue.put_nowait((fn, args))
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            fn, args = job
+            try:
+                fn(*args)
+                self.stats['written'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+                if self._logger is not None:
+                    self._logger.error('Error writing sensor dump: ' + traceback.format_exc())
+
+    def close(self):
+        """Waits for queued dumps to be written and stops the writer"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._logger is not None:
+            self._logger.info('Sensor dumps written %d, dropped %d, errors %d'
+                              % (self.stats['written'], self.stats['dropped'], self.stats['errors']))
@@ -0,0 +1,82 @@
+import mmap
+import os
+import tempfile
+import uuid
+
+import numpy as np
+
+
+class SharedMemoryRing:
+    """ Ring buffer of fixed size slots in a memory mapped file shared with the simulation server
+
+    The server writes sensor frames into the current slot and sends only their offsets over the socket.
+    Arrays read from the ring are views into the memory mapped file (no copy), so they are only valid
+    until their slot is reused (after another slots - 1 responses).  Copy them if they need to be kept.
+    """
+    def __init__(self, path=None, slots=4, slot_size=16*1024*1024, min_bytes=1024, create=True):
+        if path is None:
+            # use shared memory backed filesystem if available
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(shm_dir, 'minos-' + uuid.uuid4().hex)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.min_bytes = min_bytes
+        self.size = slots * slot_size
+        self._slot = -1
+        self._used = 0
+        # the client creates (and removes) the file, servers attach to it
+        self._owner = create
+        if create:
+            with open(path, 'wb') as f:
+                f.truncate(self.size)   # sparse file, memory is only used for written pages
+        self._file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self._file.fileno(), self.size)
+
+    @staticmethod
+    def attach(spec):
+        """Opens existing ring from its transport specification (used by servers implemented in python)"""
+        return SharedMemoryRing(path=spec['path'], slots=spec['slots'], slot_size=spec['slotSize'],
+                                min_bytes=spec.get('minBytes', 0), create=False)
+
+    def spec(self):
+        """Transport specification sent to the server"""
+        return {'type': 'shm', 'path': self.path, 'slots': self.slots,
+                'slotSize': self.slot_size, 'minBytes': self.min_bytes}
+
+    def next_slot(self):
+        """Moves writer to the next slot (used by servers implemented in python)"""
+        self._slot = (self._slot + 1) % self.slots
+        self._used = 0
+        return self._slot
+
+    def write(self, array):
+        """Writes array to current slot and returns its location (or None if it should go over the socket)"""
+        data = np.ascontiguousarray(array).view(np.uint8).reshape(-1)
+        nbytes = data.shape[0]
+        if nbytes < self.min_bytes or self._slot < 0 or self._used + nbytes > self.slot_size:
+            return None
+        offset = self._slot * self.slot_size + self._used
+        self.mmap[offset:offset + nbytes] = data.tobytes()
+        self._used += (nbytes + 7) // 8 * 8    # keep arrays 8 byte aligned
+        return {'offset': offset, 'byteLength': nbytes}
+
+    def read(self, location, dtype):
+        """Returns view of array at location"""
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.mmap, dtype=dtype, count=location['byteLength'] // dtype.itemsize,
+                             offset=location['offset'])
+
+    def close(self):
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # there are still arrays referencing the ring, let the mmap be closed when they go away
+                pass
+            self.mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._owner and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,124 @@
+import atexit
+import os
+import signal
+import threading
+import time
+
+import psutil
+
+from .PortAllocator import is_listening
+
+
+class PooledServer:
+    """ Simulator server process that can be leased by one simulator at a time """
+    def __init__(self, key, proc, port, release_port=None):
+        self.key = key
+        self.proc = proc
+        self.port = port
+        self.release_port = release_port   # called with port when process is stopped
+        self.num_leases = 0
+        self.started_at = time.time()
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def is_healthy(self):
+        return self.is_alive() and is_listening(self.proc.pid, self.port)
+
+    def get_rss_mb(self):
+        try:
+            return psutil.Process(self.proc.pid).memory_info().rss / (1024 * 1024)
+        except psutil.NoSuchProcess:
+            return None
+
+    def stop(self):
+        if self.is_alive():
+            try:
+                os.killpg(os.getpgid(self.proc.pid), signal.SIGTERM)
+            except OSError:
+                pass
+        self.proc.close()
+        if self.release_port is not None:
+            self.release_port(self.port)
+
+
+class SimServerPool:
+    """ Pool of warm simulator server processes that are leased to simulators
+
+    A simulator leases an idle server started with the same launch configuration (key), or launches a new
+    one, and gives it back when it is done with it.  Returned servers are kept for the next simulator unless
+    they are unhealthy (exited or not listening), use more than max_rss_mb of memory, have been leased
+    max_leases times, or there are already max_idle idle servers.  Servers are also checked before
+    being leased, so a server that died while idle is replaced transparently.
+    """
+    def __init__(self, max_idle=4, max_rss_mb=None, max_leases=None, logger=None):
+        self.max_idle = max_idle
+        self.max_rss_mb = max_rss_mb
+        self.max_leases = max_leases
+        self._logger = logger
+        self._idle = []
+        self._lock = threading.Lock()
+        self.stats = {'launched': 0, 'reused': 0, 'recycled': 0}
+        atexit.register(self.shutdown)
+
+    def _log(self, msg):
+        if self._logger is not None:
+            self._logger.info('SimServerPool:' + msg)
+
+    def lease(self, key, launch):
+        """Returns idle healthy server for key, or launches new server with launch() -> PooledServer or None"""
+        while True:
+            with self._lock:
+                server = next((s for s in self._idle if s.key == key), None)
+                if server is not None:
+                    self._idle.remove(server)
+            if server is None:
+                break
+            if server.is_healthy():
+                server.num_leases += 1
+                self.stats['reused'] += 1
+                self._log('Reusing server pid %d on port %d (lease %d)' % (server.proc.pid, server.port,
+                                                                          server.num_leases))
+                return server
+            self._log('Dropping unhealthy server pid %d on port %d' % (server.proc.pid, server.port))
+            server.stop()
+        server = launch()
+        if server is not None:
+            server.num_leases = 1
+            self.stats['launched'] += 1
+        return server
+
+    def _recycle_reason(self, server):
+        if not server.is_healthy():
+            return 'unhealthy'
+        if self.max_rss_mb is not None:
+            rss_mb = server.get_rss_mb()
+            if rss_mb is not None and rss_mb > self.max_rss_mb:
+                return 'using %.0f MB (max %.0f MB)' % (rss_mb, self.max_rss_mb)
+        if self.max_leases is not None and server.num_leases >= self.max_leases:
+            return 'leased %d times' % server.num_leases
+        return None
+
+    def release(self, server, reusable=True):
+        """Returns server to pool (stopping it if it should not be reused)"""
+        reason = self._recycle_reason(server) if reusable else 'not reusable'
+        if reason is None:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(server)
+                    return
+            reason = 'pool full'
+        self.stats['recycled'] += 1
+        self._log('Stopping server pid %d on port %d (%s)' % (server.proc.pid, server.port, reason))
+        server.stop()
+
+    def num_idle(self):
+        return len(self._idle)
+
+    def shutdown(self):
+        """Stops all idle servers"""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for server in idle:
+            server.stop()
@@ -0,0 +1,228 @@
+import bz2
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Numeric columns of episode states files
+FLOAT_FIELDS = ['startX', 'startY', 'startZ', 'startAngle', 'startTilt', 'goalX', 'goalY', 'goalZ', 'goalAngle',
+                'goalTilt', 'dist', 'pathDist']
+INT_FIELDS = ['episodeId', 'pathNumDoors', 'pathNumRooms', 'level']
+# Columns that are copied as is into state records
+RECORD_FIELDS = ['dist', 'pathDist', 'pathNumRooms', 'pathRoomIds', 'pathNumDoors', 'pathDoorIds', 'level']
+
+
+def get_index_paths(states_file):
+    """Returns paths of binary index (array and metadata) for episode states file"""
+    base = states_file
+    for ext in ['.bz2', '.csv']:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + '.states.npy', base + '.states.json'
+
+
+def _file_digest(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class StateIndex:
+    """ Columnar episode states backed by a memory mapped numpy structured array
+
+    Rows are grouped by scene (in order of first appearance in the states file) with offsets per scene.
+    String columns are stored as indices into a table of interned strings (-1 for missing values).
+    """
+    VERSION = 1
+
+    def __init__(self, states, meta):
+        self.states = states
+        self.columns = meta['columns']
+        self.strings = meta['strings']
+        self.scene_ids = meta['scene_ids']
+        self.scene_offsets = meta['scene_offsets']
+        self._numeric = set(FLOAT_FIELDS + INT_FIELDS)
+        self._missing_numeric = [f for f in FLOAT_FIELDS + INT_FIELDS if f not in self.columns]
+
+    @staticmethod
+    def load(states_file):
+        """Loads index for states file (returns None if there is no index or it is out of date)"""
+        npy_path, meta_path = get_index_paths(states_file)
+        if not os.path.isfile(npy_path) or not os.path.isfile(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') != StateIndex.VERSION or meta.get('source_size') != os.path.getsize(states_file) \
+                or meta.get('source_sha1') != _file_digest(states_file):
+            print('Ignoring out of date episode states index ' + npy_path)
+            return None
+        return StateIndex(np.load(npy_path, mmap_mode='r'), meta)
+
+    @staticmethod
+    def write(states_file):
+        """Converts states file into binary index written beside it.  Returns paths of written files"""
+        with bz2.open(states_file, 'rt') if states_file.endswith('bz2') else open(states_file) as f:
+            reader = csv.DictReader(f)
+            columns = reader.fieldnames
+            rows = [r for r in reader]
+
+        strings = []
+        string_indices = {}
+
+        def intern(s):
+            if s is None:
+                return -1
+            index = string_indices.get(s)
+            if index is None:
+                index = len(strings)
+                strings.append(s)
+                string_indices[s] = index
+            return index
+
+        # group rows by scene (keeping order of scenes and of rows within each scene)
+        scene_order = {}
+        for r in rows:
+            scene_order.setdefault(r['sceneId'], len(scene_order))
+        order = sorted(range(len(rows)), key=lambda i: scene_order[rows[i]['sceneId']])
+
+        dtype = [(c, 'f8' if c in FLOAT_FIELDS else 'i8' if c in INT_FIELDS else 'i4') for c in columns]
+        states = np.empty(len(rows), dtype=dtype)
+        for j, i in enumerate(order):
+            r = rows[i]
+            states[j] = tuple(float(r[c]) if c in FLOAT_FIELDS else int(r[c]) if c in INT_FIELDS else intern(r[c])
+                              for c in columns)
+
+        scene_ids = list(scene_order.keys())
+        scene_counts = np.bincount([scene_order[r['sceneId']] for r in rows], minlength=len(scene_ids))
+        scene_offsets = [0] + np.cumsum(scene_counts).tolist()
+
+        npy_path, meta_path = get_index_paths(states_file)
+        np.save(npy_path, states)
+        meta = {
+            'version': StateIndex.VERSION,
+            'source_size': os.path.getsize(states_file),
+            'source_sha1': _file_digest(states_file),
+            'columns': columns,
+            'strings': strings,
+            'scene_ids': scene_ids,
+            'scene_offsets': scene_offsets
+        }
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        return npy_path, meta_path
+
+    def num_states(self):
+        return self.states.shape[0]
+
+    def get_scene_range(self, scene_index):
+        return self.scene_offsets[scene_index], self.scene_offsets[scene_index + 1]
+
+    def get_row(self, i):
+        """Returns row as dictionary (same as parsed csv row with numeric fields converted)"""
+        row = self.states[i]
+        r = {}
+        for c in self.columns:
+            v = row[c].item()
+            if c in self._numeric:
+                r[c] = v
+            else:
+                r[c] = self.strings[v] if v >= 0 else None
+        for c in self._missing_numeric:
+            r[c] = None
+        return r
+
+    def get_values(self, field, rows):
+        """Returns list of values of field for rows (slice or array of row indices)"""
+        values = self.states[field][rows].tolist()
+        if field in self._numeric:
+            return values
+        return [self.strings[v] if v >= 0 else None for v in values]
+
+    def get_columns(self):
+        """Returns dictionary of numeric fields copied as is into state records to arrays of their values"""
+        return {c: np.asarray(self.states[c]) for c in RECORD_FIELDS if c in self.columns and c in self._numeric}
+
+
+class IndexedStates:
+    """ List of state records of a scene that are created from the index when accessed
+
+    States are the rows from start to end, or the given rows (array of row indices) if only some of them
+    are selected.  Records are created with counters from counter (start if not given).
+    """
+    def __init__(self, index, start, end, create_record, rows=None, counter=None):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.counter = start if counter is None else counter
+        self._create_record = create_record
+        self._records = {}
+
+    def __len__(self):
+        return self.end - self.start if self.rows is None else len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('state index out of range')
+        rec = self._records.get(i)
+        if rec is None:
+            row = self.start + i if self.rows is None else int(self.rows[i])
+            rec = self._create_record(self.index.get_row(row), self.counter + i)
+            self._records[i] = rec
+        return rec
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_values(self, field):
+        """Returns values of field for all states (without creating records if possible)"""
+        if field in RECORD_FIELDS and field in self.index.columns:
+            return self.index.get_values(field, slice(self.start, self.end) if self.rows is None else self.rows)
+        return [s[field] for s in self]
+
+
+class ChainedStates:
+    """ Concatenation of lists of states (without copying them) """
+    def __init__(self, lists):
+        self.lists = lists
+
+    def __len__(self):
+        return sum(len(states) for states in self.lists)
+
+    def __iter__(self):
+        for states in self.lists:
+            for s in states:
+                yield s
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        for states in self.lists:
+            if i < len(states):
+                return states[i]
+            i -= len(states)
+        raise IndexError('state index out of range')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert episode states files to binary index')
+    parser.add_argument('input', nargs='+',
+                        help='Episode states files to convert')
+    args = parser.parse_args()
+    for states_file in args.input:
+        paths = StateIndex.write(states_file)
+        print('Wrote ' + ', '.join(paths))
+
+
+if __name__ == "__main__":
+    main()
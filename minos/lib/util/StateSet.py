@@ -5,6 +5,10 @@ import math
 
 from enum import Enum
 
+import numpy as np
+
+from .StateIndex import StateIndex, IndexedStates, ChainedStates, FLOAT_FIELDS, INT_FIELDS
+
 
 class Select(Enum):
     FIRST = 'first'
@@ -22,12 +26,14 @@ class StateSet:
     """ Wrapper for set of episode val/test states """
     def __init__(self, scenes_file=None, states_files=None,
                  scene_filter=None, episode_filter=None, max_states_per_scene=None,
-                 select_policy=SelectPolicy(Select.FIRST)):
+                 select_policy=SelectPolicy(Select.FIRST), use_index=True):
         self.states = []
         self.scenes = []
         self.scenes_by_id = {}
         self.states_by_scene = {}
         self.select_policy = select_policy
+        # Use binary index of states file if available (see StateIndex)
+        self.use_index = use_index
         if scenes_file:
             self._load_scenes(scenes_file, scene_filter)
         if states_files:
@@ -61,66 +67,76 @@ class StateSet:
 
     def _select_n_states(self, states, n):
         # Select n states from big list of states
-        policy = self.select_policy.policy
-        field = self.select_policy.field
         if n is not None and n < len(states):
-            if policy == Select.FIRST:
-                if field is not None:
-                    # sort by field
-                    states = sorted(states, key=lambda x: x[field])
-                return states[:n]
-            elif policy == Select.RANGE_KEY:
-                # sort by field
-                states = sorted(states, key=lambda x: x[field])
-                # select by evenly dividing indices
-                r = len(states)/float(n)
-                selected = []
-                for i in range(n):
-                    si = int(math.floor(math.ceil(r*i)/2))
-                    selected.append(states[si])
-                return selected
-            elif policy == Select.RANGE_VALUE:
-                # sort by field and get range (value)
-                states = sorted(states, key=lambda x: x[field])
-                fmin = states[0][field]
-                fmax = states[-1][field]
-                # print('Range is %f to %f' % (fmin,fmax))
-                # from range, divide up into n buckets
-                r = (fmax-fmin)/float(n)
-                buckets = []
-                for i in range(n):
-                    buckets.append([])
-                for state in states:
-                    bi = int(min(math.ceil((state[field] - fmin)/r), n-1))
-                    buckets[bi].append(state)
-                # make sure all buckets have something
-                for i, bucket in enumerate(buckets):
-                    if len(bucket) == 0:
-                        # print('Nothing in bucket %d' % i)
-                        # still some from other buckets
-                        pi = max(i-1, 0)
-                        ni = min(i+1, n-1)
-                        nlen = len(buckets[ni])
-                        plen = len(buckets[pi])
-                        if nlen > plen:
-                            # take half from bucket[ni] and put in current bucket
-                            k = math.floor(nlen/2)
-                            buckets[i] = buckets[ni][:k]
-                            buckets[ni] = buckets[ni][k:]
-                        else:
-                            k = math.floor(plen/2)
-                            buckets[i] = buckets[pi][:k]
-                            buckets[pi] = buckets[pi][k:]
-                selected = []
-                for bucket in buckets:
-                    bii = math.floor(len(bucket)/2)
-                    selected.append(bucket[bii])
-                return selected
-            else:
-                raise ValueError('Unsupported select_policy ' + policy)
+            field = self.select_policy.field
+            values = None
+            if field is not None:
+                if isinstance(states, IndexedStates):
+                    values = states.get_values(field)
+                else:
+                    values = [s[field] for s in states]
+            return [states[i] for i in self._select_n_indices(values, len(states), n)]
         else:
             return states
 
+    def _select_n_indices(self, values, count, n):
+        # Select indices of n states given values of select field
+        policy = self.select_policy.policy
+        if policy == Select.FIRST:
+            if values is not None:
+                # sort by field
+                return sorted(range(count), key=lambda i: values[i])[:n]
+            return list(range(n))
+        elif policy == Select.RANGE_KEY:
+            # sort by field
+            indices = sorted(range(count), key=lambda i: values[i])
+            # select by evenly dividing indices
+            r = count/float(n)
+            selected = []
+            for i in range(n):
+                si = int(math.floor(math.ceil(r*i)/2))
+                selected.append(indices[si])
+            return selected
+        elif policy == Select.RANGE_VALUE:
+            # sort by field and get range (value)
+            indices = sorted(range(count), key=lambda i: values[i])
+            fmin = values[indices[0]]
+            fmax = values[indices[-1]]
+            # print('Range is %f to %f' % (fmin,fmax))
+            # from range, divide up into n buckets
+            r = (fmax-fmin)/float(n)
+            buckets = []
+            for i in range(n):
+                buckets.append([])
+            for si in indices:
+                bi = int(min(math.ceil((values[si] - fmin)/r), n-1))
+                buckets[bi].append(si)
+            # make sure all buckets have something
+            for i, bucket in enumerate(buckets):
+                if len(bucket) == 0:
+                    # print('Nothing in bucket %d' % i)
+                    # still some from other buckets
+                    pi = max(i-1, 0)
+                    ni = min(i+1, n-1)
+                    nlen = len(buckets[ni])
+                    plen = len(buckets[pi])
+                    if nlen > plen:
+                        # take half from bucket[ni] and put in current bucket
+                        k = math.floor(nlen/2)
+                        buckets[i] = buckets[ni][:k]
+                        buckets[ni] = buckets[ni][k:]
+                    else:
+                        k = math.floor(plen/2)
+                        buckets[i] = buckets[pi][:k]
+                        buckets[pi] = buckets[pi][k:]
+            selected = []
+            for bucket in buckets:
+                bii = math.floor(len(bucket)/2)
+                selected.append(bucket[bii])
+            return selected
+        else:
+            raise ValueError('Unsupported select_policy ' + policy)
+
     def _populate_from_lists(self, my_scenes, my_states_by_scene, max_states_per_scene):
         self.scenes = my_scenes
         for scene in my_scenes:
@@ -148,7 +164,42 @@ class StateSet:
                 self.scenes_by_id[r['id']] = r
             self.scenes.sort(key=lambda x: x['nobjects'])
 
+    @staticmethod
+    def _create_state_record(r, counter):
+        # Create episode state record from row of states file
+        task_id = r.get('task', '')
+        if task_id == 'p':
+            task = 'point_goal'
+        elif task_id == 'o':
+            task = 'object_goal'
+        elif task_id == 'r':
+            task = 'room_goal'
+        else:  # unknown or no task_id, default to point_goal
+            task = 'point_goal'
+        rec = {
+            'episode_id': r.get('episodeId', counter),
+            'task': task,
+            'scene_id': r['sceneId'],
+            'room_id': r['roomId'],
+            'start': {'position': [r['startX'], r['startY'], r['startZ']],
+                      'angle': r['startAngle'], 'tilt': r.get('startTilt', 0.0)},
+            'goal': {'id': r['goalObjectId'], 'objectType': r.get('goalObjectType', ''),
+                     'roomId': r.get('goalRoomId', ''), 'roomType': r.get('goalRoomType', ''),
+                     'position': [r['goalX'], r['goalY'], r['goalZ']],
+                     'angle': r.get('goalAngle', 0.0), 'tilt': r.get('goalTilt', 0.0)},
+            'dist': r['dist']
+        }
+        for k in ['pathDist', 'pathNumRooms', 'pathRoomIds', 'pathNumDoors', 'pathDoorIds', 'level']:
+            if k in r:
+                rec[k] = r[k]
+        return rec
+
     def _load_states(self, filename, max_states_per_scene, state_filter):
+        index = StateIndex.load(filename) if self.use_index else None
+        if index is not None:
+            self._load_states_from_index(index, max_states_per_scene, state_filter)
+            return
+
         with bz2.open(filename, 'rt') if filename.endswith('bz2') else open(filename) as f:
             reader = csv.DictReader(f)
             all_states = [r for r in reader]
@@ -156,38 +207,12 @@ class StateSet:
             # Convert scene state and group by sceneId
             counter = 0
             for r in all_states:
-                for v in ['startX', 'startY', 'startZ', 'startAngle', 'startTilt', 'goalX', 'goalY', 'goalZ', 'goalAngle', 'goalTilt', 'dist', 'pathDist']:
+                for v in FLOAT_FIELDS:
                     r[v] = float(r[v]) if v in r else None
-                for v in ['episodeId', 'pathNumDoors', 'pathNumRooms', 'level']:
+                for v in INT_FIELDS:
                     r[v] = int(r[v]) if v in r else None
-                scene_id = r['sceneId']
-                task_id = r.get('task', '')
-                if task_id == 'p':
-                    task = 'point_goal'
-                elif task_id == 'o':
-                    task = 'object_goal'
-                elif task_id == 'r':
-                    task = 'room_goal'
-                else:  # unknown or no task_id, default to point_goal
-                    task = 'point_goal'
-                scene_states = self.states_by_scene.setdefault(scene_id, [])
-                rec = {
-                    'episode_id': r.get('episodeId', counter),
-                    'task': task,
-                    'scene_id': r['sceneId'],
-                    'room_id': r['roomId'],
-                    'start': {'position': [r['startX'], r['startY'], r['startZ']],
-                              'angle': r['startAngle'], 'tilt': r.get('startTilt', 0.0)},
-                    'goal': {'id': r['goalObjectId'], 'objectType': r.get('goalObjectType', ''),
-                             'roomId': r.get('goalRoomId', ''), 'roomType': r.get('goalRoomType', ''),
-                             'position': [r['goalX'], r['goalY'], r['goalZ']],
-                             'angle': r.get('goalAngle', 0.0), 'tilt': r.get('goalTilt', 0.0)},
-                    'dist': r['dist']
-                }
-                for k in ['pathDist', 'pathNumRooms', 'pathRoomIds', 'pathNumDoors', 'pathDoorIds', 'level']:
-                    if k in r:
-                        rec[k] = r[k]
-
+                scene_states = self.states_by_scene.setdefault(r['sceneId'], [])
+                rec = self._create_state_record(r, counter)
                 if not state_filter or state_filter(rec):
                     scene_states.append(rec)
                     counter = counter + 1
@@ -199,11 +224,55 @@ class StateSet:
                 states += self.states_by_scene[scene_id]
             self.states = states
 
+    @staticmethod
+    def _filter_index(state_filter, index):
+        # Evaluates filter on the index columns (arrays of values of all states) instead of on each state record.
+        # This works for comparisons of record fields such as lambda e: e['pathNumDoors'] > 1.  Returns mask of
+        # selected states (None if the filter needs the records).
+        try:
+            mask = state_filter(index.get_columns())
+        except Exception:
+            return None
+        if isinstance(mask, np.ndarray) and mask.dtype == bool and mask.shape == (index.num_states(),):
+            return mask
+        return None
+
+    def _load_states_from_index(self, index, max_states_per_scene, state_filter):
+        mask = self._filter_index(state_filter, index) if state_filter else None
+        # Group by sceneId using the scene ranges of the index
+        counter = 0
+        for scene_index, scene_id in enumerate(index.scene_ids):
+            start, end = index.get_scene_range(scene_index)
+            if state_filter and mask is None:
+                # filter needs the records, create them all
+                scene_states = self.states_by_scene.setdefault(scene_id, [])
+                for i in range(start, end):
+                    rec = self._create_state_record(index.get_row(i), counter)
+                    if state_filter(rec):
+                        scene_states.append(rec)
+                        counter = counter + 1
+            else:
+                # records are only created for states that are used
+                if mask is not None:
+                    rows = start + np.flatnonzero(mask[start:end])
+                    scene_states = IndexedStates(index, start, end, self._create_state_record, rows, counter)
+                    counter = counter + len(rows)
+                else:
+                    scene_states = IndexedStates(index, start, end, self._create_state_record)
+                if scene_id in self.states_by_scene:
+                    scene_states = list(self.states_by_scene[scene_id]) + list(scene_states)
+                self.states_by_scene[scene_id] = scene_states
+
+        # Filter down to states per scene and create big list of all scenes (without copying)
+        for scene_id, scene_states in self.states_by_scene.items():
+            self.states_by_scene[scene_id] = self._select_n_states(scene_states, max_states_per_scene)
+        self.states = ChainedStates(list(self.states_by_scene.values()))
+
     def _embed_states_in_scenes(self):
-        for state in self.states:
-            scene_id = state['scene_id']
-            if scene_id in self.scenes_by_id:
-                self.scenes_by_id[scene_id].setdefault('states', []).append(state)
+        for scene_id, scene in self.scenes_by_id.items():
+            states = self.states_by_scene.get(scene_id)
+            if states:
+                scene['states'] = states if isinstance(states, IndexedStates) else list(states)
         scenes_with_no_states = []
         for i, scene in enumerate(self.scenes):
             if 'states' not in scene or len(scene['states']) == 0:
@@ -231,6 +300,10 @@ def main():
                         type=str,
                         default=None,
                         help='Scenes file to load')
+    parser.add_argument('--no_index',
+                        action='store_true',
+                        default=False,
+                        help='Ignore binary index of states file (parse csv)')
     parser.add_argument('input',
                         help='Input file to load')
     args = parser.parse_args()
@@ -238,7 +311,8 @@ def main():
     state_set = StateSet(scenes_file=args.scenes,
                          states_files=args.input,
                          max_states_per_scene=args.limit,
-                         select_policy=SelectPolicy(args.select, args.field))
+                         select_policy=SelectPolicy(args.select, args.field),
+                         use_index=not args.no_index)
     for state in state_set.states:
         print(state)
 
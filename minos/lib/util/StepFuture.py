@@ -0,0 +1,21 @@
+class StepFuture:
+    """ Handle to a simulation step that was sent without waiting for its observation """
+    def __init__(self, sim, rpc):
+        self.rpc = rpc
+        self.processed = False
+        self._sim = sim
+        self._result = None
+
+    def done(self):
+        """Whether the response for this step has been received (observation may not be processed yet)"""
+        return self.rpc.done()
+
+    def set_result(self, result):
+        self._result = result
+        self.processed = True
+
+    def result(self):
+        """Waits for the step and returns processed observation (same as return value of Simulator.step)"""
+        if not self.processed:
+            self._sim.wait_steps(self)
+        return self._result
@@ -0,0 +1,95 @@
+import collections
+import math
+
+import numpy as np
+
+
+class TraceReplayer:
+    """ Replays action traces against a simulator to regenerate their observations
+
+    In 'actions' mode the recorded actions are simulated again.  Steps are submitted with step_async so
+    up to max_steps_in_flight of them are rendered while earlier observations are consumed (or, with
+    sequence_length > 1, sequences of that many steps are sent with step_sequence in one call each).  In
+    'positions' mode the agent is moved to each recorded pose with move_to (no physics is simulated) and
+    the observation at that pose is rendered (or, with sequence_length > 1, that many poses are rendered
+    per call with render_poses).
+
+    Observations may be views into buffers that are reused by later steps (shared memory transport), so
+    consumers should copy frames they want to keep before asking for the next one.
+    """
+    MODES = ['actions', 'positions']
+
+    def __init__(self, sim, mode='actions', action_angle=math.radians(5), sequence_length=1):
+        if mode not in self.MODES:
+            raise ValueError('Unknown replay mode %s (supported: %s)' % (mode, ','.join(self.MODES)))
+        self.sim = sim
+        self.mode = mode
+        self.action_angle = action_angle
+        self.sequence_length = sequence_length
+
+    def get_actions(self, rec):
+        """Returns simulator actions for action record (empty for records without actions to simulate)"""
+        names = rec['actions'].split('+') if rec.get('actions') else []
+        return [{'name': name, 'strength': 1, 'angle': self.action_angle} for name in names if name != 'reset']
+
+    def start(self, trace):
+        """Starts episode of trace.  Returns episode info"""
+        self.sim.configure(trace.start_state())
+        return self.sim.start()
+
+    def replay(self, trace):
+        """Starts episode of trace and yields (action record, observation) for each replayed record"""
+        self.start(trace)
+        if self.mode == 'positions' and self.sequence_length > 1:
+            poses = [([rec['px'], rec['py'], rec['pz']], rec['rotation'], None) for rec in trace.actions]
+            i = 0
+            for rendered in self.sim.iter_render_poses(poses, self.sequence_length):
+                for j in range(len(rendered['poses'])):
+                    yield trace.actions[i + j], self._get_step_response(rendered, j)
+                i += len(rendered['poses'])
+        elif self.mode == 'positions':
+            for rec in trace.actions:
+                self.sim.move_to([rec['px'], rec['py'], rec['pz']], rec['rotation'])
+                yield rec, self.sim.step({'name': 'idle'}, 1)
+        elif self.sequence_length > 1:
+            sequence = []
+            for rec in trace.actions:
+                actions = self.get_actions(rec)
+                if len(actions) == 0:
+                    continue
+                sequence.append((rec, actions))
+                if len(sequence) >= self.sequence_length:
+                    yield from self._replay_sequence(sequence)
+                    sequence = []
+            yield from self._replay_sequence(sequence)
+        else:
+            pending = collections.deque()
+            for rec in trace.actions:
+                actions = self.get_actions(rec)
+                if len(actions) == 0:
+                    continue
+                pending.append((rec, self.sim.step_async(actions, 1)))
+                if len(pending) >= self.sim.max_steps_in_flight:
+                    rec, future = pending.popleft()
+                    yield rec, future.result()
+            while len(pending) > 0:
+                rec, future = pending.popleft()
+                yield rec, future.result()
+
+    def _replay_sequence(self, sequence):
+        if len(sequence) == 0:
+            return
+        response = self.sim.step_sequence([actions for rec, actions in sequence], 1, observations='all')
+        for i, (rec, actions) in enumerate(sequence):
+            yield rec, self._get_step_response(response, i) if response is not None else None
+
+    @staticmethod
+    def _get_step_response(response, i):
+        """Returns response of i-th step of action sequence or pose of rendered poses (with frames of that
+        step as sensors)"""
+        sensors = {}
+        for name, frame in response['frames'].items():
+            sensors[name] = {k: v[i] if isinstance(v, np.ndarray) else v for k, v in frame.items()}
+            sensors[name]['shape'] = frame['shape'][1:]
+        steps = response.get('steps')
+        return {'observation': dict(steps[i] if steps is not None else {}, sensors=sensors)}
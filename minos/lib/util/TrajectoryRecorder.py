@@ -0,0 +1,250 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+VALID_SUFFIX = '#valid'   # suffix of mask of steps with values for fields that are missing or None in some steps
+
+
+def flatten(record, prefix='', out=None):
+    """Flattens nested dictionary into dictionary with '/' separated keys"""
+    if out is None:
+        out = {}
+    for k, v in record.items():
+        key = prefix + str(k)
+        if isinstance(v, dict):
+            flatten(v, key + '/', out)
+        else:
+            out[key] = v
+    return out
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot record value of type %s' % type(value).__name__)
+
+
+def _get_kind(value):
+    # how values are stacked: 'str' (as is), 'array' (numbers and arrays of numbers) or 'json' (json strings)
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, (np.ndarray, np.generic)):
+        return 'array' if value.dtype.kind in 'biufcSU' else 'json'
+    if isinstance(value, (bool, int, float)):
+        return 'array'
+    if isinstance(value, (list, tuple)):
+        try:
+            return 'array' if np.asarray(value).dtype.kind in 'biuf' else 'json'
+        except ValueError:
+            return 'json'  # ragged lists
+    return 'json'
+
+
+def _to_arrays(key, values):
+    """Returns arrays with values of field key stacked over steps (numbers and arrays stacked, strings as is,
+    everything else as json strings).  Steps where the value is None (or missing) are filled with zeros (or
+    empty strings) and marked in mask key#valid, which is only added if some values are missing."""
+    valid = np.array([v is not None for v in values])
+    present = [v for v in values if v is not None]
+    arrays = {} if valid.all() else {key + VALID_SUFFIX: valid}
+    if len(present) == 0:
+        return arrays
+    kinds = set(_get_kind(v) for v in present)
+    if len(kinds) > 1:
+        raise ValueError('Cannot record field %s with values of mixed types (%s)' % (key, ', '.join(sorted(kinds))))
+    kind = kinds.pop()
+    if kind == 'array':
+        present = [np.asarray(v) for v in present]
+        shapes = set(v.shape for v in present)
+        if len(shapes) > 1:
+            raise ValueError('Cannot record field %s with values of differing shapes %s' % (key, sorted(shapes)))
+        dtype = np.result_type(*present)
+        fill = np.zeros(present[0].shape, dtype=dtype)
+    elif kind == 'json':
+        present = [json.dumps(v, default=_json_default) for v in present]
+        fill = ''
+    else:
+        fill = ''
+    it = iter(present)
+    stacked = [next(it) if is_valid else fill for is_valid in valid]
+    arrays[key] = np.stack(stacked) if kind == 'array' else np.array(stacked)
+    return arrays
+
+
+class TrajectoryRecorder:
+    """ Streams steps of episodes into compressed npz shards with a json index
+
+    Each step is a (nested) dictionary of observations, action, measurements, reward, etc.  Steps are
+    buffered and every chunk_size steps written as a shard (shard_00000.npz, ...) with one array per
+    field stacked over the steps of the shard.  Shards are compressed and written by a background
+    thread so recording does not slow down the simulation (add_step only blocks if max_pending shards
+    are waiting to be written).  The index lists the shards and, for each episode, its episode info
+    and the range of steps it covers (global step numbers).  Fields that are None or missing in some steps
+    get a <field>#valid mask of the steps with values (other steps are filled with zeros or empty strings).
+    """
+    def __init__(self, output_dir, chunk_size=1000, compress=True, max_pending=4):
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.compress = compress
+        os.makedirs(output_dir, exist_ok=True)
+        self.index = {'version': 1, 'chunk_size': chunk_size, 'num_steps': 0, 'shards': [], 'episodes': []}
+        self._steps = []
+        self._num_steps = 0
+        self._episode = None
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(name='trajectory_writer', target=self._write_shards)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def begin_episode(self, episode_info=None):
+        if self._episode is not None:
+            self.end_episode()
+        self._episode = {'id': len(self.index['episodes']), 'info': episode_info,
+                         'start': self._num_steps, 'end': self._num_steps}
+
+    def add_step(self, step):
+        """Adds step (nested dictionary of values) to current episode"""
+        if self._error is not None:
+            raise self._error
+        if self._episode is None:
+            self.begin_episode()
+        self._steps.append(flatten(step))
+        self._num_steps += 1
+        self._episode['end'] = self._num_steps
+        if len(self._steps) >= self.chunk_size:
+            self.flush()
+
+    def end_episode(self, summary=None):
+        if self._episode is not None:
+            if summary is not None:
+                self._episode['summary'] = summary
+            self.index['episodes'].append(self._episode)
+            self._episode = None
+
+    def flush(self):
+        """Queues buffered steps to be written as shard"""
+        if len(self._steps) == 0:
+            return
+        steps = self._steps
+        self._steps = []
+        shard = {'file': 'shard_%05d.npz' % len(self.index['shards']),
+                 'start': self._num_steps - len(steps), 'num_steps': len(steps)}
+        self.index['shards'].append(shard)
+        self._queue.put((shard, steps))
+
+    def _write_shards(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            shard, steps = item
+            try:
+                keys = []
+                for step in steps:
+                    keys.extend(k for k in step if k not in keys)
+                arrays = {}
+                for key in keys:
+                    arrays.update(_to_arrays(key, [step.get(key) for step in steps]))
+                path = os.path.join(self.output_dir, shard['file'])
+                with open(path + '.tmp', 'wb') as f:
+                    if self.compress:
+                        np.savez_compressed(f, **arrays)
+                    else:
+                        np.savez(f, **arrays)
+                os.replace(path + '.tmp', path)
+            except Exception as e:
+                self._error = e
+
+    def _write_index(self):
+        self.index['num_steps'] = self._num_steps
+        path = os.path.join(self.output_dir, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, default=str)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        """Writes remaining steps and index (waiting for background writes to finish)"""
+        if self._thread is None:
+            return
+        self.end_episode()
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._write_index()
+        if self._error is not None:
+            raise self._error
+
+
+class TrajectoryReader:
+    """ Reads episodes recorded by TrajectoryRecorder """
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        with open(os.path.join(input_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.episodes = self.index['episodes']
+        self._shard_cache = (None, None)
+
+    def num_episodes(self):
+        return len(self.episodes)
+
+    def _load_shard(self, i):
+        if self._shard_cache[0] != i:
+            shard = self.index['shards'][i]
+            with np.load(os.path.join(self.input_dir, shard['file'])) as data:
+                self._shard_cache = (i, {k: data[k] for k in data.files})
+        return self._shard_cache[1]
+
+    def get_steps(self, start, end, fields=None):
+        """Returns dictionary of field to array of values for global steps from start to end.  Fields that are
+        missing in some of the steps also have a <field>#valid mask of the steps with values."""
+        parts = []
+        keys = []
+        for i, shard in enumerate(self.index['shards']):
+            s0 = shard['start']
+            s1 = s0 + shard['num_steps']
+            if s1 <= start or s0 >= end:
+                continue
+            data = self._load_shard(i)
+            parts.append((min(end, s1) - max(start, s0),
+                          {k: v[max(start, s0) - s0:min(end, s1) - s0] for k, v in data.items()}))
+            for k in data:
+                key = k[:-len(VALID_SUFFIX)] if k.endswith(VALID_SUFFIX) else k
+                if key not in keys and (fields is None or key in fields):
+                    keys.append(key)
+        steps = {}
+        for key in keys:
+            # shards without values of the field (none of their steps had one) are filled like missing values
+            template = next((part[key] for _, part in parts if key in part), None)
+            values = []
+            valid = []
+            for num_steps, part in parts:
+                if key in part:
+                    values.append(part[key])
+                    valid.append(part.get(key + VALID_SUFFIX, np.ones(num_steps, dtype=bool)))
+                else:
+                    if template is not None:
+                        values.append(np.zeros((num_steps,) + template.shape[1:], dtype=template.dtype))
+                    valid.append(np.zeros(num_steps, dtype=bool))
+            if template is not None:
+                try:
+                    steps[key] = np.concatenate(values)
+                except ValueError:
+                    raise ValueError('Field %s has values of differing shapes %s in shards'
+                                     % (key, sorted(set(v.shape[1:] for v in values))))
+            valid = np.concatenate(valid)
+            if not valid.all():
+                steps[key + VALID_SUFFIX] = valid
+        return steps
+
+    def get_episode(self, i, fields=None):
+        """Returns episode info and dictionary of field to array of values over the steps of episode"""
+        episode = self.episodes[i]
+        return episode, self.get_steps(episode['start'], episode['end'], fields)
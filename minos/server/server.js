@@ -25,6 +25,14 @@ var sio = SocketIO(port, {
 });
 
 var sim;
+var simClient;  // id of client socket that created sim
+var simClosed = false;
+// Optional events clients ask for (with get_capabilities) before using them, as older servers never answer them
+var CAPABILITIES = ['begin_episode', 'action_sequence', 'preload_scenes', 'render_poses', 'cached_action',
+  'get_memory_usage', 'get_navmap', 'set_transport'];
+// Scenes preloaded in the background (least recently used first) so that starting them avoids a cold load
+// (fullId to { sceneState, bytes }, sceneState is null while loading)
+var preloadedScenes = new Map();
 
 console.log('Waiting for client connection on port ' + port);
 
@@ -61,6 +69,70 @@ function createSimulator(params) {
   return new STK.sim.Simulator(simParams);
 }
 
+function getSceneBytes(sceneState) {
+  // Approximate memory held by a loaded scene (geometry buffers and texture images)
+  var root = sceneState? (sceneState.fullScene || sceneState.scene) : null;
+  if (!root || !root.traverse) {
+    return 0;
+  }
+  var bytes = 0;
+  var seen = new Set();
+  root.traverse(function(node) {
+    var geometry = node.geometry;
+    if (geometry && !seen.has(geometry)) {
+      seen.add(geometry);
+      _.each(geometry.attributes, function(attribute) {
+        bytes += (attribute && attribute.array)? attribute.array.byteLength : 0;
+      });
+      if (geometry.index && geometry.index.array) {
+        bytes += geometry.index.array.byteLength;
+      }
+    }
+    var materials = node.material? (node.material.materials || node.material) : [];
+    materials = Array.isArray(materials)? materials : [materials];
+    _.each(materials, function(material) {
+      _.each(material, function(texture) {
+        if (texture && texture.isTexture && texture.image && !seen.has(texture)) {
+          seen.add(texture);
+          bytes += (texture.image.width || 0) * (texture.image.height || 0) * 4;
+        }
+      });
+    });
+  });
+  return bytes;
+}
+
+function usePreloadedScenes(sim) {
+  // Hands scenes preloaded by preload_scenes to the simulator when it loads them (on start or begin_episode)
+  var assetManager = sim.assetManager;
+  if (assetManager.__usesPreloadedScenes) {
+    return;
+  }
+  var loadScene = assetManager.loadScene.bind(assetManager);
+  assetManager.loadScene = function(sceneinfo, callback) {
+    var fullId = sceneinfo? sceneinfo.fullId : null;
+    var preloaded = fullId? preloadedScenes.get(fullId) : null;
+    if (preloaded && preloaded.sceneState) {
+      // the simulator owns (and may modify) the scene from now on
+      console.log('Using preloaded scene ' + fullId);
+      preloadedScenes.delete(fullId);
+      setTimeout(function() { callback(null, preloaded.sceneState); }, 0);
+      return;
+    }
+    return loadScene(sceneinfo, callback);
+  };
+  assetManager.__usesPreloadedScenes = true;
+}
+
+function setCachedNavmap(sim, file) {
+  // Use navigation grid previously computed by the simulator (and cached by the client) instead of recomputing
+  var grid = file? JSON.parse(fs.readFileSync(file, 'utf8')) : null;
+  sim.configure({ navmap: { grid: grid } });
+  if (file) {
+    console.log('Using cached navmap ' + file);
+  }
+}
+
 var __typedArrayToType = {
   'Int8Array': 'int8',
   'Int16Array': 'int16',
@@ -73,8 +145,43 @@ var __typedArrayToType = {
   'Float64Array': 'float64'
 };
 
-function serializeForSocketIO(data) {
+// Writes arrays into ring buffer of slots in a memory mapped file shared with the client
+// Only small control messages with offsets of the arrays are sent over the socket
+function ShmWriter(opts) {
+  this.path = opts.path;
+  this.slots = opts.slots;
+  this.slotSize = opts.slotSize;
+  this.minBytes = opts.minBytes || 0;
+  this.fd = fs.openSync(this.path, 'r+');
+  this.slot = -1;
+  this.used = 0;
+}
+
+ShmWriter.prototype.nextSlot = function() {
+  this.slot = (this.slot + 1) % this.slots;
+  this.used = 0;
+  return this.slot;
+};
+
+ShmWriter.prototype.write = function(x) {
+  // Returns location of array or undefined if array should be sent over the socket
+  var byteLength = x.byteLength;
+  if (this.slot < 0 || byteLength < this.minBytes || this.used + byteLength > this.slotSize) {
+    return;
+  }
+  var offset = this.slot * this.slotSize + this.used;
+  fs.writeSync(this.fd, Buffer.from(x.buffer, x.byteOffset, byteLength), 0, byteLength, offset);
+  this.used += Math.ceil(byteLength / 8) * 8;  // keep arrays 8 byte aligned
+  return { offset: offset, byteLength: byteLength };
+};
+
+ShmWriter.prototype.close = function() {
+  fs.closeSync(this.fd);
+};
+
+function serializeForSocketIO(data, shm) {
   // Minor serializing of data so that TypedArrays are passed in binary
+  // (or written to shared memory if shm is specified)
   if (data != undefined) {
     // TODO: Indicate endianness
     var serialized = STK.util.cloneDeepWith(data, function (x,k) {
@@ -87,6 +194,10 @@ function serializeForSocketIO(data) {
       } else if (x && x.constructor) {
         var t = __typedArrayToType[x.constructor.name];
         if (t) {
+          var location = shm? shm.write(x) : undefined;
+          if (location) {
+            return {type: 'array', datatype: t, length: x.length, shm: location};
+          }
           return {type: 'array', datatype: t, length: x.length, data: x.buffer};
         }
       }
@@ -96,12 +207,54 @@ function serializeForSocketIO(data) {
   }
 }
 
+function stackSensorFrames(frames, sensors, i, n) {
+  // Copies sensor frames of the i-th of n observations into stacked frames (first dimension is the observation)
+  // Frames are copied as sensor buffers can be reused by the next step
+  _.each(sensors, function(sensor, name) {
+    var x = sensor.data;
+    if (!x || !x.constructor || !__typedArrayToType[x.constructor.name]) {
+      return;
+    }
+    var frame = frames[name];
+    if (!frame) {
+      frame = {};
+      _.each(sensor, function(v, k) {
+        if (k !== 'data') {
+          frame[k] = v;
+        }
+      });
+      frame.shape = [n].concat(sensor.shape || [x.length]);
+      frame.data = new x.constructor(x.length * n);
+      frames[name] = frame;
+    }
+    frame.data.set(x, i * x.length);
+  });
+  return frames;
+}
+
+function quantizePose(state, positionResolution, angleResolution) {
+  // Quantized agent pose (x, y, z, angle, tilt cells) used as observation cache key
+  // Must match quantize_pose of minos/lib/util/ObservationCache.py
+  var numAngles = Math.max(1, Math.floor(2 * Math.PI / angleResolution + 0.5));
+  var angle = ((state.angle % (2 * Math.PI)) + 2 * Math.PI) % (2 * Math.PI);
+  var p = state.position;
+  return [Math.floor(p[0] / positionResolution + 0.5), Math.floor(p[1] / positionResolution + 0.5),
+          Math.floor(p[2] / positionResolution + 0.5),
+          Math.floor(angle / angleResolution + 0.5) % numAngles,
+          Math.floor((state.tilt || 0) / angleResolution + 0.5)];
+}
+
 sio.on('connection', function (socket) {
   console.log('Client ' + socket.id + ' connected on port ' + port);
+  var shm;
 
   // Predefined events
   socket.on('disconnect', function (reason) {
     console.warn('Client disconnected', reason);
+    if (shm) {
+      shm.close();
+      shm = null;
+    }
   });
 
   socket.on('error', function (err) {
@@ -110,18 +263,38 @@ sio.on('connection', function (socket) {
 
   // Custom events
   socket.on('init', function (params, respCb) {
+    if (sim && simClient !== socket.id) {
+      // server reused by a new client (e.g. leased from a server pool), start over with the client's params
+      console.log('Recreating simulator for client ' + socket.id);
+      if (!simClosed) {
+        sim.close();
+      }
+      sim = null;
+      preloadedScenes.clear();  // loaded by the asset manager of the old simulator
+    }
     if (!sim) {
       sim = createSimulator(params);
+      simClient = socket.id;
+      simClosed = false;
     }
     respCb({ status: 'OK', message: 'initialized' });
   });
 
+  socket.on('get_capabilities', function (p, respCb) {
+    respCb({ status: 'OK', data: { events: CAPABILITIES } });
+  });
+
   socket.on('start', function (params, respCb) {
     if (cmd.busywait > 0) {
       STK.util.busywait(cmd.busywait);
     }
     if (!sim) {
       sim = createSimulator(params);
+      simClient = socket.id;
+      simClosed = false;
+    }
+    if (params && params.navmap_cached_grid !== undefined) {
+      setCachedNavmap(sim, params.navmap_cached_grid);
     }
 
     STK.util.checkMemory('starting');
@@ -177,6 +350,64 @@ sio.on('connection', function (socket) {
     }
   });
 
+  // Seeds, configures, starts (or resets) and takes the first step of an episode in one round trip
+  socket.on('begin_episode', function (opts, respCb) {
+    if (!sim && !opts.start) {
+      console.error('Simulator is not initialized yet!');
+      respCb({ status: 'error', message: 'Simulator is not initialized yet!' });
+      return;
+    }
+    if (opts.start) {
+      if (cmd.busywait > 0) {
+        STK.util.busywait(cmd.busywait);
+      }
+      if (!sim) {
+        sim = createSimulator(opts.params);
+        simClient = socket.id;
+        simClosed = false;
+      }
+      if (opts.params && opts.params.navmap_cached_grid !== undefined) {
+        setCachedNavmap(sim, opts.params.navmap_cached_grid);
+      }
+    }
+    if (opts.seed != null) {
+      sim.seed(opts.seed);
+    }
+    if (opts.config) {
+      sim.configure(opts.config);
+    }
+    var begin = opts.start? sim.start.bind(sim) : sim.reset.bind(sim);
+    begin(function (err, sceneState) {
+      if (!sceneState) {
+        respCb({ status: 'error', message: err });
+        return;
+      }
+      // wait for textures to load (maybe new objects were loaded)
+      STK.util.waitImagesLoaded(function () {
+        sim.getEpisodeInfo({}, function(err, summary) {
+          if (err) {
+            respCb({ status: 'error', message: err });
+            return;
+          }
+          if (!opts.goalObservations) {
+            delete summary.goalObservations;
+          }
+          sim.step(opts.action || { name: 'idle' }, 1, function(err, data) {
+            if (err) {
+              respCb({ status: 'error', message: err });
+              return;
+            }
+            var episodeInfo = serializeForSocketIO(summary);
+            if (shm) {
+              shm.nextSlot();
+            }
+            respCb({ status: 'OK', data: { episodeInfo: episodeInfo, step: serializeForSocketIO(data, shm) } });
+          });
+        });
+      });
+    });
+  });
+
   socket.on('configure', function (opts, respCb) {
     if (sim) {
       var data = sim.configure(opts);
@@ -199,7 +430,10 @@ sio.on('connection', function (socket) {
         if (err) {
           respCb({ status: 'error', message: err });
         } else {
-          var serialized = serializeForSocketIO(data);
+          if (shm) {
+            shm.nextSlot();
+          }
+          var serialized = serializeForSocketIO(data, shm);
           if (STK.util.size(serialized) === 0) {
             console.error('Sending message with empty data: ', serialized, data);
           }
@@ -212,6 +446,198 @@ sio.on('connection', function (socket) {
     }
   });
 
+  // Takes a step like action, leaving out the frames of sensors the client has cached for the pose it predicts the
+  // agent to reach (frames are sent as usual if the agent ends up elsewhere)
+  socket.on('cached_action', function (opts, respCb) {
+    if (cmd.busywait > 0) {
+      STK.util.busywait(cmd.busywait);
+    }
+    if (!sim || !sim.isReady()) {
+      console.error('Simulator is not started yet!');
+      respCb({ status: 'error', message: 'Simulator is not started yet!' });
+      return;
+    }
+    sim.step(opts.action, 1, function(err, data) {
+      if (err) {
+        respCb({ status: 'error', message: err });
+        return;
+      }
+      var cached = opts.cached;
+      var state = data.info ? data.info.agent_state : null;
+      if (cached && state && state.position && state.angle != null && data.observation && data.observation.sensors &&
+          _.isEqual(quantizePose(state, cached.positionResolution, cached.angleResolution), cached.pose)) {
+        data.observation.sensors = _.omit(data.observation.sensors, cached.sensors);
+        data.observation.cachedSensors = cached.sensors;
+      }
+      if (shm) {
+        shm.nextSlot();
+      }
+      respCb({ status: 'OK', data: serializeForSocketIO(data, shm) });
+    });
+  });
+
+  // Takes a step for each action of a sequence in one call, returning the last step with the time, collision
+  // and measurements of every step (and the sensor frames of every step stacked if observations is 'all')
+  socket.on('action_sequence', function (opts, respCb) {
+    if (cmd.busywait > 0) {
+      STK.util.busywait(cmd.busywait);
+    }
+    if (!sim || !sim.isReady()) {
+      console.error('Simulator is not started yet!');
+      respCb({ status: 'error', message: 'Simulator is not started yet!' });
+      return;
+    }
+    var actions = opts.actions || [];
+    if (actions.length === 0) {
+      respCb({ status: 'error', message: 'No actions in action sequence' });
+      return;
+    }
+    var stackFrames = opts.observations === 'all';
+    var steps = [];
+    var frames = {};
+    function takeStep(i) {
+      sim.step(actions[i], 1, function(err, data) {
+        if (err) {
+          respCb({ status: 'error', message: err });
+          return;
+        }
+        var observation = data.observation || {};
+        steps.push({ time: observation.time, collision: observation.collision,
+                     measurements: serializeForSocketIO(observation.measurements) });
+        if (stackFrames) {
+          stackSensorFrames(frames, observation.sensors, i, actions.length);
+        }
+        if (i + 1 < actions.length) {
+          takeStep(i + 1);
+          return;
+        }
+        if (shm) {
+          shm.nextSlot();
+        }
+        if (stackFrames) {
+          // frames of the last step are only sent stacked
+          data.observation.sensors = _.omit(data.observation.sensors, _.keys(frames));
+        }
+        var serialized = serializeForSocketIO(data, shm);
+        serialized.steps = steps;
+        if (stackFrames) {
+          serialized.frames = serializeForSocketIO(frames, shm);
+        }
+        respCb({ status: 'OK', data: serialized });
+      });
+    }
+    takeStep(0);
+  });
+
+  // Renders sensor frames at each of a list of poses (position, angle, tilt) in one call, returning them stacked
+  // together with the poses the agent was moved to and the measurements and room at each pose
+  // (the agent is left at the last pose)
+  socket.on('render_poses', function (opts, respCb) {
+    if (!sim || !sim.isReady()) {
+      console.error('Simulator is not started yet!');
+      respCb({ status: 'error', message: 'Simulator is not started yet!' });
+      return;
+    }
+    var poses = opts.poses || [];
+    if (poses.length === 0) {
+      respCb({ status: 'error', message: 'No poses to render' });
+      return;
+    }
+    var agentPoses = [];
+    var steps = [];
+    var frames = {};
+    function render(i) {
+      agentPoses.push(sim.getAgent().moveTo(poses[i]));
+      sim.step({ name: 'idle' }, 1, function(err, data) {
+        if (err) {
+          respCb({ status: 'error', message: err });
+          return;
+        }
+        var observation = data.observation;
+        steps.push({ time: observation.time, collision: observation.collision,
+                     measurements: serializeForSocketIO(observation.measurements),
+                     roomInfo: serializeForSocketIO(observation.roomInfo) });
+        stackSensorFrames(frames, observation.sensors, i, poses.length);
+        if (i + 1 < poses.length) {
+          render(i + 1);
+          return;
+        }
+        if (shm) {
+          shm.nextSlot();
+        }
+        respCb({ status: 'OK', data: { poses: serializeForSocketIO(agentPoses), steps: steps,
+                                       frames: serializeForSocketIO(frames, shm) } });
+      });
+    }
+    render(0);
+  });
+
+  socket.on('set_transport', function (opts, respCb) {
+    if (shm) {
+      shm.close();
+      shm = null;
+    }
+    if (opts && opts.type === 'shm') {
+      try {
+        shm = new ShmWriter(opts);
+        console.log('Using shared memory transport at ' + opts.path);
+      } catch (err) {
+        console.error('Error opening shared memory', err);
+        respCb({ status: 'error', message: 'Error opening shared memory ' + opts.path });
+        return;
+      }
+    }
+    respCb({ status: 'OK', data: true });
+  });
+
+  socket.on('preload_scenes', function (opts, respCb) {
+    var assetManager = sim? sim.assetManager : null;
+    if (!assetManager || !assetManager.loadScene) {
+      respCb({ status: 'error', message: 'Scene preloading not supported' });
+      return;
+    }
+    usePreloadedScenes(sim);
+    var cacheSize = opts.cacheSize || opts.fullIds.length;
+    var maxMemory = opts.maxMemoryMB? opts.maxMemoryMB*1024*1024 : Infinity;
+    function evict() {
+      // evicted scenes are no longer referenced (the simulator loads scenes it did not get from us itself)
+      var preloadedBytes = 0;
+      preloadedScenes.forEach(function(preloaded) { preloadedBytes += preloaded.bytes; });
+      while (preloadedScenes.size > 0 && (preloadedScenes.size > cacheSize || preloadedBytes > maxMemory)) {
+        var oldest = preloadedScenes.keys().next().value;
+        console.log('Evicting preloaded scene ' + oldest);
+        preloadedBytes -= preloadedScenes.get(oldest).bytes;
+        preloadedScenes.delete(oldest);
+      }
+    }
+    _.each(opts.fullIds, function(fullId) {
+      if (preloadedScenes.has(fullId)) {
+        // mark as most recently used
+        var preloaded = preloadedScenes.get(fullId);
+        preloadedScenes.delete(fullId);
+        preloadedScenes.set(fullId, preloaded);
+        return;
+      }
+      var loading = { sceneState: null, bytes: 0 };
+      preloadedScenes.set(fullId, loading);
+      // load with the scene options the simulator uses so the scene can be handed to it on start
+      assetManager.loadScene(_.defaults({ fullId: fullId }, opts.sceneOptions), function(err, sceneState) {
+        if (err) {
+          console.warn('Error preloading scene ' + fullId, err);
+          if (preloadedScenes.get(fullId) === loading) {
+            preloadedScenes.delete(fullId);
+          }
+        } else if (preloadedScenes.get(fullId) === loading) {
+          loading.sceneState = sceneState;
+          loading.bytes = getSceneBytes(sceneState);
+        }
+        evict();
+      });
+    });
+    evict();
+    respCb({ status: 'OK', data: Array.from(preloadedScenes.keys()) });
+  });
+
   socket.on('move_to', function (p, respCb) {
     if (sim) {
       var data = sim.getAgent().moveTo(p);
@@ -247,6 +673,21 @@ sio.on('connection', function (socket) {
     }
   });
 
+  socket.on('get_navmap', function (p, respCb) {
+    var navscene = sim? sim.getState().navscene : null;
+    if (navscene && navscene.grid) {
+      // send as json string so client can cache it as is
+      respCb({ status: 'OK', data: JSON.stringify(navscene.grid.toJson()) });
+    } else {
+      respCb({ status: 'error', message: 'No navigation map' });
+    }
+  });
+
+  socket.on('get_memory_usage', function (p, respCb) {
+    // rss, heapTotal, heapUsed and external (in bytes) so the client can decide when to recycle us
+    respCb({ status: 'OK', data: process.memoryUsage() });
+  });
+
   socket.on('get_observation_metadata', function (p, respCb) {
     if (sim) {
       var meta = sim.getObservationMetadata();
@@ -282,6 +723,7 @@ sio.on('connection', function (socket) {
     if (!sim) { console.error('Simulator is not started yet!'); }
     console.log('Received close signal. Shutting down simulator server...');
     sim.close();
+    simClosed = true;
     console.log('Closed simulator');
     respCb({ status: 'OK', message: 'closed' });
     //sio.close();
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from minos.lib.util.TrajectoryRecorder import TrajectoryReader, TrajectoryRecorder
+
+
+def _record(path, steps, chunk_size=2):
+    recorder = TrajectoryRecorder(str(path), chunk_size=chunk_size)
+    recorder.begin_episode({'sceneId': 'test'})
+    for step in steps:
+        recorder.add_step(step)
+    recorder.close()
+    return TrajectoryReader(str(path))
+
+
+def test_sparse_field_round_trip(tmp_path):
+    # agent_state is only recorded for some steps (and not at all in the second shard)
+    steps = [{'reward': 0.5, 'agent_state': {'position': [1.0, 0.0, 2.0], 'angle': 0.5}},
+             {'reward': 0.25},
+             {'reward': 0.0},
+             {'reward': 1.0},
+             {'reward': 0.0, 'agent_state': {'position': [3.0, 0.0, 4.0], 'angle': 1.5}}]
+    episode, data = _record(tmp_path, steps).get_episode(0)
+    assert episode['info'] == {'sceneId': 'test'}
+    np.testing.assert_array_equal(data['reward'], [0.5, 0.25, 0.0, 1.0, 0.0])
+    assert 'reward#valid' not in data
+    np.testing.assert_array_equal(data['agent_state/position#valid'], [True, False, False, False, True])
+    np.testing.assert_array_equal(data['agent_state/position'],
+                                  [[1, 0, 2], [0, 0, 0], [0, 0, 0], [0, 0, 0], [3, 0, 4]])
+    assert data['agent_state/position'].dtype == np.float64
+    np.testing.assert_array_equal(data['agent_state/angle'], [0.5, 0, 0, 0, 1.5])
+
+
+def test_none_field_round_trip(tmp_path):
+    steps = [{'time': 0.1, 'collision': None, 'frame': np.ones((2, 2), dtype=np.uint8), 'room': 'kitchen'},
+             {'time': None, 'collision': False, 'frame': None, 'room': None},
+             {'time': 0.3, 'collision': True, 'frame': np.zeros((2, 2), dtype=np.uint8), 'room': 'bedroom'}]
+    _, data = _record(tmp_path, steps, chunk_size=10).get_episode(0)
+    np.testing.assert_array_equal(data['time'], [0.1, 0, 0.3])
+    np.testing.assert_array_equal(data['time#valid'], [True, False, True])
+    np.testing.assert_array_equal(data['collision'], [False, False, True])
+    np.testing.assert_array_equal(data['collision#valid'], [False, True, True])
+    assert data['frame'].dtype == np.uint8 and data['frame'].shape == (3, 2, 2)
+    np.testing.assert_array_equal(data['frame#valid'], [True, False, True])
+    np.testing.assert_array_equal(data['room'], ['kitchen', '', 'bedroom'])
+    for values in data.values():
+        assert values.dtype != object
+
+
+def test_mixed_types_rejected(tmp_path):
+    with pytest.raises(ValueError, match='mixed types'):
+        _record(tmp_path, [{'value': 1.0}, {'value': 'one'}])
+    with pytest.raises(ValueError, match='differing shapes'):
+        _record(tmp_path / 'shapes', [{'value': [1.0, 2.0]}, {'value': [1.0]}])
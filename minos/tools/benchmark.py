@@ -17,8 +17,8 @@ Timing = namedtuple('Timing', 'name secs')
 
 random.seed(12345678)
 
-def process_simulators(sims, act, repeat=1, async=False):
-    if async:
+def process_simulators(sims, act, repeat=1, use_async=False):
+    if use_async:
         with ThreadPoolExecutor(max_workers=len(sims)) as executor:
             for i in range(0,repeat):
                 futures = []
@@ -31,11 +31,11 @@ def process_simulators(sims, act, repeat=1, async=False):
             for sim in sims:
                 act(sim)
 
-def run_simulators(sims, steps, async=False):
+def run_simulators(sims, steps, use_async=False):
     def step(sim):
         action = {'name': random.choice(actions), 'strength': 1, 'angle': math.radians(15)}
         sim.step(action, 1)
-    process_simulators(sims, act=step, repeat=steps, async=async)
+    process_simulators(sims, act=step, repeat=steps, use_async=use_async)
 
 def report_times(scene_id, episode, nsteps, timings):
     line = '%s,%s,%d' % (scene_id, episode, nsteps)
@@ -50,10 +50,10 @@ def benchmark(args):
     nsteps = args.steps_per_episode
     nepisodes = args.episodes_per_scene
     nscenes = args.num_scenes or len(scene_ids)
-    async = args.async
+    use_async = args.use_async
 
     print('Benchmarking %d simulators (%s) with %d scenes, %d episodes each scene, %d steps each episode'
-          % (nsims, 'async' if async else 'sync', nscenes, nepisodes, nsteps))
+          % (nsims, 'async' if use_async else 'sync', nscenes, nepisodes, nsteps))
 
     total_secs_from_start = 0
     total_secs_from_init = 0
@@ -64,7 +64,7 @@ def benchmark(args):
     for i in range(0, nsims):
         sims.append(Simulator(vars(args)))
     common.attach_exit_handler(sims)
-    process_simulators(sims, act=lambda s: s.init(), async=async)
+    process_simulators(sims, act=lambda s: s.init(), use_async=use_async)
 
     init_time = timer()
     print('scene,episode,nsteps,secs_no_setup,fps_no_setup,secs_with_setup,fps_with_setup')
@@ -77,14 +77,14 @@ def benchmark(args):
                 sim.start()
         for i in range(0, nscenes):
             scene_id = scene_ids[i % len(scene_ids)]
-            process_simulators(sims, act=lambda s: s.set_scene(scene_dataset + '.' + scene_id), async=async)
+            process_simulators(sims, act=lambda s: s.set_scene(scene_dataset + '.' + scene_id), use_async=use_async)
             for j in range(0, nepisodes):
                 print('=== Starting/resetting simulators for scene ...' + scene_id)
                 reset_only = j > 0
-                process_simulators(sims, act=lambda s: start_sim(s, reset_only=reset_only), async=async)
+                process_simulators(sims, act=lambda s: start_sim(s, reset_only=reset_only), use_async=use_async)
                 print('=== Simulator started.')
                 start_time = timer()
-                run_simulators(sims, nsteps, async=async)
+                run_simulators(sims, nsteps, use_async=use_async)
 
                 curr_time = timer()
                 secs_from_start = curr_time - start_time
@@ -129,6 +129,7 @@ def main():
                         type=int,
                         help='Number of simulators to run')
     parser.add_argument('--async',
+                        dest='use_async',
                         action='store_true',
                         default=False,
                         help='Test simulators asynchronously')
@@ -0,0 +1,89 @@
+import argparse
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+
+from minos.lib.simdepth import simdepth
+from minos.lib.simdepth.simredwood import RedwoodDepthNoiseSim
+
+
+def make_frames(nframes, width, height, near, far, seed):
+    rand = np.random.RandomState(seed)
+    return (near + rand.rand(nframes, height, width) * (far - near)).astype(np.float32)
+
+
+def time_simulate(simulate, frames):
+    outputs = np.copy(frames)
+    start_time = timer()
+    for i in range(outputs.shape[0]):
+        simulate(outputs[i])
+    secs = timer() - start_time
+    return secs, outputs
+
+
+def summarize(frames, outputs):
+    diff = outputs - frames
+    valid = outputs != 0
+    return {
+        'mean_diff': float(np.mean(diff[valid])) if valid.any() else 0.0,
+        'std_diff': float(np.std(diff[valid])) if valid.any() else 0.0,
+        'zero_fraction': float(1.0 - np.mean(valid))
+    }
+
+
+def benchmark(args):
+    noise_sim = RedwoodDepthNoiseSim(args.model, seed=args.seed)
+    frames = make_frames(args.frames, args.width, args.height, args.near, args.far, args.seed)
+    print('Benchmarking redwood depth noise on %d frames of %dx%d' % (args.frames, args.width, args.height))
+
+    print('impl,nframes,secs,fps,mean_diff,std_diff,zero_fraction')
+    impls = [('vectorized', noise_sim.simulate)]
+    if not args.skip_reference:
+        impls.append(('per_pixel', noise_sim.simulate_per_pixel))
+    for name, simulate in impls:
+        secs, outputs = time_simulate(simulate, frames)
+        stats = summarize(frames, outputs)
+        print('%s,%d,%f,%f,%f,%f,%f' % (name, args.frames, secs, args.frames / secs,
+                                         stats['mean_diff'], stats['std_diff'], stats['zero_fraction']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarking the redwood depth noise simulator')
+    parser.add_argument('--model',
+                        default=os.path.join(os.path.dirname(simdepth.__file__), 'dist-model.txt'),
+                        help='Distortion model file')
+    parser.add_argument('--frames',
+                        default=10,
+                        type=int,
+                        help='Number of depth frames to process')
+    parser.add_argument('--width',
+                        default=320,
+                        type=int,
+                        help='Depth frame width')
+    parser.add_argument('--height',
+                        default=320,
+                        type=int,
+                        help='Depth frame height')
+    parser.add_argument('--near',
+                        default=0.5,
+                        type=float,
+                        help='Minimum depth (in meters) of synthetic frames')
+    parser.add_argument('--far',
+                        default=4.0,
+                        type=float,
+                        help='Maximum depth (in meters) of synthetic frames')
+    parser.add_argument('--seed',
+                        default=12345678,
+                        type=int,
+                        help='Random seed')
+    parser.add_argument('--skip_reference',
+                        action='store_true',
+                        default=False,
+                        help='Skip the slow per pixel reference implementation')
+    args = parser.parse_args()
+    benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import argparse
+import collections
+import copy
+import json
+import math
+import multiprocessing as mp
+import os
+import platform
+import random
+import subprocess as sp
+import traceback
+from datetime import datetime
+from timeit import default_timer as timer
+
+import numpy as np
+
+from minos.config.sim_args import parse_sim_args
+from minos.lib import common
+from minos.lib.RoomSimulator import RoomSimulator
+from minos.lib.Simulator import Simulator
+from minos.lib.VectorRoomSimulator import VectorRoomSimulator
+
+actions = ['forwards', 'backwards', 'turnLeft', 'turnRight', 'strafeLeft', 'strafeRight', 'lookUp', 'lookDown', 'idle']
+
+# Observation flags enabled by each sensor scenario (in addition to color)
+SENSOR_OBSERVATIONS = collections.OrderedDict([
+    ('none', {}),
+    ('depth', {'depth': True}),
+    ('normal', {'normal': True}),
+    ('semantic', {'objectId': True}),
+    ('audio', {'audio': True}),
+    ('map', {'map': True})
+])
+
+DEPTH_NOISE_MODELS = collections.OrderedDict([
+    ('simple', {'type': 'simple', 'clip': [0.5, 4], 'noise': ['gaussian', 0, 0.01]}),
+    ('redwood', {'type': 'redwood', 'path': '${SIMDEPTH_DIR}/dist-model.txt'})
+])
+
+
+def random_action():
+    return {'name': random.choice(actions), 'strength': 1, 'angle': math.radians(15)}
+
+
+def summarize(timings, frames_per_op=1):
+    """Summary statistics (in seconds) of timings of operations"""
+    t = np.asarray(timings, dtype=np.float64)
+    if t.size == 0:
+        return {'count': 0}
+    total = float(np.sum(t))
+    return {
+        'count': int(t.size),
+        'total_secs': total,
+        'mean_secs': float(np.mean(t)),
+        'std_secs': float(np.std(t)),
+        'min_secs': float(np.min(t)),
+        'max_secs': float(np.max(t)),
+        'p50_secs': float(np.percentile(t, 50)),
+        'p90_secs': float(np.percentile(t, 90)),
+        'p99_secs': float(np.percentile(t, 99)),
+        'fps': t.size * frames_per_op / total if total > 0 else None
+    }
+
+
+def get_metadata(args):
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    try:
+        git_hash = sp.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True,
+                                   cwd=script_path).strip()
+    except (sp.CalledProcessError, OSError):
+        git_hash = None
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'machine': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': mp.cpu_count(),
+        'git_hash': git_hash,
+        'sim_server': args.get('sim_server') or 'node',
+        'mock': args.get('mock'),
+        'transport': args.get('transport'),
+        'decode_mode': args.get('decode_mode'),
+        'env_config': args.get('env_config'),
+        'width': args.width,
+        'height': args.height,
+        'steps': args.steps,
+        'repeats': args.repeats
+    }
+
+
+def create_simulator(params):
+    sim = Simulator(params)
+    common.attach_exit_handler(sim)
+    sim.init()
+    sim.seed(random.randint(0, 12345678))
+    return sim
+
+
+def start_scene(sim, params, scene_id):
+    sim.set_scene(params['scene']['dataset'] + '.' + scene_id)
+    return sim.start()
+
+
+def scenario_cold_scene_load(params, args):
+    """Time to start each scene in a fresh simulator"""
+    timings = []
+    for i in range(args.repeats):
+        scene_id = args.scene_ids[i % len(args.scene_ids)]
+        sim = create_simulator(params)
+        start_time = timer()
+        start_scene(sim, params, scene_id)
+        timings.append(timer() - start_time)
+        sim.kill()
+    return {'timings': timings}
+
+
+def scenario_reset_only(params, args):
+    """Time to reset episodes in the same scene"""
+    sim = create_simulator(params)
+    start_scene(sim, params, args.scene_ids[0])
+    timings = []
+    for i in range(args.repeats):
+        start_time = timer()
+        sim.reset()
+        timings.append(timer() - start_time)
+    latency = sim.get_latency_stats()
+    sim.kill()
+    return {'timings': timings, 'latency': latency}
+
+
+def scenario_steps(params, args):
+    """Time of simulator steps with random actions"""
+    sim = create_simulator(params)
+    start_scene(sim, params, args.scene_ids[0])
+    timings = []
+    for i in range(args.steps):
+        action = random_action()
+        start_time = timer()
+        sim.step(action, 1)
+        timings.append(timer() - start_time)
+    latency = sim.get_latency_stats()
+    sim.kill()
+    return {'timings': timings, 'latency': latency}
+
+
+def scenario_room_simulator(params, args):
+    """Time of RoomSimulator steps (with measures and rewards)"""
+    sim = RoomSimulator(params)
+    sim.init()
+    num_actions = len(sim.available_controls)
+    timings = []
+    for i in range(args.steps):
+        action = [False] * num_actions
+        action[random.randrange(num_actions)] = True
+        start_time = timer()
+        sim.step(action)
+        timings.append(timer() - start_time)
+    latency = sim.sim.get_latency_stats()
+    sim.close_game()
+    return {'timings': timings, 'latency': latency}
+
+
+def scenario_scaling(params, args):
+    """Time of stepping several RoomSimulators (in separate processes) together"""
+    sims = VectorRoomSimulator(params)
+    sims.reset()
+    num_actions = len(params.get('available_controls', ['turnLeft', 'turnRight', 'forwards']))
+    timings = []
+    for i in range(args.steps):
+        step_actions = []
+        for j in range(sims.num_simulators):
+            action = [False] * num_actions
+            action[random.randrange(num_actions)] = True
+            step_actions.append(action)
+        start_time = timer()
+        sims.step(step_actions)
+        timings.append(timer() - start_time)
+    sims.close()
+    return {'timings': timings, 'frames_per_op': sims.num_simulators}
+
+
+def get_scenarios(args):
+    """Returns dictionary of scenario name to (function, parameter overrides)"""
+    color_only = {k: False for k in ['depth', 'normal', 'objectId', 'objectType', 'roomId', 'roomType',
+                                     'audio', 'forces', 'map']}
+    color_only['color'] = True
+    scenarios = collections.OrderedDict()
+    scenarios['cold_scene_load'] = (scenario_cold_scene_load, {})
+    scenarios['reset_only'] = (scenario_reset_only, {})
+    for resolution in args.resolutions:
+        w, h = [int(x) for x in resolution.split('x')]
+        scenarios['step_%dx%d' % (w, h)] = (scenario_steps, {'width': w, 'height': h, 'resolution': (w, h),
+                                                             'observations': color_only})
+    for name, observations in SENSOR_OBSERVATIONS.items():
+        scenarios['sensor_' + name] = (scenario_steps, {'observations': dict(color_only, **observations)})
+    for name, noise_model in DEPTH_NOISE_MODELS.items():
+        scenarios['depth_noise_' + name] = (scenario_steps, {
+            'observations': dict(color_only, depth=True),
+            'sensors': [{'name': 'depth', 'noise': True, 'noise_model': noise_model}]})
+    scenarios['room_simulator'] = (scenario_room_simulator, {})
+    for n in args.scaling:
+        scenarios['scaling_%d' % n] = (scenario_scaling, {'num_simulators': n})
+    return scenarios
+
+
+def run(args):
+    scenarios = get_scenarios(args)
+    selected = args.scenarios or list(scenarios.keys())
+    unknown = [name for name in selected if name not in scenarios]
+    if len(unknown) > 0:
+        raise ValueError('Unknown scenarios %s (available: %s)' % (','.join(unknown), ','.join(scenarios.keys())))
+
+    results = {'metadata': get_metadata(args), 'scenarios': collections.OrderedDict()}
+    base_params = {k: v for k, v in args.items() if k not in ['scenarios', 'output', 'resolutions', 'scaling']}
+    for name in selected:
+        fn, overrides = scenarios[name]
+        params = copy.deepcopy(base_params)
+        params.update(copy.deepcopy(overrides))
+        params['id'] = 'bench_' + name
+        params['logdir'] = os.path.join(args.logdir, name)
+        print('=== Running scenario %s' % name)
+        try:
+            res = fn(params, args)
+            summary = summarize(res['timings'], res.get('frames_per_op', 1))
+            result = {'summary': summary, 'overrides': overrides}
+            if 'latency' in res:
+                result['latency'] = res['latency']
+            print('%s: %d ops, mean %.3f ms, p90 %.3f ms, %s fps' %
+                  (name, summary['count'], summary.get('mean_secs', 0) * 1000, summary.get('p90_secs', 0) * 1000,
+                   '%.1f' % summary['fps'] if summary.get('fps') else '-'))
+        except Exception:
+            traceback.print_exc()
+            result = {'error': traceback.format_exc(), 'overrides': overrides}
+        results['scenarios'][name] = result
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print('Wrote results to ' + args.output)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite for the simulator (named scenarios with JSON output)')
+    parser.add_argument('--scenarios',
+                        nargs='*',
+                        help='Scenarios to run (all by default)')
+    parser.add_argument('--steps',
+                        default=500,
+                        type=int,
+                        help='Number of steps for step scenarios')
+    parser.add_argument('--repeats',
+                        default=5,
+                        type=int,
+                        help='Number of scene loads or resets for load/reset scenarios')
+    parser.add_argument('--resolutions',
+                        nargs='*',
+                        default=['84x84', '128x128', '256x256'],
+                        help='Resolutions (WxH) for step scenarios')
+    parser.add_argument('--scaling',
+                        nargs='*',
+                        type=int,
+                        default=[1, 2, 4],
+                        help='Number of simulators for scaling scenarios')
+    parser.add_argument('--output',
+                        default='benchmark.json',
+                        help='JSON file to write results to')
+    parser.add_argument('--logdir',
+                        help='Directory for simulator logs (one subdirectory per scenario)')
+    args = parse_sim_args(parser)
+    if not args.logdir:
+        args.logdir = os.path.join('logs', 'benchmark_' + datetime.now().strftime('%Y%m%d-%H%M%S'))
+    random.seed(12345678)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+from timeit import default_timer as timer
+
+from minos.config.sim_args import parse_sim_args
+from minos.lib import common
+from minos.lib.Simulator import Simulator
+from minos.lib.util.ObservationStore import STORE_FILE, build_observation_store, get_num_headings
+
+
+def run(args):
+    sim = Simulator(vars(args))
+    common.attach_exit_handler(sim)
+    sim.init()
+    num_headings = args.get('num_headings') or get_num_headings(sim.params.get('agent'))
+    for scene_id in args.scene_ids:
+        full_id = args.scene.dataset + '.' + scene_id
+        path = os.path.join(args.output, full_id)
+        if os.path.isfile(os.path.join(path, STORE_FILE)) and not args.overwrite:
+            print('Skipping scene %s (observation store %s exists)' % (full_id, path))
+            continue
+        start_time = timer()
+        sim.configure({'scene': {'fullId': full_id, 'level': args.level}})
+        episode_info = sim.start()
+        if not episode_info:
+            print('Error starting scene %s' % full_id)
+            continue
+        try:
+            num_cells = build_observation_store(sim, path, episode_info, cell_size=args.cell_size,
+                                                num_headings=num_headings, max_cells=args.get('max_cells'),
+                                                chunk_size=args.chunk_size)
+        except RuntimeError as e:
+            print('Error building observation store for scene %s: %s' % (full_id, e))
+            continue
+        print('Built observation store for scene %s with %d cells, %d headings in %.1f secs'
+              % (full_id, num_cells, num_headings, timer() - start_time))
+    sim.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-render observations of gridworld agents at every reachable '
+                                                 'cell and heading of scenes into observation stores')
+    parser.add_argument('--output',
+                        required=True,
+                        help='Directory to write observation stores to (one subdirectory per scene)')
+    parser.add_argument('--cell_size',
+                        default=0.5,
+                        type=float,
+                        help='Distance between cells (in meters)')
+    parser.add_argument('--num_headings',
+                        type=int,
+                        help='Number of agent headings (default from angular resolution of agent config)')
+    parser.add_argument('--level',
+                        default=0,
+                        type=int,
+                        help='Scene level to render')
+    parser.add_argument('--max_cells',
+                        type=int,
+                        help='Maximum number of cells per scene')
+    parser.add_argument('--chunk_size',
+                        default=64,
+                        type=int,
+                        help='Number of poses to render per call')
+    parser.add_argument('--overwrite',
+                        action='store_true',
+                        default=False,
+                        help='Rebuild existing observation stores')
+    args = parse_sim_args(parser)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 import argparse
-from easydict import EasyDict as edict
-import random
+import copy
+import json
 import math
+import multiprocessing as mp
+import os
+import queue
+import random
+import traceback
+
+from easydict import EasyDict as edict
 
 from minos.config.sim_args import parse_sim_args
 from minos.lib import common
@@ -9,38 +16,113 @@ from minos.lib.Simulator import Simulator
 
 random.seed(12345678)
 
-EPISODE_ID = 0
+WORKER_POLL_SECS = 5  # seconds to wait for worker results before checking that workers are still alive
 
+HEADER = ['episodeId', 'task', 'sceneId', 'level',
+          'startX', 'startY', 'startZ', 'startAngle', 'startTilt',
+          'goalRoomId', 'goalRoomType', 'goalObjectId', 'goalObjectType',
+          'goalX', 'goalY', 'goalZ', 'goalAngle', 'goalTilt',
+          'dist', 'pathDist', 'pathNumDoors', 'pathDoorIds',
+          'pathNumRooms', 'pathRoomIndices']
 
-def process_scene(sim, dataset, scene_id, f, level, num_levels, n_episodes, scene_counter=0):
-    if scene_counter == 0:
-        header = ['episodeId', 'task', 'sceneId', 'level',
-                  'startX', 'startY', 'startZ', 'startAngle', 'startTilt',
-                  'goalRoomId', 'goalRoomType', 'goalObjectId', 'goalObjectType',
-                  'goalX', 'goalY', 'goalZ', 'goalAngle', 'goalTilt',
-                  'dist', 'pathDist', 'pathNumDoors', 'pathDoorIds',
-                  'pathNumRooms', 'pathRoomIndices']
-        f.write(','.join(header) + '\n')
 
+def process_scene(sim, dataset, scene_id, level, num_levels, n_episodes):
+    """Samples episodes for scene.  Returns list of (level, scene data) for sampled episodes"""
     sim.set_scene(dataset + '.' + scene_id)
-    if level >= 0:  # do one level
-        sim.configure({'scene': {'level': level}})
+    levels = [level] if level >= 0 else range(0, num_levels)  # do one level or all levels
+    samples = []
+    for i_level in levels:
+        sim.configure({'scene': {'level': i_level}})
         for j in range(0, n_episodes):
             if j > 0:
                 sim.reset()
             else:
                 sim.start()
-            write_configuration(f, edict(sim.get_scene_data()['data']), level)
-    else:  # do all levels
-        for i_level in range(0, num_levels):
-            sim.configure({'scene': {'level': i_level}})
-            for j in range(0, n_episodes):
-                if j > 0:
-                    sim.reset()
-                else:
-                    sim.start()
-                scene_data = edict(sim.get_scene_data()['data'])
-                write_configuration(f, scene_data, i_level)
+            samples.append((i_level, sim.get_scene_data()['data']))
+    return samples
+
+
+class EpisodeWriter:
+    """ Single writer of sampled episodes assigning globally unique episode ids
+
+    Rows are written one scene at a time.  After each scene, a checkpoint with the completed scenes,
+    next episode id and size of the output file is saved so generation can be resumed.
+    """
+    def __init__(self, output, resume=False):
+        self.output = output
+        self.checkpoint_file = output + '.checkpoint.json'
+        self.completed_scenes = set()
+        self.episode_id = 0
+        checkpoint = None
+        if resume and os.path.isfile(self.checkpoint_file) and os.path.isfile(output):
+            with open(self.checkpoint_file) as f:
+                checkpoint = json.load(f)
+        if checkpoint is not None:
+            self.completed_scenes = set(checkpoint['completed_scenes'])
+            self.episode_id = checkpoint['episode_id']
+            self.f = open(output, 'r+')
+            self.f.truncate(checkpoint['output_size'])  # drop rows of scene that was not completed
+            self.f.seek(checkpoint['output_size'])
+            print('Resuming from checkpoint with %d completed scenes' % len(self.completed_scenes))
+        else:
+            self.f = open(output, 'w')
+            self.f.write(','.join(HEADER) + '\n')
+            self._save_checkpoint()
+
+    def write_scene(self, scene_id, samples):
+        for level, scene_data in samples:
+            write_configuration(self.f, edict(scene_data), level, self.episode_id)
+            self.episode_id += 1
+        self.completed_scenes.add(scene_id)
+        self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        checkpoint = {'completed_scenes': sorted(self.completed_scenes), 'episode_id': self.episode_id,
+                      'output_size': self.f.tell()}
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def close(self):
+        self.f.close()
+
+
+def create_simulator(params, seed):
+    sim = Simulator(params)
+    common.attach_exit_handler(sim)
+    sim.init()
+    sim.seed(seed)
+    return sim
+
+
+def _worker(index, params, seed, scene_queue, result_queue):
+    """Samples scenes from scene_queue, sending ('scene', index, scene_id) when starting a scene,
+    ('result', index, scene_id, samples, error) when done with it and ('done', index) when exiting"""
+    args = edict(params)
+    sim = None
+    try:
+        sim = create_simulator(params, seed)
+        while True:
+            scene_id = scene_queue.get()
+            if scene_id is None:
+                break
+            result_queue.put(('scene', index, scene_id))
+            try:
+                samples = process_scene(sim, args.scene.dataset, scene_id, args.level, args.num_levels,
+                                        args.samples_per_scene)
+                result_queue.put(('result', index, scene_id, samples, None))
+            except Exception:
+                result_queue.put(('result', index, scene_id, None, traceback.format_exc()))
+    finally:
+        try:
+            if sim is not None:
+                sim.close()
+                sim.kill()
+        finally:
+            result_queue.put(('done', index))
 
 
 def run(args):
@@ -50,20 +132,70 @@ def run(args):
     else:
         scene_ids = args.scene_ids
 
-    sim = Simulator(vars(args))
-    common.attach_exit_handler(sim)
-    sim.init()
-    sim.seed(random.randint(0, 12345678))
-
-    f = open(args.output, 'w')
-    n_scenes = len(scene_ids)
-    for i in range(0, n_scenes):
-        process_scene(sim, args.scene.dataset, scene_ids[i], f, args.level, args.num_levels,
-                      args.samples_per_scene, i)
+    writer = EpisodeWriter(args.output, resume=args.resume)
+    scene_ids = [scene_id for scene_id in scene_ids if scene_id not in writer.completed_scenes]
+    n_scenes = len(writer.completed_scenes) + len(scene_ids)
+    seed = random.randint(0, 12345678)
+    if args.num_workers <= 1:
+        sim = create_simulator(vars(args), seed)
+        for scene_id in scene_ids:
+            samples = process_scene(sim, args.scene.dataset, scene_id, args.level, args.num_levels,
+                                    args.samples_per_scene)
+            writer.write_scene(scene_id, samples)
+    else:
+        # Scenes are handed out to simulators in worker processes, sampled episodes sent back to writer
+        scene_queue = mp.Queue()
+        result_queue = mp.Queue()
+        for scene_id in scene_ids:
+            scene_queue.put(scene_id)
+        workers = []
+        logdir = args.get('logdir', 'logs')
+        for i in range(args.num_workers):
+            scene_queue.put(None)
+            params = copy.copy(vars(args))
+            params['id'] = 'sim%02d' % i
+            params['port'] = None
+            params['logdir'] = os.path.join(logdir, params['id'])
+            worker = mp.Process(target=_worker, args=(i, params, seed + i, scene_queue, result_queue))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        running = set(range(len(workers)))
+        current_scenes = {}  # worker index to scene it is sampling
+        while len(running) > 0:
+            try:
+                result = result_queue.get(timeout=WORKER_POLL_SECS)
+            except queue.Empty:
+                # workers that died without saying they are done (e.g. killed) are finished
+                for i in [i for i in running if not workers[i].is_alive()]:
+                    running.discard(i)
+                    scene_id = current_scenes.pop(i, None)
+                    print('Worker %d exited with code %s%s' % (i, workers[i].exitcode,
+                                                              ' while sampling scene ' + scene_id if scene_id else ''))
+                continue
+            kind, i = result[0], result[1]
+            if kind == 'done':
+                running.discard(i)
+            elif kind == 'scene':
+                current_scenes[i] = result[2]
+            else:
+                scene_id, samples, error = result[2:]
+                current_scenes.pop(i, None)
+                if error is not None:
+                    print('Error sampling scene %s: %s' % (scene_id, error))
+                else:
+                    writer.write_scene(scene_id, samples)
+                    print('Completed scene %s (%d/%d)' % (scene_id, len(writer.completed_scenes), n_scenes))
+        for worker in workers:
+            worker.join()
+        # scenes that failed, or were never sampled because their workers died
+        failed = [scene_id for scene_id in scene_ids if scene_id not in writer.completed_scenes]
+        if len(failed) > 0:
+            print('Failed to sample %d scenes (rerun with --resume to retry): %s' % (len(failed), ','.join(failed)))
+    writer.close()
 
 
-def write_configuration(f, c, level):
-    global EPISODE_ID
+def write_configuration(f, c, level, episode_id):
     scene_id = c.sceneId.split('.')[1]
     task = c.task
     s = c.start
@@ -90,13 +222,12 @@ def write_configuration(f, c, level):
     path_rooms = path.rooms if valid_path else []
     dist = math.sqrt((sp[0] - gp[0])**2 + (sp[1] - gp[1])**2 + (sp[2] - gp[2])**2)
     p = '.3f'  # precision for floats
-    f.write(f'{EPISODE_ID},{task[0]},{scene_id},{level:d},'
+    f.write(f'{episode_id},{task[0]},{scene_id},{level:d},'
         f'{sp[0]:{p}},{sp[1]:{p}},{sp[2]:{p}},{sangle:{p}},{stilt:.0f},'  # NOTE lower precision on stilt since always 0
         f'{groomid},{groomtype},{gid},{gobjecttype},'
         f'{gp[0]:{p}},{gp[1]:{p}},{gp[2]:{p}},{gangle:.0f},{gtilt:.0f},'  # NOTE lower precision on gangle and gtilt since always 0
         f'{dist:{p}},{path_dist:{p}},{len(path_doors):d},{":".join(path_doors)},'
         f'{len(path_rooms):d},{":".join(str(r) for r in path_rooms)}\n')
-    EPISODE_ID += 1
 
 
 def main():
@@ -138,6 +269,14 @@ def main():
     parser.add_argument('--output',
                         required=True,
                         help='Output states file to write sampled episode states')
+    parser.add_argument('--num_workers',
+                        default=1,
+                        type=int,
+                        help='Number of simulators (in separate processes) to sample scenes with')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        default=False,
+                        help='Resume from checkpoint of output file (skipping completed scenes)')
     args = parse_sim_args(parser)
 
     # args for simulator consumption
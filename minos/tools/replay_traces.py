@@ -0,0 +1,75 @@
+import argparse
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+
+from minos.config.sim_args import parse_sim_args
+from minos.lib import common
+from minos.lib.Simulator import Simulator
+from minos.lib.util.ActionTraces import iter_action_traces
+from minos.lib.util.TraceReplayer import TraceReplayer
+from minos.lib.util.TrajectoryRecorder import TrajectoryRecorder
+
+
+def run(args):
+    sim = Simulator(vars(args))
+    common.attach_exit_handler(sim)
+    sim.init()
+    replayer = TraceReplayer(sim, mode=args.replay_mode, sequence_length=args.sequence_length)
+    recorder = TrajectoryRecorder(args.output, chunk_size=args.chunk_size)
+    num_steps = 0
+    start_time = timer()
+    for i, trace in enumerate(iter_action_traces(args.traces)):
+        if args.get('max_traces') is not None and i >= args.max_traces:
+            break
+        recorder.begin_episode({'episode': trace.episode, 'sceneId': trace.sceneId, 'task': trace.task,
+                                'start': trace.start, 'goals': trace.goals})
+        for rec, response in replayer.replay(trace):
+            if response is None:
+                print('No observation for tick %s of episode %s' % (rec['tick'], trace.episode))
+                continue
+            observation = response['observation']
+            sensors = {name: np.array(sensor_data['data']) for name, sensor_data in observation['sensors'].items()}
+            recorder.add_step({'tick': rec['tick'], 'actions': rec['actions'],
+                               'pose': [rec['px'], rec['py'], rec['pz'], rec['rotation']],
+                               'sensors': sensors, 'collision': observation.get('collision')})
+            num_steps += 1
+        recorder.end_episode()
+        elapsed = timer() - start_time
+        print('Replayed episode %s in scene %s (%d steps total, %.1f steps/s)'
+              % (trace.episode, trace.sceneId, num_steps, num_steps / elapsed if elapsed > 0 else 0))
+    recorder.close()
+    sim.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate observations for recorded action traces')
+    parser.add_argument('--traces',
+                        required=True,
+                        help='Action traces file (csv, or npz converted with minos.lib.util.ActionTraces)')
+    parser.add_argument('--replay_mode',
+                        choices=TraceReplayer.MODES,
+                        default='actions',
+                        help='Simulate recorded actions, or render recorded positions')
+    parser.add_argument('--sequence_length',
+                        default=16,
+                        type=int,
+                        help='Number of recorded actions to simulate (or positions to render) per call')
+    parser.add_argument('--max_traces',
+                        type=int,
+                        help='Maximum number of traces to replay')
+    parser.add_argument('--chunk_size',
+                        default=1000,
+                        type=int,
+                        help='Number of steps per output shard')
+    parser.add_argument('--output',
+                        required=True,
+                        help='Directory to write regenerated observations to')
+    args = parse_sim_args(parser)
+    os.makedirs(args.output, exist_ok=True)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()